@@ -1,17 +1,30 @@
 import streamlit as st
 import os
-import platform
-import subprocess
+import datetime
+import tempfile
+from contextlib import contextmanager, nullcontext
 from utils.custom_script import CustomScriptManager
 from utils.agentlist import ClientManager
+from utils.endpoint_inventory import EndpointInventory
 from utils.run_custom_script import RunCustomScriptManager
 from utils.collect_file import CollectFileManager
 from utils.download_task import TaskDownloader
+from utils.task_pipeline import DEFAULT_MAX_WAIT, TaskPipeline
 from utils.yara_rule_list import YaraRuleManager
 from utils.yara_rule_run import YaraScanManager
+from utils.yara_scan_matrix import YaraScanMatrixManager
 from utils.config_manager import ConfigManager
+from utils.async_api_client import run_async, DEFAULT_CONCURRENCY
+from utils.multi_status import DEFAULT_CHUNK_SIZE
+from utils.target_ingest import TargetLimitError
+from utils.target_resolver import parse_agent_targets
+from utils.target_query import QUERY_EXAMPLE, QueryError, select_endpoints
+from utils.records import EndpointRecord, TaskRecord, records_to_frame, results_to_frame
+from utils.log import setup_logging
 from streamlit_option_menu import option_menu
 
+setup_logging()
+
 st.set_page_config(page_title="Vision One 工具", layout="wide")
 st.title("Trend Micro Vision One 工具")
 
@@ -33,10 +46,12 @@ with st.sidebar:
             "更新 Custom Script",
             "批次執行 Custom Script",
             "執行 YARA 掃描",
+            "YARA 掃描矩陣",
             "批次收集檔案",
             "下載並解壓縮檔案",
             "檢查 Task ID 狀態",
             "持續監控所有 Task 狀態（Web 介面）",
+            "多 Tenant 總覽與批次執行",
             "⚙️ 設定與 Tenant 切換",
             "關於本工具"
         ],
@@ -44,12 +59,74 @@ with st.sidebar:
             "file-earmark-code",
             "shield-check",
             "people", "play", "upload",
-            "layers", "bug", "cloud-arrow-down", "archive", "search", "list-check", "gear", "info-circle"
+            "layers", "bug", "grid-3x3", "cloud-arrow-down", "archive", "search", "list-check", "diagram-3", "gear", "info-circle"
         ],
         menu_icon="tools",
         default_index=0
     )
 
+TARGET_MODES = ["上傳 txt 檔案", "查詢條件"]
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_select_endpoints(query, server_side, tenant_name):
+    return select_endpoints(query, tenant_name, server_side)
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_parse_agent_targets(text, tenant_name):
+    # 以輸入文字為鍵快取，避免每次重新執行頁面都解析名稱 / IP 並同步 Endpoint 清單
+    return parse_agent_targets(text, tenant_name)
+
+
+@contextmanager
+def uploaded_file(file, suffix):
+    """將上傳的檔案寫入唯一的暫存檔並回傳路徑（多個 Session 同時上傳不會互相覆蓋），離開 with 區塊時刪除"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(file.getvalue())
+    try:
+        yield tmp.name
+    finally:
+        os.remove(tmp.name)
+
+
+def agent_targets_input(label, key=None):
+    """輸入 Agent GUID、Endpoint 名稱或 IP 清單並顯示解析結果，回傳 Agent GUID 列表"""
+    text = st.text_area(label, key=key)
+    try:
+        agent_guids, report = cached_parse_agent_targets(text, active_tenant)
+    except TargetLimitError as e:
+        st.error(f"❌ {e}")
+        return []
+    if report.accepted:
+        st.caption(report.summary())
+    if report.rejected_samples or report.unresolved_samples:
+        st.warning("\n".join(
+            [f"第 {no} 行（格式錯誤）：{line}" for no, line, _ in report.rejected_samples]
+            + [f"第 {no} 行（找不到對應的 Endpoint）：{line}" for no, line in report.unresolved_samples]
+        ))
+    return agent_guids
+
+
+def query_target_input(key):
+    """輸入查詢條件並預覽符合的 Endpoint，回傳 Agent GUID 列表"""
+    query = st.text_input(f"查詢條件（例如 {QUERY_EXAMPLE}）", key=f"{key}_query")
+    server_side = st.checkbox("條件可轉換時直接向 API 查詢（否則使用本機 Endpoint 清單）", value=True,
+                              key=f"{key}_server_side")
+    if not query.strip():
+        return []
+    try:
+        endpoints, source = cached_select_endpoints(query, server_side, active_tenant)
+    except QueryError as e:
+        st.error(f"查詢條件錯誤：{e}")
+        return []
+
+    st.caption(f"符合 {len(endpoints)} 台 Agent（{'API' if source == 'server' else '本機 Endpoint 清單'}）")
+    if endpoints:
+        st.dataframe(records_to_frame(endpoints[:1000], EndpointRecord))
+    return sorted({e.agent_guid for e in endpoints})
+
+
 if option == "列出 Custom Scripts":
     with st.expander("1. 列出 Custom Scripts", expanded=True):
         st.subheader("Custom Script 清單")
@@ -87,34 +164,42 @@ elif option == "列出所有 Clients（包含 EDR Sensor 狀態）":
     with st.expander("2. 列出所有 Clients（包含 EDR Sensor 狀態）", expanded=True):
         st.subheader("Client 清單")
         manager = ClientManager()
-        if "agents_data" not in st.session_state:
-            st.session_state.agents_data = []
-
-        if st.button("執行功能"):
-            agents = manager.list_all_clients()
-            st.session_state.agents_data = agents
-            if agents:
-                table_data = []
-                for agent in agents:
-                    table_data.append({
-                        "Endpoint Name": agent.get("endpointName", "未知"),
-                        "Agent GUID": agent.get("agentGuid", ""),
-                        "IP": agent.get("lastUsedIp", ""),
-                        "OS": agent.get("osName", ""),
-                        "EDR Sensor": agent.get("edrSensor", {}).get("connectivity", "Disconnected")
-                    })
-                import pandas as pd
-                df = pd.DataFrame(table_data)
-                st.dataframe(df)
+        inventory = EndpointInventory()
+        try:
+            state = inventory.sync_state()
+            if state and state["last_sync"]:
+                last_sync = datetime.datetime.fromtimestamp(state["last_sync"]).strftime("%Y-%m-%d %H:%M:%S")
+                st.caption(f"本機清單：{inventory.count()} 筆，最後同步時間 {last_sync}")
             else:
-                st.warning("❌ 沒有找到任何 Client")
+                st.caption("本機清單尚未同步，第一次查詢會完整同步")
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("增量同步"):
+                    with st.spinner("同步中..."):
+                        st.write(inventory.sync())
+            with col2:
+                if st.button("完整同步"):
+                    with st.spinner("同步中..."):
+                        st.write(inventory.sync(full=True))
+
+            if st.button("執行功能"):
+                inventory.ensure_fresh()
+                agents = inventory.list_records()
+                if agents:
+                    st.dataframe(records_to_frame(agents, EndpointRecord))
+                else:
+                    st.warning("❌ 沒有找到任何 Client")
 
-        if st.button("匯出 CSV"):
-            if st.session_state.agents_data:
-                manager.export_to_csv(st.session_state.agents_data)
-                st.success("已匯出 CSV（請查看本機路徑）")
-            else:
-                st.warning("尚未執行查詢或沒有資料可匯出")
+            if st.button("匯出 CSV"):
+                agents = inventory.list_endpoints()
+                if agents:
+                    manager.export_to_csv(agents)
+                    st.success("已匯出 CSV（請查看本機路徑）")
+                else:
+                    st.warning("尚未執行查詢或沒有資料可匯出")
+        finally:
+            inventory.close()
 
 elif option == "執行單一 Custom Script":
     with st.expander("3. 執行單一 Custom Script", expanded=True):
@@ -158,34 +243,59 @@ elif option == "更新 Custom Script":
 elif option == "批次執行 Custom Script":
     with st.expander("5. 批次執行 Custom Script", expanded=True):
         st.subheader("批次執行 Custom Script")
-        file = st.file_uploader("上傳包含 Agent GUID 的 txt 檔案", type="txt")
+        target_mode = st.radio("目標來源", TARGET_MODES, horizontal=True, key="script_target_mode")
+        if target_mode == TARGET_MODES[0]:
+            file = st.file_uploader("上傳包含 Agent GUID 的 txt 檔案", type="txt")
+        else:
+            file, query_guids = None, query_target_input("script")
         script_manager = CustomScriptManager()
         scripts = script_manager.list_custom_scripts()
         script_names = [s.get("fileName", "未知 Script") for s in scripts] if scripts else []
         script_name = st.selectbox("Script 檔案名稱", script_names)
         params = st.text_input("腳本參數（powershell or bash）", "")
+        col1, col2 = st.columns(2)
+        with col1:
+            concurrency = st.number_input("同時送出的批次數", min_value=1, max_value=100, value=DEFAULT_CONCURRENCY)
+        with col2:
+            chunk_size = st.number_input("每批 Agent 數", min_value=1, max_value=500, value=DEFAULT_CHUNK_SIZE)
+        preflight = st.checkbox("只下發給在線的 Agent（離線的 Agent 寫入延後清單）", key="script_preflight")
         if st.button("執行批次"):
-            if file and script_name:
-                path = f"/tmp/agents.txt"
-                with open(path, "wb") as f:
-                    f.write(file.read())
+            if (file or target_mode == TARGET_MODES[1] and query_guids) and script_name:
                 manager = RunCustomScriptManager()
-                results, csv_path, taskid_path = manager.run_from_file(path, script_name, params or None)
-                for res in results:
-                    st.success(f"Custom Script 執行成功（Agent: {res.get('agent_guid')}）")
-                    st.write(f"任務查詢 URL: {res.get('task_url')}")
+                with uploaded_file(file, ".txt") if file else nullcontext() as path:
+                    if path:
+                        coroutine = manager.run_from_file_async(path, script_name, params or None,
+                                                                concurrency=concurrency, chunk_size=chunk_size,
+                                                                preflight=preflight)
+                    else:
+                        coroutine = manager.run_targets_async(query_guids, script_name, params or None,
+                                                              concurrency=concurrency, chunk_size=chunk_size,
+                                                              preflight=preflight)
+                    results, csv_path, taskid_path = run_async(coroutine)
+                if results:
+                    succeeded = sum(1 for res in results if res.get("status") == "Success")
+                    st.success(f"Custom Script 已下發：{succeeded}/{len(results)} 台 Agent 成功")
+                    deferred = sum(1 for res in results if res.get("status") == "Deferred")
+                    if deferred:
+                        st.info(f"{deferred} 台 Agent 離線，已寫入延後清單（preflight_deferred/）")
+                    st.dataframe(results_to_frame(results))
 
                 if csv_path:
                     st.success(f"執行結果已成功匯出至 {csv_path}")
                 if taskid_path:
                     st.success(f"Task IDs 已成功匯出至 {taskid_path}")
             else:
-                st.warning("請上傳 txt 並輸入 Script 名稱")
+                st.warning("請上傳 txt（或輸入有符合 Agent 的查詢條件）並選擇 Script 名稱")
 
 elif option == "執行 YARA 掃描":
     with st.expander("執行 YARA 規則掃描", expanded=True):
         st.subheader("執行 YARA 掃描（自訂規則）")
-        agent_guid_list = st.text_area("輸入多個 Agent GUID（每行一個）").splitlines()
+        yara_target_mode = st.radio("目標來源", ["輸入清單", TARGET_MODES[1]], horizontal=True, key="yara_target_mode")
+        if yara_target_mode == TARGET_MODES[1]:
+            agent_guid_list = query_target_input("yara")
+        else:
+            agent_guid_list = agent_targets_input(
+                "輸入多個 Agent GUID、Endpoint 名稱或 IP（每行一個，可使用萬用字元，例如 WEB-* 或 10.0.1.*）")
         target_file_location = st.text_input("目標檔案路徑（例如 C:\\test.txt）")
         manager_rule = YaraRuleManager()
         rules = manager_rule.list_yara_rules()
@@ -194,12 +304,20 @@ elif option == "執行 YARA 掃描":
         description = st.text_input("任務描述", value="Run YARA Rule")
         target_file_size = st.selectbox("掃描檔案大小上限", ["1M", "2M", "3M", "4M"], index=0)
         target_file_option = st.selectbox("掃描範圍", ["SCAN_ALL", "SCAN_TOP"], index=0)
+        col1, col2 = st.columns(2)
+        with col1:
+            concurrency = st.number_input("同時送出的批次數", min_value=1, max_value=100, value=DEFAULT_CONCURRENCY,
+                                          key="yara_concurrency")
+        with col2:
+            chunk_size = st.number_input("每批 Agent 數", min_value=1, max_value=500, value=DEFAULT_CHUNK_SIZE,
+                                         key="yara_chunk_size")
+
+        preflight = st.checkbox("只下發給在線的 Agent（離線的 Agent 寫入延後清單）", key="yara_preflight")
 
         if st.button("執行 YARA 掃描"):
             if not agent_guid_list:
                 st.warning("❌ 請輸入至少一個 Agent GUID")
             elif agent_guid_list and target_file_location and yara_content:
-                st.write("🚀 即將送出 YARA Scan Request：")
                 base_payload = {
                     "target": "File",
                     "targetFileLocation": target_file_location,
@@ -215,34 +333,121 @@ elif option == "執行 YARA 掃描":
                     **base_payload,
                     "agentGuids": agent_guid_list
                 }
-                st.write("🚀 即將送出 YARA Scan Request：", full_payload)
-                import json
-                print("🪵 DEBUG - 即將送出的完整 Payload：")
-                print(json.dumps(full_payload, indent=2, ensure_ascii=False))
-                result = manager.run_yara_scan(full_payload)
-                if result:
-                    st.success("✅ YARA 任務送出成功")
-                    st.json(result)
+                st.write(f"🚀 即將送出 YARA Scan Request：共 {len(agent_guid_list)} 台 Agent")
+                result = manager.run_yara_scan(full_payload, concurrency=concurrency, chunk_size=chunk_size,
+                                               preflight=preflight)
+                if result and result["task_id_path"]:
+                    results = result["data"]
+                    succeeded = sum(1 for res in results if res.get("status") == "Success")
+                    st.success(f"✅ YARA 任務送出成功：{succeeded}/{len(results)} 台 Agent")
+                    st.dataframe(results_to_frame(results))
+                    st.success(f"Task IDs 已成功匯出至 {result['task_id_path']}")
+                    if result["deferred_path"]:
+                        st.info(f"離線的 Agent 已寫入延後清單 {result['deferred_path']}")
                 else:
                     st.error("❌ 任務發送失敗")
+                    if result:
+                        st.dataframe(results_to_frame(result["data"]))
             else:
                 st.warning("請填寫所有欄位")
 
+elif option == "YARA 掃描矩陣":
+    with st.expander("YARA 規則 × 路徑 × Agent 掃描矩陣", expanded=True):
+        st.subheader("YARA 掃描矩陣")
+        rules = YaraRuleManager().list_yara_rules()
+        yara_rule_names = [r.get("檔案名稱", "未知") for r in rules] if rules else []
+        matrix_rules = st.multiselect("選擇 YARA 規則（可多選）", yara_rule_names)
+        matrix_paths = st.text_area("掃描路徑（每行一個）").splitlines()
+        matrix_agents = agent_targets_input("Agent GUID、Endpoint 名稱或 IP（每行一個，可使用萬用字元）",
+                                            key="matrix_agents")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            matrix_size = st.selectbox("掃描檔案大小上限", ["1M", "2M", "3M", "4M"], index=0, key="matrix_size")
+        with col2:
+            matrix_option = st.selectbox("掃描範圍", ["SCAN_ALL", "SCAN_TOP"], index=0, key="matrix_option")
+        with col3:
+            concurrency = st.number_input("同時送出的批次數", min_value=1, max_value=100, value=DEFAULT_CONCURRENCY,
+                                          key="matrix_concurrency")
+        with col4:
+            chunk_size = st.number_input("每批 Agent 數", min_value=1, max_value=500, value=DEFAULT_CHUNK_SIZE,
+                                         key="matrix_chunk_size")
+
+        manager = YaraScanMatrixManager()
+        cells, agents = manager.expand(matrix_rules, matrix_paths, matrix_agents)
+        st.caption(f"去除重複後：{len(cells)} 個 (規則, 路徑) × {len(agents)} 台 Agent = {len(cells) * len(agents)} 個掃描")
+
+        if st.button("執行掃描矩陣"):
+            if cells and agents:
+                import pandas as pd
+                total = len(cells) * len(agents)
+                progress_bar = st.progress(0.0)
+                matrix_table = st.empty()
+
+                def show_progress(progress):
+                    done = sum(counts["done"] for counts in progress.values())
+                    progress_bar.progress(done / total, text=f"{done}/{total}")
+                    matrix_table.dataframe(
+                        pd.DataFrame(manager.matrix_rows(progress))
+                        .pivot(index="yara_rule", columns="target_file_location", values="success")
+                    )
+
+                result = manager.run_matrix(matrix_rules, matrix_paths, matrix_agents,
+                                            options={"targetFileSize": matrix_size,
+                                                     "targetFileOption": matrix_option},
+                                            concurrency=concurrency, chunk_size=chunk_size,
+                                            on_progress=show_progress)
+                st.dataframe(pd.DataFrame(manager.matrix_rows(result["progress"])))
+                if result["matrix_path"]:
+                    st.success(f"掃描矩陣已成功匯出至 {result['matrix_path']}")
+                if result["task_id_path"]:
+                    st.success(f"Task IDs 已成功匯出至 {result['task_id_path']}")
+            else:
+                st.warning("規則、路徑與 Agent 皆至少需要一個")
+
 elif option == "批次收集檔案":
     with st.expander("6. 批次收集檔案", expanded=True):
         st.subheader("Collect File")
-        file = st.file_uploader("上傳 Agent GUIDs 的 txt", type="txt")
-        collect_path = st.text_input("目標檔案路徑（例如 C:\\\\test.txt）")
+        target_mode = st.radio("目標來源", TARGET_MODES, horizontal=True, key="collect_target_mode")
+        if target_mode == TARGET_MODES[0]:
+            file = st.file_uploader("上傳 Agent GUIDs 的 txt", type="txt")
+        else:
+            file, query_guids = None, query_target_input("collect")
+        collect_paths = st.text_area("目標檔案路徑（每行一個，例如 C:\\\\test.txt）")
+        col1, col2 = st.columns(2)
+        with col1:
+            concurrency = st.number_input("同時送出的批次數", min_value=1, max_value=100, value=DEFAULT_CONCURRENCY)
+        with col2:
+            chunk_size = st.number_input("每批項目數", min_value=1, max_value=500, value=DEFAULT_CHUNK_SIZE,
+                                         key="collect_chunk_size")
+        preflight = st.checkbox("只下發給在線的 Agent（離線的 Agent 寫入延後清單）", key="collect_preflight")
+        auto_download = st.checkbox("等待收集完成並自動下載、解壓縮（每個 Task 完成即下載）", key="collect_auto_download")
+        max_wait = st.number_input("最長等待時間（分鐘，逾時的 Task 標記為 Timeout）", min_value=1, max_value=1440,
+                                   value=DEFAULT_MAX_WAIT // 60, key="collect_max_wait", disabled=not auto_download)
         if st.button("收集檔案"):
-            if file and collect_path:
-                path = "/tmp/agents_collect.txt"
-                with open(path, "wb") as f:
-                    f.write(file.read())
+            paths = [p.strip() for p in collect_paths.splitlines() if p.strip()]
+            if (file or target_mode == TARGET_MODES[1] and query_guids) and paths:
                 manager = CollectFileManager()
-                manager.collect_from_file(path, collect_path)
-                st.success("收集完成")
+                with uploaded_file(file, ".txt") if file else nullcontext() as path:
+                    if path:
+                        coroutine = manager.collect_from_file_async(path, paths, concurrency=concurrency,
+                                                                    chunk_size=chunk_size, preflight=preflight)
+                    else:
+                        coroutine = manager.collect_targets_async(query_guids, paths, concurrency=concurrency,
+                                                                  chunk_size=chunk_size, preflight=preflight)
+                    results = run_async(coroutine)
+                if results:
+                    succeeded = sum(1 for res in results if res.get("status") == "Success")
+                    st.success(f"收集完成：{succeeded}/{len(results)} 個項目成功下發")
+                    st.dataframe(results_to_frame(results))
+                    task_ids = [res["task_id"] for res in results if res.get("status") == "Success" and res.get("task_id")]
+                    if auto_download and task_ids:
+                        with st.spinner(f"等待 {len(task_ids)} 個 Task 完成並下載..."):
+                            downloads = TaskPipeline().run(task_ids, max_wait=max_wait * 60)
+                        done = sum(1 for res in downloads if res["status"] == "Success")
+                        st.success(f"下載與解壓縮完成：{done}/{len(downloads)} 個 Task 成功")
+                        st.dataframe(downloads)
             else:
-                st.warning("請上傳 txt 並輸入路徑")
+                st.warning("請上傳 txt（或輸入有符合 Agent 的查詢條件）並輸入路徑")
 
     with st.expander("單一收集（手動輸入 Agent GUID）", expanded=False):
         st.subheader("單一 Agent 檔案收集")
@@ -268,13 +473,22 @@ elif option == "下載並解壓縮檔案":
     with st.expander("7. 下載並解壓縮檔案", expanded=True):
         st.subheader("下載並解壓縮")
         file = st.file_uploader("上傳包含 Task ID 的txt檔案", type="txt")
+        concurrency = st.number_input("同時下載數", min_value=1, max_value=50, value=8)
+        wait_for_tasks = st.checkbox("等待尚未完成的 Task（管線模式：每個 Task 完成即下載，查詢、下載與解壓縮同時進行）")
+        max_wait = st.number_input("最長等待時間（分鐘，逾時的 Task 標記為 Timeout）", min_value=1, max_value=1440,
+                                   value=DEFAULT_MAX_WAIT // 60, key="download_max_wait", disabled=not wait_for_tasks)
         if st.button("開始下載"):
             if file:
-                path = "/tmp/taskids.txt"
-                with open(path, "wb") as f:
-                    f.write(file.read())
-                manager = TaskDownloader()
-                manager.process_from_file(path)
+                with uploaded_file(file, ".txt") as path:
+                    if wait_for_tasks:
+                        with st.spinner("等待 Task 完成並下載..."):
+                            results = TaskPipeline(download_workers=concurrency).run_from_file(path,
+                                                                                               max_wait=max_wait * 60)
+                        if results:
+                            st.dataframe(results)
+                    else:
+                        manager = TaskDownloader()
+                        run_async(manager.process_from_file_async(path, concurrency=concurrency))
                 st.success("任務處理完成")
             else:
                 st.warning("請上傳 txt 檔")
@@ -311,76 +525,181 @@ elif option == "下載並解壓縮檔案":
                 st.warning("請輸入 Task ID")
 
 elif option == "檢查 Task ID 狀態":
+    from utils.target_ingest import normalize_task_id, parse_targets
+    from utils.task_tracker import TaskStore, track_tasks
+
     with st.expander("8. 檢查 Task ID 狀態", expanded=True):
-        st.subheader("檢查任務狀態（新視窗背景執行）")
+        st.subheader("檢查任務狀態（共用背景追蹤）")
+        st.caption("Task ID 登記後由單一背景程序查詢，多個使用者追蹤同一個 Task 也只查詢一次；本頁狀態讀取自本機紀錄，不會呼叫 API")
         file = st.file_uploader("上傳 Task ID txt", type="txt")
-        if file:
-            path = "/tmp/task_check.txt"
-            with open(path, "wb") as f:
-                f.write(file.read())
-
-            system = platform.system().lower()
-            script_module = "utils.check_task_status"
-            if system == "windows":
-                script_path = os.path.join(os.getcwd(), "utils", "check_task_status.py")
-                subprocess.Popen(["python", script_path, path], creationflags=subprocess.CREATE_NEW_CONSOLE)
-            elif system == "darwin":
-                cwd = os.getcwd()
-                path = os.path.abspath(path)
-                cmd = f'tell application "Terminal" to do script "cd \\"{cwd}\\"; python3 -m {script_module} \\"{path}\\""'
-                subprocess.Popen(["osascript", "-e", cmd])
+        if file and st.button("開始追蹤"):
+            try:
+                task_ids, report = parse_targets(file.read().decode("utf-8-sig", errors="replace"), normalize_task_id,
+                                                 "Task ID")
+            except TargetLimitError as e:
+                st.error(f"❌ {e}")
             else:
-                subprocess.Popen(["python3", "-m", script_module, path])
-            st.info("任務監控中，請查看新視窗")
+                if report.rejected:
+                    st.warning(report.summary())
+                if task_ids:
+                    tenant, added = track_tasks(task_ids, active_tenant)
+                    st.success(f"✅ 已登記 {added} 個新 Task（共 {len(task_ids)} 個），由背景程序追蹤")
+                else:
+                    st.error("❌ 檔案內沒有有效的 Task ID")
+
+        store = TaskStore()
+        try:
+            tracker = store.lease_info()
+            finished, pending = store.counts(active_tenant)
+            records = store.task_records(active_tenant)
+            if st.button("🧹 清除已完成的紀錄"):
+                store.forget_finished(active_tenant)
+                st.rerun()
+        finally:
+            store.close()
+
+        if tracker:
+            st.info(f"🛰️ 背景追蹤程序執行中（PID {tracker['pid']}，最後更新 {tracker['heartbeat']}）")
+        elif pending:
+            st.warning("⚠️ 背景追蹤程序未執行，重新上傳 Task ID 即可啟動")
+        st.write(f"已完成 {finished} 個，進行中 {pending} 個")
+        if st.button("🔄 重新整理"):
+            st.rerun()
+        if records:
+            df = records_to_frame(records, TaskRecord)
+            df["狀態"] = df["狀態"].fillna("尚未取得狀態")
+            st.dataframe(df, hide_index=True)
 
 elif option == "持續監控所有 Task 狀態（Web 介面）":
-    from utils.api_client import APIClient
-    from utils.all_tasks_status import fetch_all_tasks
-    import time
     from streamlit_autorefresh import st_autorefresh
+    from utils.poll_scheduler import PollScheduler, lookup_os_names
+    from utils.task_cache import DEFAULT_PAGE_SIZE, SORT_COLUMNS, TaskCache
+
+    cache = TaskCache()
+    try:
+        # 只取得上次同步之後建立或有動作的 Task；切換頁面、篩選等操作 15 秒內不重新呼叫 API
+        if st.button("🔄 重新整理任務狀態"):
+            sync_result = cache.sync()
+        else:
+            sync_result = cache.ensure_fresh(max_age=15)
+        changes = cache.recent_changes(limit=200) if sync_result else []
+
+        # 依未完成 Task 的預估完成時間決定下次自動更新（最長 5 分鐘），並記錄本次完成 Task 的完成時間
+        active_tasks = cache.active_records()
+        scheduler = PollScheduler()
+        os_names = lookup_os_names([task.agent_guid for task in active_tasks + changes])
+        scheduler.stats.observe(changes, os_names)
+        refresh_seconds = scheduler.refresh_interval(active_tasks, os_names, max_interval=300)
+        scheduler.stats.close()
+        st.subheader(f"🔁 {refresh_seconds:.0f} 秒後自動更新任務狀態")
+        st_autorefresh(interval=int(refresh_seconds * 1000), key="task_autorefresh")  # 毫秒
+
+        state = cache.sync_state()
+        if state is None:
+            st.warning("❌ 無法取得任務列表或目前尚無任務")
+        else:
+            status_counts = cache.status_counts()
+            st.caption(
+                f"本機共 {sum(status_counts.values())} 筆 Task（最後同步 "
+                f"{datetime.datetime.fromtimestamp(state['last_sync']).strftime('%H:%M:%S')}）"
+                + (f"，本次{'完整' if sync_result['mode'] == 'full' else '增量'}同步取得 {sync_result['fetched']} 筆、"
+                   f"變更 {sync_result['changed']} 筆" if sync_result else "")
+            )
+            status_icons = {"succeeded": "🟢", "failed": "🔴", "running": "🟠", "queued": "⚪"}
+            if changes and sync_result["mode"] == "incremental":
+                with st.expander(f"本次更新的 Task（{len(changes)}）"):
+                    df = records_to_frame(changes, TaskRecord)
+                    df["狀態"] = df["狀態"].map(lambda status: f"{status_icons.get(status, '')} {status}".strip())
+                    st.dataframe(df, hide_index=True)
+
+            col1, col2, col3 = st.columns(3)
+            statuses = col1.multiselect("狀態", list(status_counts),
+                                        format_func=lambda status: f"{status}（{status_counts[status]}）")
+            action = col2.selectbox("動作", ["全部"] + cache.actions())
+            search = col3.text_input("Task ID / 端點（可使用 * ?）").strip()
+            col1, col2, col3 = st.columns(3)
+            sort_labels = {"updated": "更新時間", "created": "建立時間", "status": "狀態", "action": "動作",
+                           "endpoint_name": "端點", "task_id": "Task ID"}
+            sort = col1.selectbox("排序", list(SORT_COLUMNS), format_func=sort_labels.get)
+            descending = col2.checkbox("由新到舊 / 由大到小", value=True)
+            page_size = col3.selectbox("每頁筆數", [50, DEFAULT_PAGE_SIZE, 200, 500], index=1)
+
+            filters = (statuses, None if action == "全部" else action, search or None)
+            total = cache.count(*filters)
+            pages = max(1, -(-total // page_size))
+            page_no = st.number_input(f"頁數（共 {pages} 頁，{total} 筆）", min_value=1, max_value=pages, value=1)
+            records = cache.page(*filters, sort=sort, descending=descending, offset=(page_no - 1) * page_size,
+                                 limit=page_size)
+            if records:
+                df = records_to_frame(records, TaskRecord, {
+                    "task_id": "Task ID", "status": "狀態", "action": "動作", "endpoint_name": "端點",
+                    "file": "檔案路徑/名稱", "error": "錯誤訊息", "description": "描述", "updated": "更新時間"
+                })
+                df["狀態"] = df["狀態"].map(lambda status: f"{status_icons.get(status, '')} {status}".strip())
+                st.dataframe(df, hide_index=True)
+            else:
+                st.info("沒有符合條件的 Task")
+    finally:
+        cache.close()
+
+elif option == "多 Tenant 總覽與批次執行":
     import pandas as pd
-    from streamlit.components.v1 import html
-
-    st.subheader("🔁 每 90 秒自動更新任務狀態")
-    refresh_interval = 90 * 1000  # 毫秒
-    st_autorefresh(interval=refresh_interval, key="task_autorefresh")
-
-    st.subheader("🌐 顯示目前所有任務（API 方式）")
-
-    if st.button("🔄 重新整理任務狀態"):
-        st.rerun()
-
-    all_tasks = fetch_all_tasks()
-    if all_tasks:
-        table_data = []
-        for task in all_tasks:
-            task_id = task.get("id", "N/A")
-            status_raw = task.get("status", "Unknown").lower()
-            if status_raw == "succeeded":
-                status = f"<span style='color: green'>{status_raw}</span>"
-            elif status_raw == "failed":
-                status = f"<span style='color: red'>{status_raw}</span>"
-            elif status_raw == "running":
-                status = f"<span style='color: orange'>{status_raw}</span>"
+    from utils import multi_tenant
+
+    st.header("🏢 多 Tenant 總覽與批次執行")
+    all_tenant_names = list(config_manager.get_all_tenants().keys())
+    selected_tenants = st.multiselect("選擇 Tenant", all_tenant_names, default=all_tenant_names)
+
+    with st.expander("同時查詢多個 Tenant", expanded=True):
+        operations = {
+            "列出所有 Clients": multi_tenant.list_clients_for_tenants,
+            "列出所有 Task": multi_tenant.fetch_tasks_for_tenants,
+            "列出 Custom Scripts": multi_tenant.list_custom_scripts_for_tenants,
+            "列出 YARA Rules": multi_tenant.list_yara_rules_for_tenants,
+        }
+        operation = st.selectbox("查詢項目", list(operations.keys()))
+        if st.button("開始查詢", key="multi_tenant_query"):
+            if not selected_tenants:
+                st.warning("請至少選擇一個 Tenant")
             else:
-                status = status_raw
-            endpoint = task.get("endpointName", "N/A")
-            file_path = task.get("filePath") or task.get("fileName") or "N/A"
-            error_msg = task.get("error", {}).get("message", "")
-            description = task.get("description", "N/A")
-            table_data.append({
-                "Task ID": task_id,
-                "狀態": status,
-                "端點": endpoint,
-                "檔案路徑/名稱": file_path,
-                "錯誤訊息": error_msg,
-                "描述": description,
-            })
-
-        df = pd.DataFrame(table_data)
-        st.write(df.to_html(escape=False, index=False), unsafe_allow_html=True)
-    else:
-        st.warning("❌ 無法取得任務列表或目前尚無任務")
+                with st.spinner(f"同時查詢 {len(selected_tenants)} 個 Tenant..."):
+                    rows, errors = operations[operation](selected_tenants)
+                for name, error in errors.items():
+                    st.error(f"❌ {name}: {error}")
+                if rows:
+                    df = pd.json_normalize(rows)
+                    df = df[[multi_tenant.TENANT_FIELD] + [c for c in df.columns if c != multi_tenant.TENANT_FIELD]]
+                    st.success(f"共 {len(df)} 筆資料（{df[multi_tenant.TENANT_FIELD].nunique()} 個 Tenant）")
+                    st.dataframe(df)
+                    st.download_button("下載 CSV", df.to_csv(index=False).encode("utf-8-sig"),
+                                       file_name="multi_tenant.csv", mime="text/csv")
+                else:
+                    st.warning("❌ 沒有取得任何資料")
+
+    with st.expander("多 Tenant 批次執行 Custom Script", expanded=False):
+        st.caption("上傳 CSV，每行格式為 `Tenant 名稱,Agent GUID`（可直接使用上方「列出所有 Clients」下載的欄位整理）")
+        file = st.file_uploader("上傳 Tenant / Agent GUID 清單", type=["csv", "txt"], key="multi_tenant_targets")
+        script_name = st.text_input("Script 檔案名稱（各 Tenant 需有同名 Script）")
+        params = st.text_input("腳本參數（powershell or bash）", "", key="multi_tenant_params")
+        concurrency = st.number_input("每個 Tenant 同時執行數", min_value=1, max_value=100, value=DEFAULT_CONCURRENCY)
+        if st.button("執行批次", key="multi_tenant_run"):
+            if file and script_name:
+                with uploaded_file(file, ".csv") as path:
+                    targets = multi_tenant.read_tenant_targets(path)
+                targets = {name: guids for name, guids in targets.items() if name in selected_tenants}
+                if not targets:
+                    st.warning("清單中沒有屬於已選 Tenant 的 Agent")
+                else:
+                    rows, errors = run_async(multi_tenant.run_script_for_tenants_async(
+                        targets, script_name, params or None, concurrency=concurrency))
+                    for name, error in errors.items():
+                        st.error(f"❌ {name}: {error}")
+                    if rows:
+                        st.dataframe(pd.DataFrame(rows))
+                        csv_path = multi_tenant.export_tenant_results(rows, "run_script")
+                        st.success(f"執行結果已成功匯出至 {csv_path}")
+            else:
+                st.warning("請上傳清單並輸入 Script 名稱")
 
 elif option == "⚙️ 設定與 Tenant 切換":
     st.header("⚙️ 設定與 Tenant 管理")
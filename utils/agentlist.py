@@ -1,29 +1,40 @@
 import csv
 import os
 import datetime
-from utils.api_client import APIClient
+from utils.api_client import PaginationError, get_api_client
+from utils.log import setup_logging
+
+ENDPOINTS_PATH = "/v3.0/endpointSecurity/endpoints"
+ENDPOINT_LIST_PARAMS = {
+    "orderBy": "agentGuid asc",  # 按照 agentGuid 遞增排序
+    "top": 1000,  # 每頁 1000 筆
+    "select": "agentGuid,endpointName,lastUsedIp,osName,edrSensorConnectivity"  # ✅ 正確選取 edrSensor 欄位
+}
 
 class ClientManager:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
 
     def list_all_clients(self):
         """列出全部 Vision One 上的 Client，並顯示 `agentGuid`、`endpointName`、`lastUsedIp`、`osName`、`edrSensor.connectivity`"""
-        endpoint = "/v3.0/endpointSecurity/endpoints"
-        params = {
-            "orderBy": "agentGuid asc",  # 按照 agentGuid 遞增排序
-            "top": 1000,  # 取得最多 1000 筆資料
-            "select": "agentGuid,endpointName,lastUsedIp,osName,edrSensorConnectivity"  # ✅ 正確選取 edrSensor 欄位
-        }
-
-        result = self.api_client.send_request("GET", endpoint, params=params)
-
-        if result is None:
-            print("❌ API 回應為 None，請檢查 API Key 或權限")
-            return []
+        try:
+            agents = list(self.iter_all_clients())
+        except PaginationError as e:
+            print(f"❌ Client 清單讀取失敗：{e}")
+            return None
+        if not agents:
+            print("❌ 沒有取得任何 Client，請檢查 API Key 或權限")
+        return agents
 
-        #print("🔍 API 回應內容: ", result)  # ✅ Debug: 確認 API 回應內容
-        return result.get("items", [])
+    def iter_all_clients(self, prefetch=True):
+        """
+        逐筆產生全部 Client（自動跟隨 nextLink 分頁）
+        :raises PaginationError: 任一頁讀取失敗
+        """
+        return self.api_client.paginate(ENDPOINTS_PATH, params=ENDPOINT_LIST_PARAMS, prefetch=prefetch)
 
     def export_to_csv(self, agents):
         """將 Client 資料匯出至 CSV"""
@@ -61,6 +72,7 @@ class ClientManager:
         print(f"✅ Client 資料已成功匯出至 {file_path}")
 
 if __name__ == "__main__":
+    setup_logging()
     manager = ClientManager()
     agents = manager.list_all_clients()
 
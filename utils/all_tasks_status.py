@@ -1,9 +1,26 @@
-from utils.api_client import APIClient
-
-def fetch_all_tasks():
-    """呼叫 /v3.0/response/tasks 並回傳 task 狀態列表"""
-    api = APIClient()
-    result = api.send_request("GET", "/v3.0/response/tasks")
-    if not result or "items" not in result:
-        return []
-    return result["items"]
\ No newline at end of file
+from utils.api_client import get_api_client
+from utils.records import TaskRecord
+
+def iter_all_tasks(prefetch=True, tenant_name=None):
+    """
+    逐筆產生 /v3.0/response/tasks 的所有 task（自動跟隨 nextLink 分頁）
+    :raises PaginationError: 任一頁讀取失敗
+    """
+    api = get_api_client(tenant_name)
+    return api.paginate("/v3.0/response/tasks", params={"top": 200}, prefetch=prefetch)
+
+
+def fetch_all_tasks(tenant_name=None):
+    """
+    呼叫 /v3.0/response/tasks 並回傳 task 狀態列表
+    :raises PaginationError: 任一頁讀取失敗（不回傳不完整的清單）
+    """
+    return list(iter_all_tasks(tenant_name=tenant_name))
+
+
+def fetch_task_records(tenant_name=None):
+    """
+    取得所有 task 並逐筆轉為 TaskRecord（原始 dict 不會整批保留在記憶體中）
+    :raises PaginationError: 任一頁讀取失敗
+    """
+    return [TaskRecord.from_api(task) for task in iter_all_tasks(tenant_name=tenant_name)]
@@ -1,78 +1,361 @@
+import copy
+import json
+import logging
+import threading
+import random
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from utils.config_manager import ConfigManager
+from utils.rate_limiter import RateLimiter, parse_retry_after
+from utils.response_cache import response_cache
+from utils.single_flight import single_flight
+
+logger = logging.getLogger(__name__)
+
+# 記錄 Log 時需遮蔽的標頭
+SENSITIVE_HEADERS = {"authorization", "cookie", "set-cookie"}
+
+DEFAULT_POOL_SIZE = 20  # 每個 Tenant 保留的 keep-alive 連線數
+DEFAULT_TIMEOUT = (10, 60)  # (連線逾時, 讀取逾時)，單位：秒
+
+# 可安全重送的方法；POST（runScript、collectFile...）重送可能造成重複下發
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+RETRY_STATUS_IDEMPOTENT = {500, 502, 503, 504}
+RETRY_STATUS_ANY = {429, 503}  # 伺服器明確表示尚未處理的狀態，任何方法都可重送
+
+# Process 內共用的 APIClient，以 Tenant 名稱為 key（Streamlit rerun 之間也會沿用）
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class PaginationError(RuntimeError):
+    """清單 API 的某一頁請求失敗，已取得的資料不完整"""
+
+
+def redact_headers(headers):
+    """遮蔽敏感標頭（Bearer Token 等）後回傳新的字典，供 Log 使用"""
+    return {k: ("***" if k.lower() in SENSITIVE_HEADERS else v) for k, v in headers.items()}
+
+
+def _client_key(tenant_name, tenant):
+    """用來判斷 Tenant 設定是否變更的 key，設定變更時需重建連線池"""
+    tenant = tenant or {}
+    return (
+        tenant_name,
+        tenant.get("api_key"),
+        tenant.get("base_url"),
+        tenant.get("pool_size"),
+        str(tenant.get("timeout")),
+        str(tenant.get("rate_limit")),
+    )
+
+
+def get_api_client(tenant_name=None):
+    """
+    取得 Tenant 共用的 APIClient（含 keep-alive 連線池）
+    :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+    :return: 同一個 Tenant 在整個 Process 中共用的 APIClient
+    """
+    name, tenant = ConfigManager().get_tenant_config(tenant_name)
+    key = _client_key(name, tenant)
+
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None or client.client_key != key:
+            # 設定變更（API Key、Base URL、連線池大小...）時重建，舊的連線池交由 GC 回收
+            client = APIClient(tenant_name=name, tenant_config=tenant)
+            _clients[name] = client
+        return client
+
 
 class APIClient:
-    def __init__(self):
-        """初始化 API 連線"""
-        self.config_manager = ConfigManager()
-        self.api_key, self.base_url = self.config_manager.get_active_config()
-        
+    def __init__(self, tenant_name=None, tenant_config=None):
+        """
+        初始化 API 連線
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        :param tenant_config: Tenant 設定字典，未指定時從 tenants.json 讀取
+        """
+        if tenant_config is None:
+            tenant_name, tenant_config = ConfigManager().get_tenant_config(tenant_name)
+        tenant_config = tenant_config or {}
+
+        self.tenant_name = tenant_name
+        self.client_key = _client_key(tenant_name, tenant_config)
+        self.api_key = tenant_config.get("api_key")
+        self.base_url = tenant_config.get("base_url")
+        self.pool_size = int(tenant_config.get("pool_size") or DEFAULT_POOL_SIZE)
+        self.timeout = self._parse_timeout(tenant_config.get("timeout"))
+        self.rate_limiter = RateLimiter(tenant_config.get("rate_limit"))
+
+        # 共用 Session：同一個 Tenant 的請求重複使用 TCP / TLS 連線
+        self.session = requests.Session()
+        self._pool_lock = threading.Lock()
+        self._mount_adapter(self.pool_size)
+
         if not self.api_key or not self.base_url:
-            print("⚠️ 警告: 未設定 API Key 或 Base URL，請至設定頁面設定")
+            logger.warning("Tenant %s 未設定 API Key 或 Base URL，請至設定頁面設定", tenant_name)
             self.headers = {}
         else:
             self.headers = {
                 "Authorization": f"Bearer {self.api_key}"
             }
 
-    def send_request(self, method, endpoint, params=None, data=None, files=None, extra_headers=None):
+    @staticmethod
+    def _parse_timeout(value):
+        """tenants.json 的 timeout 可為單一秒數或 [連線逾時, 讀取逾時]"""
+        if value is None:
+            return DEFAULT_TIMEOUT
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            return float(value[0]), float(value[1])
+        return float(value)
+
+    def _mount_adapter(self, pool_size):
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def ensure_pool_size(self, size):
+        """
+        將連線池擴大到至少 `size` 條連線（只會變大），讓更高的並行數也能重複使用連線
+        進行中的請求沿用原本的連線池，之後的請求改用新的連線池
+        """
+        with self._pool_lock:
+            if size > self.pool_size:
+                logger.info("Tenant %s 連線池由 %d 擴大為 %d", self.tenant_name, self.pool_size, size)
+                self.pool_size = size
+                self._mount_adapter(size)
+
+    def close(self):
+        """關閉連線池"""
+        self.session.close()
+
+    @staticmethod
+    def _is_retryable_error(method, error):
+        """連線錯誤是否可重試：冪等方法一律可重試，POST 僅限尚未送出請求的連線失敗"""
+        if method.upper() in IDEMPOTENT_METHODS:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+    @staticmethod
+    def _is_retryable_status(method, status_code):
+        """HTTP 狀態碼是否可重試"""
+        if status_code in RETRY_STATUS_ANY:
+            return True
+        return method.upper() in IDEMPOTENT_METHODS and status_code in RETRY_STATUS_IDEMPOTENT
+
+    @staticmethod
+    def _rewind_files(files):
+        """重試前將上傳檔案指標移回開頭"""
+        for value in (files or {}).values():
+            file_obj = value[1] if isinstance(value, tuple) else value
+            if hasattr(file_obj, "seek"):
+                file_obj.seek(0)
+
+    def _request(self, method, url, headers, params=None, data=None, files=None):
+        """
+        經過限流送出請求，遇到 429（依 Retry-After）、暫時性 5xx 與連線中斷時自動退避重試
+        :return: requests.Response（重試用盡時回傳最後一次的回應）
+        :raises requests.exceptions.RequestException: 無法重試或重試用盡的連線錯誤
+        """
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                if files:
+                    self._rewind_files(files)
+                    response = self.session.request(method, url, headers=headers, params=params, data=data,
+                                                    files=files, timeout=self.timeout)
+                else:
+                    response = self.session.request(method, url, headers=headers, params=params, json=data,
+                                                    timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                if attempt >= limiter.max_retries or not self._is_retryable_error(method, e):
+                    raise
+                delay = limiter.backoff(attempt)
+                logger.warning("%s %s 連線失敗（%s），%.1f 秒後重試（第 %d 次）",
+                               method, url, e.__class__.__name__, delay, attempt + 1)
+            else:
+                if attempt >= limiter.max_retries or not self._is_retryable_status(method, response.status_code):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, 1)  # 依伺服器指示等待，加上少量 Jitter 錯開重送
+                else:
+                    delay = limiter.backoff(attempt)
+                if response.status_code == 429:
+                    limiter.pause(delay)  # 整個 Tenant 一起暫停，避免其他執行緒繼續觸發限流
+                logger.warning("%s %s 回應 %s，%.1f 秒後重試（第 %d 次）",
+                               method, url, response.status_code, delay, attempt + 1)
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def invalidate_cache(self, endpoint=None):
+        """
+        清除此 Tenant 的 GET 快取（例如更新 Custom Script 之後）
+        :param endpoint: 只清除此端點的快取，未指定時清除全部
+        """
+        response_cache.invalidate(self.tenant_name, endpoint)
+
+    def _url(self, endpoint):
+        """端點轉為完整 URL（nextLink 等完整 URL 直接使用）"""
+        if endpoint.startswith(("http://", "https://")):
+            return endpoint
+        return f"{self.base_url}{endpoint}"
+
+    def send_request(self, method, endpoint, params=None, data=None, files=None, extra_headers=None,
+                     use_cache=False, not_found=None):
         """
         統一發送 API 請求
         :param method: "GET", "POST", "PUT", "DELETE"
-        :param endpoint: API 端點 (例如 "/v3.0/response/customScripts")
+        :param endpoint: API 端點 (例如 "/v3.0/response/customScripts")，或完整 URL（例如分頁的 nextLink）
         :param params: 查詢參數 (GET 用, 例如 {'filter': 'YOUR_FILTER'})
         :param data: `POST/PUT` 傳送的 JSON 資料
         :param files: `POST/PUT` 需要上傳的檔案 (multipart/form-data)
         :param extra_headers: 額外的 HTTP 標頭字典
+        :param use_cache: 僅 GET 有效，使用快取（過期時依 ETag / Last-Modified 重新驗證）
+        :param not_found: 404 時回傳的值，用來與其他錯誤區分（未指定時 404 與其他錯誤相同，回傳 None）
         :return: JSON 回應，若 API 無回應則回傳 None
         """
-        url = f"{self.base_url}{endpoint}"
+        url = self._url(endpoint)
+        if method.upper() != "GET":
+            return self._send_request(method, url, params, data, files, extra_headers, not_found=not_found)
 
-        try:
-            import json
-            print("📤 發送 API 請求:")
-            print(f"🔹 Method: {method}")
-            print(f"🔹 URL: {url}")
-            headers = self.headers.copy()
-            if extra_headers:
-                headers.update(extra_headers)
-            print(f"🔹 Headers: {headers}")
-            print("📤 送出 Request Headers:")
-            for k, v in headers.items():
-                print(f"🔹 {k}: {v}")
-            if params:
-                print(f"🔹 Params: {params}")
+        request_key = self._request_key(url, params, extra_headers, not_found is not None)
+        if use_cache:
+            cache_entry = response_cache.get(request_key)
+            if cache_entry is not None and cache_entry.fresh:
+                logger.debug("GET %s -> cache hit", url)
+                return copy.deepcopy(cache_entry.body)
+
+        # 相同 Tenant 的相同 GET 同時進行時（例如多個 Session 同時自動刷新），只送出一次並共用結果
+        return single_flight.do(
+            request_key,
+            lambda: self._send_request(method, url, params, data, files, extra_headers,
+                                       cache_key=request_key if use_cache else None, not_found=not_found)
+        )
+
+    def _request_key(self, url, params=None, extra_headers=None, not_found=False):
+        """GET 請求的識別 key（快取與請求合併共用），會影響結果的標頭（例如 TMV1-Filter）也納入"""
+        key_params = dict(params or {})
+        key_params.update({f"header:{k}": v for k, v in (extra_headers or {}).items()})
+        if not_found:
+            key_params["option:not_found"] = True  # 回傳值不同，不與一般請求合併
+        return response_cache.make_key(self.tenant_name, url, key_params)
+
+    def _send_request(self, method, url, params=None, data=None, files=None, extra_headers=None, cache_key=None,
+                      not_found=None):
+        """
+        實際送出請求並依狀態碼轉換回應（見 `send_request`）
+        :param cache_key: 指定時，過期的快取會以條件式請求重新驗證，成功的回應會寫入快取
+        :param not_found: 404 時回傳的值（見 `send_request`）
+        """
+        cache_entry = response_cache.get(cache_key) if cache_key is not None else None
+
+        headers = self.headers.copy()
+        if extra_headers:
+            headers.update(extra_headers)
+        if cache_entry is not None and cache_entry.revalidatable:
+            headers.update(cache_entry.conditional_headers())
+        if not files:
+            headers["Content-Type"] = "application/json"
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("→ %s %s headers=%s params=%s", method, url, redact_headers(headers), params)
             if files:
-                print("🚀 即將送出的 Request Payload (form-data):")
-                print(data)
-                response = requests.request(method, url, headers=headers, params=params, data=data, files=files)
-            else:
-                headers["Content-Type"] = "application/json"
-                print("🚀 即將送出的 Request Payload:")
-                print(json.dumps(data, indent=2, ensure_ascii=False))
-                response = requests.request(method, url, headers=headers, params=params, json=data)
-
-            print("📥 回應 Headers:")
-            for k, v in response.headers.items():
-                print(f"🔸 {k}: {v}")
-            if response.status_code in [200, 201, 202]:
-                return response.json() if response.text else True  # 若無回應內容，視為成功
-
-            elif response.status_code == 207:  # ✅ 處理 207 Multi-Status
-                try:
-                    return response.json()
-                except requests.exceptions.JSONDecodeError:
-                    print("⚠️ 207 Multi-Status 回應無法解析 JSON")
-                    return None
-
-            elif response.status_code == 204:  # 204 No Content
-                print("✅ API 執行成功 (204 No Content)")
-                return None
+                logger.debug("→ payload (form-data): %s", data)
+            elif data is not None:
+                logger.debug("→ payload: %s", json.dumps(data, ensure_ascii=False))
 
-            else:
-                print(f"❌ API 錯誤 ({response.status_code}): {response.text}")
+        started = time.monotonic()
+        try:
+            response = self._request(method, url, headers, params=params, data=data, files=files)
+        except requests.exceptions.RequestException as e:
+            logger.error("%s %s 請求失敗 (%.0f ms): %s", method, url, (time.monotonic() - started) * 1000, e)
+            return None
+
+        logger.info("%s %s -> %s (%.0f ms, %d bytes)", method, urlparse(url).path, response.status_code,
+                    (time.monotonic() - started) * 1000, len(response.content))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("← headers=%s", redact_headers(response.headers))
+
+        if response.status_code == 304 and cache_entry is not None:  # 快取仍有效
+            response_cache.refresh(cache_key)
+            return copy.deepcopy(cache_entry.body)
+
+        if response.status_code in [200, 201, 202]:
+            result = response.json() if response.text else True  # 若無回應內容，視為成功
+            if cache_key is not None and response.status_code == 200:
+                response_cache.put(cache_key, result, response.headers.get("ETag"),
+                                   response.headers.get("Last-Modified"))
+            return result
+
+        elif response.status_code == 207:  # ✅ 處理 207 Multi-Status
+            try:
+                return response.json()
+            except requests.exceptions.JSONDecodeError:
+                logger.warning("207 Multi-Status 回應無法解析 JSON: %s %s", method, url)
                 return None
 
-        except requests.exceptions.RequestException as e:
-            print(f"❌ API 請求失敗: {e}")
-            return None
\ No newline at end of file
+        elif response.status_code == 204:  # 204 No Content
+            return None
+
+        elif response.status_code == 404 and not_found is not None:  # 呼叫端需要區分「不存在」與其他錯誤
+            logger.info("%s %s -> 404 Not Found", method, url)
+            return not_found
+
+        else:
+            logger.error("API 錯誤 (%s) %s %s: %.500s", response.status_code, method, url, response.text)
+            return None
+
+    def paginate(self, endpoint, params=None, extra_headers=None, prefetch=False, use_cache=False):
+        """
+        逐筆產生清單 API 的所有項目，依 `nextLink` 延遲載入下一頁
+        :param endpoint: API 端點 (例如 "/v3.0/endpointSecurity/endpoints")
+        :param params: 第一頁的查詢參數（後續頁面的參數已包含在 nextLink 中）
+        :param extra_headers: 額外的 HTTP 標頭字典（每一頁都會帶上，例如 TMV1-Filter）
+        :param prefetch: 為 True 時，在呼叫端處理目前頁面的同時於背景取得下一頁
+        :param use_cache: 每一頁都使用 GET 快取（見 `send_request`）
+        :return: generator，逐筆產生 `items` 中的項目
+        :raises PaginationError: 任一頁請求失敗（已產生的項目不完整）
+        """
+        for items in self.pages(endpoint, params, extra_headers, prefetch, use_cache):
+            yield from items
+
+    def pages(self, endpoint, params=None, extra_headers=None, prefetch=False, use_cache=False):
+        """
+        逐頁產生清單 API 的 `items` 列表（參數同 `paginate`）
+        :raises PaginationError: 任一頁請求失敗（已產生的頁面不完整）
+        """
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="v1-prefetch") if prefetch else None
+        try:
+            page = self.send_request("GET", endpoint, params=params, extra_headers=extra_headers, use_cache=use_cache)
+            while isinstance(page, dict):
+                next_link = page.get("nextLink")
+                future = None
+                if next_link and executor:
+                    future = executor.submit(self.send_request, "GET", next_link, None, None, None, extra_headers,
+                                             use_cache)
+
+                yield page.get("items", [])
+
+                if not next_link:
+                    return
+                if future:
+                    page = future.result()
+                else:
+                    page = self.send_request("GET", next_link, extra_headers=extra_headers, use_cache=use_cache)
+
+            raise PaginationError(f"分頁讀取中斷（{endpoint}），結果不完整")
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from utils.api_client import get_api_client
+
+DEFAULT_CONCURRENCY = 20  # 批次作業預設同時進行的請求數
+
+
+def run_async(coro):
+    """在同步程式（CLI、Streamlit）中執行 coroutine 並取得結果"""
+    return asyncio.run(coro)
+
+
+class AsyncAPIClient:
+    """
+    APIClient 的 asyncio 版本，回傳格式與 `APIClient.send_request` 相同（含 207 Multi-Status）
+
+    實際請求在有上限的執行緒池中透過 Tenant 共用的連線池送出，
+    同時進行的請求數不會超過 `concurrency`；連線池小於 `concurrency` 時會自動擴大，每個請求都能重複使用連線。
+    """
+
+    def __init__(self, tenant_name=None, concurrency=DEFAULT_CONCURRENCY):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        :param concurrency: 同時進行的請求數上限
+        """
+        self.api_client = get_api_client(tenant_name)
+        self.concurrency = max(1, int(concurrency))
+        # 並行數超過連線池大小時，多出的請求只會建立用完即丟的連線，因此先擴大連線池
+        self.api_client.ensure_pool_size(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="v1-api")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """釋放執行緒池（連線池由 Tenant 共用，不會關閉）"""
+        self._executor.shutdown(wait=False)
+
+    async def run(self, func, *args):
+        """在受並行上限控制的執行緒池中執行同步函式"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def send_request(self, method, endpoint, params=None, data=None, files=None, extra_headers=None,
+                           use_cache=False):
+        """
+        非同步發送 API 請求，參數與回傳值同 `APIClient.send_request`
+        """
+        return await self.run(self.api_client.send_request, method, endpoint, params, data, files, extra_headers,
+                              use_cache)
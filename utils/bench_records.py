@@ -0,0 +1,148 @@
+import gc
+import json
+import time
+import tracemalloc
+from utils.records import DispatchResult, EndpointRecord, TaskRecord, records_to_frame
+
+OS_NAMES = ["Windows 10", "Windows 11", "Windows Server 2019", "Ubuntu 22.04", "macOS 14"]
+TASK_ACTIONS = ["runScript", "collectFile", "runYaraRules"]
+TASK_STATUSES = ["succeeded", "failed", "running", "queued"]
+
+
+def make_endpoint_payload(count):
+    """產生與 Endpoint 清單 API 相同格式的 JSON 字串（已 select 需要的欄位）"""
+    return json.dumps([
+        {
+            "agentGuid": f"{i:08x}-0000-4000-8000-{i:012x}",
+            "endpointName": f"HOST-{i:06d}",
+            "lastUsedIp": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            "osName": OS_NAMES[i % len(OS_NAMES)],
+            "edrSensor": {"connectivity": "Connected" if i % 3 else "Disconnected"}
+        }
+        for i in range(count)
+    ])
+
+
+def make_task_payload(count):
+    """產生與 /v3.0/response/tasks 相同格式的 JSON 字串"""
+    return json.dumps([
+        {
+            "id": f"{i:010d}",
+            "status": TASK_STATUSES[i % len(TASK_STATUSES)].capitalize(),
+            "action": TASK_ACTIONS[i % len(TASK_ACTIONS)],
+            "agentGuid": f"{i:08x}-0000-4000-8000-{i:012x}",
+            "endpointName": f"HOST-{i:06d}",
+            "fileName": "collect.ps1",
+            "description": "Run custom script task",
+            "createdDateTime": "2024-01-01T00:00:00Z",
+            "lastActionDateTime": "2024-01-01T00:05:00Z",
+            "account": "admin",
+            "type": "custom"
+        }
+        for i in range(count)
+    ])
+
+
+def measure(build):
+    """
+    執行 `build()` 並量測時間與記憶體
+    :return: (結果, 秒數, 結果佔用的位元組數, 過程中的峰值位元組數)
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, current, peak
+
+
+def endpoint_dicts(payload):
+    """原本的流程：API dict 列表 → 每列一個顯示用 dict → DataFrame"""
+    import pandas as pd
+    agents = json.loads(payload)
+    table_data = [{
+        "Endpoint Name": agent.get("endpointName", "未知"),
+        "Agent GUID": agent.get("agentGuid", ""),
+        "IP": agent.get("lastUsedIp", ""),
+        "OS": agent.get("osName", ""),
+        "EDR Sensor": agent.get("edrSensor", {}).get("connectivity", "Disconnected")
+    } for agent in agents]
+    return agents, table_data, pd.DataFrame(table_data)
+
+
+def endpoint_records(payload):
+    """新的流程：EndpointRecord 列表 → 以欄位為單位建立 DataFrame"""
+    records = [
+        EndpointRecord.from_row((item["agentGuid"], item["endpointName"], item["lastUsedIp"], item["osName"],
+                                 item["edrSensor"]["connectivity"]))
+        for item in json.loads(payload)
+    ]
+    return records, records_to_frame(records, EndpointRecord)
+
+
+def task_dicts(payload):
+    import pandas as pd
+    tasks = json.loads(payload)
+    table_data = [{
+        "Task ID": task.get("id", "N/A"),
+        "狀態": task.get("status", "Unknown").lower(),
+        "端點": task.get("endpointName", "N/A"),
+        "檔案路徑/名稱": task.get("filePath") or task.get("fileName") or "N/A",
+        "錯誤訊息": task.get("error", {}).get("message", ""),
+        "描述": task.get("description", "N/A"),
+    } for task in tasks]
+    return tasks, table_data, pd.DataFrame(table_data)
+
+
+def task_records(payload):
+    records = [TaskRecord.from_api(task) for task in json.loads(payload)]
+    return records, records_to_frame(records, TaskRecord)
+
+
+def dispatch_dicts(count):
+    return [{"agent_guid": f"{i:08x}-0000-4000-8000-{i:012x}", "task_id": f"{i:010d}",
+             "task_url": f"https://api.example.com/v3.0/response/tasks/{i:010d}", "status": "Success"}
+            for i in range(count)]
+
+
+def dispatch_records(count):
+    return [DispatchResult(f"{i:08x}-0000-4000-8000-{i:012x}", task_id=f"{i:010d}",
+                           task_url=f"https://api.example.com/v3.0/response/tasks/{i:010d}", status="Success")
+            for i in range(count)]
+
+
+def run_benchmark(count=100_000):
+    """
+    比較 dict 與 Record 兩種流程的時間與記憶體
+    :param count: 每種資料的筆數
+    :return: 結果列表 [{"case", "mode", "seconds", "retained_mb", "peak_mb", "bytes_per_item"}]
+    """
+    cases = [
+        ("endpoints", make_endpoint_payload(count), endpoint_dicts, endpoint_records),
+        ("tasks", make_task_payload(count), task_dicts, task_records),
+        ("dispatch results", count, dispatch_dicts, dispatch_records),
+    ]
+    rows = []
+    for case, source, old, new in cases:
+        for mode, build in (("dict", old), ("record", new)):
+            result, seconds, current, peak = measure(lambda: build(source))
+            rows.append({
+                "case": case,
+                "mode": mode,
+                "seconds": round(seconds, 3),
+                "retained_mb": round(current / 2 ** 20, 1),
+                "peak_mb": round(peak / 2 ** 20, 1),
+                "bytes_per_item": current // count
+            })
+            del result
+    return rows
+
+
+if __name__ == "__main__":
+    count = int(input("每種資料的筆數（預設 100000）: ").strip() or 100_000)
+    print(f"{'case':<18}{'mode':<8}{'seconds':>9}{'retained MB':>13}{'peak MB':>10}{'bytes/item':>12}")
+    for row in run_benchmark(count):
+        print(f"{row['case']:<18}{row['mode']:<8}{row['seconds']:>9}{row['retained_mb']:>13}{row['peak_mb']:>10}"
+              f"{row['bytes_per_item']:>12}")
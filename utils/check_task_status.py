@@ -1,66 +1,113 @@
 import os
-import time
 import sys
 import platform
-from utils.api_client import APIClient
+import asyncio
+from utils.api_client import get_api_client
+from utils.async_api_client import DEFAULT_CONCURRENCY
+from utils.target_ingest import normalize_task_id, read_targets
+from utils.task_poller import TaskPoller
+from utils.log import setup_logging
 
 
 class TaskStatusChecker:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
         self.url_template = "/v3.0/response/tasks/{task_id}"
-        self.check_interval = 90  # ✅ 每 30 秒檢查一次 (可調整)
+        self.check_interval = None  # ✅ None：依各 Task 的預估完成時間自動調整；設定秒數則固定間隔
 
     def get_task_status(self, task_id):
         """查詢 Task ID 狀態"""
         endpoint = self.url_template.format(task_id=task_id)
         result = self.api_client.send_request("GET", endpoint)
+        return self._parse_status(task_id, result)
 
+    async def get_task_status_async(self, async_client, task_id):
+        """`get_task_status` 的非同步版本"""
+        endpoint = self.url_template.format(task_id=task_id)
+        result = await async_client.send_request("GET", endpoint)
+        return self._parse_status(task_id, result)
+
+    def _parse_status(self, task_id, result):
+        """從 Task 資訊取出狀態"""
         if result is None:
             print(f"❌ 無法獲取 Task ID ({task_id}) 的資訊，請檢查 API 權限")
             return "Unknown"
 
         return result.get("status", "Unknown")
 
-    def check_all_tasks(self, task_file):
-        """讀取 Task ID 清單，持續檢查所有 Task 狀態直到全部完成"""
-        if not os.path.isfile(task_file):
-            print(f"❌ 錯誤: 檔案 '{task_file}' 不存在，請確認路徑")
+    def _read_task_ids(self, task_file):
+        """讀取 Task ID 清單（檢查格式並去除重複），檔案不存在或沒有有效 Task ID 時回傳 None"""
+        task_ids, _ = read_targets(task_file, normalize_task_id, "Task ID")
+        return task_ids or None
+
+    def _make_poller(self, task_ids, concurrency=DEFAULT_CONCURRENCY):
+        """建立 TaskPoller；設定固定的 `check_interval` 時每一輪查詢全部未完成的 Task"""
+        poller = TaskPoller(self.api_client.tenant_name, concurrency, adaptive=self.check_interval is None)
+        poller.add(task_ids)
+        return poller
+
+    def _report_round(self, poller, changed):
+        """印出本輪狀態有變化的 Task 與進度"""
+        for record in changed:
+            print(f"🔄 Task {record.task_id} 狀態: {record.status}")
+        print(poller.summary())
+        if poller.done:
+            print("✅ 所有 Task 已完成！")
+        else:
+            wait = self._next_wait(poller)
+            print(f"⏳ 仍有 {len(poller.active)} 個 Task 未完成，{wait:.0f} 秒後重新檢查...")
+
+    def _next_wait(self, poller):
+        """距離下一輪檢查的秒數"""
+        return self.check_interval if self.check_interval is not None else poller.seconds_until_next()
+
+    async def check_all_tasks_async(self, task_file, concurrency=DEFAULT_CONCURRENCY):
+        """
+        `check_all_tasks` 的非同步版本（查詢在執行緒中進行，不阻塞 event loop）
+        :param task_file: 包含 Task ID 的 txt 檔案路徑
+        :param concurrency: 退回逐一查詢時同時進行的請求數上限
+        :return: {task_id: TaskRecord}
+        """
+        task_ids = self._read_task_ids(task_file)
+        if not task_ids:
             return
 
-        with open(task_file, "r", encoding="utf-8") as f:
-            task_ids = [line.strip() for line in f if line.strip()]
+        print(f"🔍 共有 {len(task_ids)} 個 Task，開始監控狀態...")
+        poller = self._make_poller(task_ids, concurrency)
+        loop = asyncio.get_running_loop()
+        while not poller.done:
+            changed = await loop.run_in_executor(None, poller.poll)
+            self._report_round(poller, changed)
+            if not poller.done:
+                await asyncio.sleep(self._next_wait(poller))
+        return poller.records
 
+    def check_all_tasks(self, task_file):
+        """
+        讀取 Task ID 清單，持續檢查所有 Task 狀態直到全部完成
+        已完成的 Task 不再查詢，其餘以 Task 清單 API 批次 / 增量查詢，並依預估完成時間排定查詢時間（見 TaskPoller）
+        :return: {task_id: TaskRecord}
+        """
+        task_ids = self._read_task_ids(task_file)
         if not task_ids:
-            print("❌ 檔案內沒有有效的 Task ID")
             return
 
         print(f"🔍 共有 {len(task_ids)} 個 Task，開始監控狀態...")
-
-        while True:
-            pending_tasks = []
-            for task_id in task_ids:
-                status = self.get_task_status(task_id)
-                print(f"🔄 Task {task_id} 狀態: {status}")
-
-                if status.lower() not in ["completed", "succeeded", "failed"]:
-                    pending_tasks.append(task_id)
-
-            if not pending_tasks:
-                print("✅ 所有 Task 已完成！")
-                break
-
-            print(f"⏳ 仍有 {len(pending_tasks)} 個 Task 未完成，90 秒後重新檢查...")
-            time.sleep(self.check_interval)  # ✅ 等待 30 秒再檢查
+        poller = self._make_poller(task_ids)
+        return poller.run(self.check_interval, self._report_round)
 
 if __name__ == "__main__":
+    setup_logging()
     if len(sys.argv) > 1:
         task_file = sys.argv[1]  # ✅ 從參數讀取 Task ID 檔案
     else:
         task_file = input("請輸入包含 Task ID 的 txt 檔案路徑: ").strip()
 
     manager = TaskStatusChecker()
-    manager.check_all_tasks(task_file)
+    asyncio.run(manager.check_all_tasks_async(task_file))
 
     # ✅ 在所有 Task 完成後，根據系統顯示保留提示
     system = platform.system().lower()
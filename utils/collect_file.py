@@ -2,13 +2,26 @@ import csv
 import os
 import json
 import datetime
-from utils.api_client import APIClient
+import asyncio
+from utils.api_client import get_api_client
+from utils.async_api_client import AsyncAPIClient, DEFAULT_CONCURRENCY
+from utils.job_journal import JobJournal
+from utils.multi_status import (DEFAULT_CHUNK_SIZE, answered_keys, chunked, get_error_message, get_operation_location,
+                                map_multi_status)
+from utils.preflight import DEFERRED_STATUS, split_online
+from utils.records import DispatchResult
+from utils.target_resolver import read_agent_targets
+from utils.log import setup_logging
 
 class CollectFileManager:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
         self.url_path = "/v3.0/response/endpoints/collectFile"
         self.task_output_dir = "collectFile_exported_results"  # 儲存 Task ID 的資料夾
+        self.chunk_size = DEFAULT_CHUNK_SIZE  # 每個 collectFile 請求包含的項目數
         os.makedirs(self.task_output_dir, exist_ok=True)
 
     def collect_file(self, agent_guid, file_path, description="Collect file task"):
@@ -18,77 +31,273 @@ class CollectFileManager:
         :param file_path: 需要收集的檔案路徑
         :param description: 任務描述（預設為 "Collect file task"）
         """
-        payload = [{
+        payload = self._build_payload(agent_guid, file_path, description)
+        result = self.api_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_result(agent_guid, file_path, result)
+
+    async def collect_file_async(self, async_client, agent_guid, file_path, description="Collect file task"):
+        """
+        `collect_file` 的非同步版本
+        :param async_client: AsyncAPIClient
+        """
+        payload = self._build_payload(agent_guid, file_path, description)
+        result = await async_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_result(agent_guid, file_path, result)
+
+    def _build_item(self, agent_guid, file_path, description="Collect file task"):
+        """產生 collectFile Request Body 中的單一項目"""
+        return {
             "description": description,
             "agentGuid": agent_guid,
             "filePath": file_path
-        }]
+        }
 
-        result = self.api_client.send_request("POST", self.url_path, data=payload)
+    def _build_payload(self, agent_guid, file_path, description):
+        """產生 collectFile 的 Request Body"""
+        return [self._build_item(agent_guid, file_path, description)]
+
+    def _parse_item(self, agent_guid, file_path, item):
+        """將 207 回應中的單一項目轉換為收集結果"""
+        if isinstance(item, dict) and item.get("status") == 202:
+            task_url = get_operation_location(item)
+            return DispatchResult(
+                agent_guid,
+                file_path,
+                task_id=task_url.split("/")[-1] if task_url else "N/A",  # 從 URL 取出 Task ID
+                status="Success" if task_url else "Accepted"
+            )
+        return DispatchResult(agent_guid, file_path, task_id="N/A", status="Failed", error=get_error_message(item))
 
+    def _parse_result(self, agent_guid, file_path, result):
+        """解析 collectFile 的回應，轉換為單一 Agent 的收集結果"""
         if result is None:
             print(f"❌ 無法收集檔案（Agent: {agent_guid}），請檢查 API 權限")
-            return {"agent_guid": agent_guid, "file_path": file_path, "status": "Failed", "task_id": "N/A"}
+            return DispatchResult(agent_guid, file_path, task_id="N/A", status="Failed")
 
         # ✅ 處理 207 Multi-Status 回應
-        if isinstance(result, list) and len(result) > 0 and "status" in result[0]:
-            status_code = result[0]["status"]
-
-            # 如果是 202 Accepted，取得 Task ID
-            if status_code == 202:
-                task_id = None
-                for header in result[0].get("headers", []):
-                    if header["name"] == "Operation-Location":
-                        task_id = header["value"].split("/")[-1]  # 從 URL 取出 Task ID
-                        break
-
-                if task_id:
-                    print(f"✅ 檔案收集成功（Agent: {agent_guid}），Task ID: {task_id}")
-                    return {
-                        "agent_guid": agent_guid,
-                        "file_path": file_path,
-                        "task_id": task_id,
-                        "status": "Success"
-                    }
-                else:
-                    print(f"⚠️ 任務已接受（Agent: {agent_guid}），但未提供 Task ID，請手動檢查 API")
-                    return {
-                        "agent_guid": agent_guid,
-                        "file_path": file_path,
-                        "task_id": "N/A",
-                        "status": "Accepted"
-                    }
+        response = self._parse_item(agent_guid, file_path, result[0] if isinstance(result, list) and result else None)
+        if response["status"] == "Success":
+            print(f"✅ 檔案收集成功（Agent: {agent_guid}），Task ID: {response['task_id']}")
+        elif response["status"] == "Accepted":
+            print(f"⚠️ 任務已接受（Agent: {agent_guid}），但未提供 Task ID，請手動檢查 API")
+        else:
+            print(f"❌ API 回應格式異常（Agent: {agent_guid}），請檢查 API 設定")
+        return response
+
+    def _parse_batch_result(self, targets, result):
+        """將 207 回應逐一對應回 (Agent GUID, 檔案路徑)，每個項目各自一筆結果"""
+        responses = [
+            self._parse_item(agent_guid, file_path, item)
+            for (agent_guid, file_path), item in map_multi_status(targets, result)
+        ]
+        succeeded = sum(1 for r in responses if r["status"] == "Success")
+        print(f"📦 collectFile 批次完成：{succeeded}/{len(responses)} 個項目成功下發")
+        return responses
+
+    def collect_batch(self, targets, description="Collect file task"):
+        """
+        以單一請求收集多台 Agent / 多個檔案（207 Multi-Status）
+        :param targets: [(Agent GUID, 檔案路徑), ...]（建議不超過 `chunk_size`）
+        :param description: 任務描述
+        :return: 與 `targets` 同順序的收集結果列表
+        """
+        return self._parse_batch_result(targets, self._send_batch(targets, description))
+
+    def _send_batch(self, targets, description="Collect file task"):
+        """送出 collectFile 批次請求，回傳未解析的回應"""
+        payload = [self._build_item(agent_guid, file_path, description) for agent_guid, file_path in targets]
+        return self.api_client.send_request("POST", self.url_path, data=payload)
+
+    async def collect_batch_async(self, async_client, targets, description="Collect file task"):
+        """
+        `collect_batch` 的非同步版本
+        :param async_client: AsyncAPIClient
+        """
+        payload = [self._build_item(agent_guid, file_path, description) for agent_guid, file_path in targets]
+        result = await async_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_batch_result(targets, result)
+
+    @staticmethod
+    def _expand_targets(agent_guids, file_paths):
+        """展開 Agent × 檔案路徑（file_paths 可為單一路徑字串或路徑列表）"""
+        if isinstance(file_paths, str):
+            file_paths = [file_paths]
+        file_paths = [p for p in dict.fromkeys(p.strip() for p in file_paths) if p]
+        return [(agent_guid, file_path) for agent_guid in agent_guids for file_path in file_paths]
+
+    @staticmethod
+    def _target_key(agent_guid, file_path):
+        """工作紀錄中 (Agent, 檔案路徑) 的識別字串"""
+        return json.dumps([agent_guid, file_path], ensure_ascii=False)
+
+    def _start_job(self, targets):
+        """開始或接續 collectFile 工作紀錄，回傳 (JobRun, 尚未處理的 targets)"""
+        job = JobJournal().start("collectFile", self.api_client.tenant_name, {},
+                                 [self._target_key(*target) for target in targets])
+        if job.resumed:
+            print(job.summary())
+        return job, [tuple(json.loads(key)) for key in job.pending()]
+
+    def _collect_journaled(self, job, targets, description="Collect file task"):
+        """
+        送出前先記錄項目，取得結果後立即寫入工作紀錄
+        只記錄伺服器有逐項回應的項目；整個請求失敗時移除送出紀錄，續傳時會重新下發
+        """
+        keys = [self._target_key(*target) for target in targets]
+        job.mark_sent(keys)
+        result = self._send_batch(targets, description)
+        responses = self._parse_batch_result(targets, result)
+        answered = answered_keys(keys, result)
+        job.record([(key, response) for key, response in zip(keys, responses) if key in answered])
+        job.release([key for key in keys if key not in answered])
+        return responses
+
+    def _finish_job(self, job, results):
+        """合併上次與本次的結果（依原始順序），並標記工作完成"""
+        by_key = job.done()
+        for key in job.unconfirmed():
+            agent_guid, file_path = json.loads(key)
+            by_key[key] = DispatchResult(agent_guid, file_path, task_id="N/A", status="Unknown",
+                                         error="上次執行中斷，無法確認是否已下發")
+        by_key.update((self._target_key(r["agent_guid"], r["file_path"]), r) for r in results)
+        job.finish()
+        return [by_key[key] for key in job.keys]
+
+    def _preflight(self, targets):
+        """
+        下發前的連線檢查，離線 Agent 的項目寫入延後清單
+        :return: (在線 Agent 的 (Agent, 檔案路徑) 列表, 離線項目的結果列表)
+        """
+        agent_guids = list(dict.fromkeys(agent_guid for agent_guid, _ in targets))
+        _, offline, _ = split_online(agent_guids, self.api_client.tenant_name, "collectFile")
+        online_targets, deferred = [], []
+        for agent_guid, file_path in targets:
+            if agent_guid in offline:
+                deferred.append(DispatchResult(agent_guid, file_path, task_id="N/A", status=DEFERRED_STATUS,
+                                               error=offline[agent_guid]))
+            else:
+                online_targets.append((agent_guid, file_path))
+        return online_targets, deferred
 
-        print(f"❌ API 回應格式異常（Agent: {agent_guid}），請檢查 API 設定")
-        return {"agent_guid": agent_guid, "file_path": file_path, "task_id": "N/A", "status": "Failed"}
+    def _in_order(self, targets, results):
+        """將結果依 (Agent, 檔案路徑) 的原始順序排列"""
+        by_key = {(r["agent_guid"], r["file_path"]): r for r in results}
+        return [by_key[target] for target in targets if target in by_key]
 
-    def collect_from_file(self, agent_file, file_path):
+    def collect_from_file(self, agent_file, file_path, resume=True, preflight=False):
         """
         讀取 Agent GUID 清單，批次執行檔案收集
         :param agent_file: 包含 Agent GUIDs 的 txt 檔案路徑
-        :param file_path: 需要收集的檔案路徑
+        :param file_path: 需要收集的檔案路徑（可為多個路徑的列表）
+        :param resume: 是否使用工作紀錄（中斷後以相同輸入重新執行時跳過已下發的項目）
+        :param preflight: 只下發給 EDR Sensor 在線的 Agent，離線的 Agent 寫入延後清單
         """
-        if not os.path.isfile(agent_file):
-            print(f"❌ 錯誤: 檔案 '{agent_file}' 不存在，請確認路徑")
+        agent_guids = self._read_agent_guids(agent_file)
+        if not agent_guids:
             return
+        return self.collect_targets(agent_guids, file_path, resume, preflight)
 
-        with open(agent_file, "r", encoding="utf-8") as f:
-            agent_guids = [line.strip() for line in f if line.strip()]
+    def collect_targets(self, agent_guids, file_path, resume=True, preflight=False):
+        """
+        對 Agent GUID 列表批次收集檔案（含工作紀錄、連線檢查與匯出），參數同 `collect_from_file`
+        :return: 每個 (Agent, 檔案路徑) 一筆的收集結果列表
+        """
+        targets = self._expand_targets(agent_guids, file_path)
+        job, pending = self._start_job(targets) if resume else (None, targets)
+        try:
+            pending, results = self._preflight(pending) if preflight else (pending, [])
 
+            for chunk in chunked(pending, self.chunk_size):
+                if job:
+                    results.extend(self._collect_journaled(job, chunk))
+                else:
+                    results.extend(self.collect_batch(chunk))
+            results = self._finish_job(job, results) if job else self._in_order(targets, results)
+        finally:
+            if job:
+                job.close()
+
+        self._export(results)
+        return results
+
+    async def collect_from_file_async(self, agent_file, file_path, concurrency=DEFAULT_CONCURRENCY, chunk_size=None,
+                                      resume=True, preflight=False):
+        """
+        `collect_from_file` 的非同步版本，同時最多送出 `concurrency` 個批次請求
+        :param agent_file: 包含 Agent GUIDs 的 txt 檔案路徑
+        :param file_path: 需要收集的檔案路徑（可為多個路徑的列表）
+        :param concurrency: 同時進行的批次請求數上限
+        :param chunk_size: 每個請求包含的項目數，未指定時使用 `self.chunk_size`
+        :param resume: 是否使用工作紀錄（中斷後以相同輸入重新執行時跳過已下發的項目）
+        :param preflight: 只下發給 EDR Sensor 在線的 Agent，離線的 Agent 寫入延後清單
+        """
+        agent_guids = self._read_agent_guids(agent_file)
         if not agent_guids:
-            print("❌ 檔案內沒有有效的 Agent GUID")
             return
+        return await self.collect_targets_async(agent_guids, file_path, concurrency, chunk_size, resume, preflight)
+
+    async def collect_targets_async(self, agent_guids, file_path, concurrency=DEFAULT_CONCURRENCY, chunk_size=None,
+                                    resume=True, preflight=False):
+        """
+        `collect_targets` 的非同步版本，同時最多送出 `concurrency` 個批次請求
+        :return: 每個 (Agent, 檔案路徑) 一筆的收集結果列表
+        """
+        targets = self._expand_targets(agent_guids, file_path)
+        job, pending = self._start_job(targets) if resume else (None, targets)
+        try:
+            pending, results = self._preflight(pending) if preflight else (pending, [])
 
-        results = []
-        for agent_guid in agent_guids:
-            response = self.collect_file(agent_guid, file_path)
-            if response:
-                results.append(response)
+            results += await self._collect_targets_async(pending, concurrency, chunk_size, job=job)
+            results = self._finish_job(job, results) if job else self._in_order(targets, results)
+        finally:
+            if job:
+                job.close()
 
-        # 匯出結果到 CSV
-        self.export_results(results)
+        self._export(results)
+        return results
 
-        # 匯出 Task ID 到 txt
+    async def collect_for_agents_async(self, agent_guids, file_paths, concurrency=DEFAULT_CONCURRENCY,
+                                       chunk_size=None, description="Collect file task"):
+        """
+        對 Agent GUID 列表收集一或多個檔案（不匯出檔案）
+        (Agent, 檔案路徑) 依 `chunk_size` 打包成 207 批次請求，各批次同時送出
+        :param agent_guids: Agent GUID 列表
+        :param file_paths: 需要收集的檔案路徑（單一字串或列表）
+        :param concurrency: 同時進行的批次請求數上限
+        :param chunk_size: 每個請求包含的項目數，未指定時使用 `self.chunk_size`
+        :param description: 任務描述
+        :return: 每個 (Agent, 檔案路徑) 一筆的收集結果列表
+        """
+        targets = self._expand_targets(agent_guids, file_paths)
+        return await self._collect_targets_async(targets, concurrency, chunk_size, description)
+
+    async def _collect_targets_async(self, targets, concurrency=DEFAULT_CONCURRENCY, chunk_size=None,
+                                     description="Collect file task", job=None):
+        """將 (Agent, 檔案路徑) 打包成批次同時送出；指定 `job` 時每個批次的結果會立即寫入工作紀錄"""
+        async with AsyncAPIClient(self.api_client.tenant_name, concurrency) as async_client:
+            if job is None:
+                batches = await asyncio.gather(*[
+                    self.collect_batch_async(async_client, chunk, description)
+                    for chunk in chunked(targets, chunk_size or self.chunk_size)
+                ])
+            else:
+                # 在執行緒池中實際送出前才記錄，排隊中的批次不會被誤判為已送出
+                batches = await asyncio.gather(*[
+                    async_client.run(self._collect_journaled, job, chunk, description)
+                    for chunk in chunked(targets, chunk_size or self.chunk_size)
+                ])
+        return [response for batch in batches for response in batch]
+
+    def _read_agent_guids(self, agent_file):
+        """
+        讀取目標清單（Agent GUID、Endpoint 名稱、IP 或萬用字元），轉換為不重複的 Agent GUID
+        :return: Agent GUID 列表，檔案不存在或沒有有效目標時回傳 None
+        """
+        return read_agent_targets(agent_file, self.api_client.tenant_name) or None
+
+    def _export(self, results):
+        """匯出結果到 CSV 與 Task ID 到 txt"""
+        self.export_results(results)
         self.export_task_ids(results)
 
     def export_results(self, results):
@@ -105,13 +314,14 @@ class CollectFileManager:
         # 寫入 CSV
         with open(file_path, mode="w", newline="", encoding="utf-8") as file:
             writer = csv.writer(file)
-            writer.writerow(["Agent GUID", "File Path", "Task ID", "Status"])
+            writer.writerow(["Agent GUID", "File Path", "Task ID", "Status", "Error"])
             for result in results:
                 writer.writerow([
                     result["agent_guid"],
                     result["file_path"],
                     result["task_id"],
-                    result["status"]
+                    result["status"],
+                    result.get("error", "")
                 ])
 
         print(f"✅ 檔案收集結果已成功匯出至 {file_path}")
@@ -134,10 +344,11 @@ class CollectFileManager:
         print(f"✅ Task ID 已成功匯出至 {file_path}")
 
 if __name__ == "__main__":
+    setup_logging()
     manager = CollectFileManager()
 
     agent_file = input("請輸入包含 Agent GUIDs 的 txt 檔案路徑: ").strip()
-    file_path = input("請輸入要收集的檔案路徑: ").strip()
+    file_paths = input("請輸入要收集的檔案路徑（多個路徑以 ; 分隔）: ").split(";")
 
-    # 迴圈執行所有 GUID，並匯出結果
-    manager.collect_from_file(agent_file, file_path)
+    # 依批次下發所有 (GUID, 路徑)，並匯出結果
+    manager.collect_from_file(agent_file, file_paths)
@@ -1,13 +1,43 @@
 import json
 import os
 import stat
+import tempfile
+import threading
+from types import MappingProxyType
 
 CONFIG_FILE = "tenants.json"
 
+# Process 內共用的設定快照，以設定檔絕對路徑為 key；檔案的 mtime / size 變更時才重新讀取
+_snapshots = {}
+_initialized = set()
+_lock = threading.RLock()  # 保護快照與「讀取 → 修改 → 寫入」流程
+
+
+def _freeze(value):
+    """將設定轉為唯讀結構（dict → MappingProxyType、list → tuple），快照可安全地在執行緒間共用"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class _Snapshot:
+    __slots__ = ("signature", "data")
+
+    def __init__(self, signature, data):
+        self.signature = signature  # (mtime_ns, size)，檔案不存在時為 None
+        self.data = data
+
+
 class ConfigManager:
     def __init__(self):
         self.config_file = CONFIG_FILE
-        self._ensure_config_exists()
+        self._path = os.path.abspath(self.config_file)
+        if self._path not in _initialized:
+            with _lock:
+                self._ensure_config_exists()
+                _initialized.add(self._path)
 
     def _ensure_config_exists(self):
         """確保設定檔存在，若不存在則嘗試從舊 config.py 遷移"""
@@ -37,8 +67,16 @@ class ConfigManager:
             
             self._save_config(initial_data)
 
+    def _signature(self):
+        """設定檔的 (mtime_ns, size)，檔案不存在時回傳 None"""
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
     def _load_config(self):
-        """讀取設定檔"""
+        """讀取設定檔（可修改的副本，供寫入流程使用）"""
         if not os.path.exists(self.config_file):
             return {"active_tenant": "Default", "tenants": {}}
         try:
@@ -47,20 +85,49 @@ class ConfigManager:
         except json.JSONDecodeError:
             return {"active_tenant": "Default", "tenants": {}}
 
+    def _snapshot(self):
+        """取得唯讀的設定快照，只有在檔案 mtime / size 變更時才重新讀取"""
+        signature = self._signature()
+        snapshot = _snapshots.get(self._path)
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot.data
+
+        with _lock:
+            signature = self._signature()
+            snapshot = _snapshots.get(self._path)
+            if snapshot is None or snapshot.signature != signature:
+                snapshot = _Snapshot(signature, _freeze(self._load_config()))
+                _snapshots[self._path] = snapshot
+            return snapshot.data
+
     def _save_config(self, data):
-        """儲存設定檔並設定權限"""
-        with open(self.config_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-        
-        # 設定檔案權限為僅擁有者可讀寫 (600) - Unix-like systems
-        try:
-            os.chmod(self.config_file, stat.S_IRUSR | stat.S_IWUSR)
-        except Exception:
-            pass # Windows 可能不支援或行為不同，忽略錯誤
+        """以「暫存檔 + rename」原子性地儲存設定檔並設定權限"""
+        with _lock:
+            directory = os.path.dirname(self._path)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tenants.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=4, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # 設定檔案權限為僅擁有者可讀寫 (600) - Unix-like systems
+                try:
+                    os.chmod(tmp_path, stat.S_IRUSR | stat.S_IWUSR)
+                except Exception:
+                    pass # Windows 可能不支援或行為不同，忽略錯誤
+
+                os.replace(tmp_path, self._path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            _snapshots[self._path] = _Snapshot(self._signature(), _freeze(data))
 
     def get_active_config(self):
         """取得當前 Active Tenant 的設定"""
-        data = self._load_config()
+        data = self._snapshot()
         active_name = data.get("active_tenant")
         tenant = data.get("tenants", {}).get(active_name)
         
@@ -69,53 +136,68 @@ class ConfigManager:
             
         return tenant.get("api_key"), tenant.get("base_url")
 
+    def get_tenant_config(self, name=None):
+        """
+        取得指定 Tenant 的完整設定
+        :param name: Tenant 名稱，未指定時使用 Active Tenant
+        :return: (Tenant 名稱, 唯讀設定字典)，找不到時設定字典為 None
+        """
+        data = self._snapshot()
+        if name is None:
+            name = data.get("active_tenant")
+        return name, data.get("tenants", {}).get(name)
+
     def get_all_tenants(self):
-        """取得所有 Tenant 列表"""
-        data = self._load_config()
+        """取得所有 Tenant 列表（唯讀）"""
+        data = self._snapshot()
         return data.get("tenants", {})
 
     def get_active_tenant_name(self):
         """取得當前 Active Tenant 名稱"""
-        data = self._load_config()
+        data = self._snapshot()
         return data.get("active_tenant")
 
     def add_tenant(self, name, api_key, base_url, note=""):
-        """新增或更新 Tenant"""
-        data = self._load_config()
-        data["tenants"][name] = {
-            "api_key": api_key,
-            "base_url": base_url,
-            "note": note
-        }
-        # 如果是第一個新增的，設為 Active
-        if len(data["tenants"]) == 1:
-            data["active_tenant"] = name
-            
-        self._save_config(data)
+        """新增或更新 Tenant（保留既有的進階設定，例如 pool_size、rate_limit）"""
+        with _lock:
+            data = self._load_config()
+            tenant = data["tenants"].setdefault(name, {})
+            tenant.update({
+                "api_key": api_key,
+                "base_url": base_url,
+                "note": note
+            })
+            # 如果是第一個新增的，設為 Active
+            if len(data["tenants"]) == 1:
+                data["active_tenant"] = name
+
+            self._save_config(data)
         return True
 
     def delete_tenant(self, name):
         """刪除 Tenant"""
-        data = self._load_config()
-        if name in data["tenants"]:
+        with _lock:
+            data = self._load_config()
+            if name not in data["tenants"]:
+                return False
             del data["tenants"][name]
-            
+
             # 如果刪除的是 Active，且還有其他 Tenant，隨機選一個當 Active
             if data["active_tenant"] == name:
                 if data["tenants"]:
                     data["active_tenant"] = next(iter(data["tenants"]))
                 else:
                     data["active_tenant"] = None
-            
+
             self._save_config(data)
-            return True
-        return False
+        return True
 
     def set_active_tenant(self, name):
         """切換 Active Tenant"""
-        data = self._load_config()
-        if name in data["tenants"]:
+        with _lock:
+            data = self._load_config()
+            if name not in data["tenants"]:
+                return False
             data["active_tenant"] = name
             self._save_config(data)
-            return True
-        return False
+        return True
@@ -1,20 +1,31 @@
 import os
-from utils.api_client import APIClient
+from utils.api_client import PaginationError, get_api_client
+from utils.log import setup_logging
 
 class CustomScriptManager:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
 
-    def list_custom_scripts(self):
-        """列出所有 Custom Scripts"""
+    def list_custom_scripts(self, use_cache=True):
+        """
+        列出所有 Custom Scripts
+        :param use_cache: 使用快取（預設開啟，`update_script` 後會自動清除）
+        :return: Custom Script 列表，分頁讀取失敗時回傳 None（不回傳不完整的清單）
+        """
         endpoint = "/v3.0/response/customScripts"
-        result = self.api_client.send_request("GET", endpoint)
+        try:
+            scripts = list(self.api_client.paginate(endpoint, use_cache=use_cache))
+        except PaginationError as e:
+            print(f"❌ Custom Script 清單讀取失敗：{e}")
+            return None
 
-        if result is None:
-            print("❌ API 回應為 None，請檢查 API Key 或權限")
-            return []
+        if not scripts:
+            print("❌ 沒有取得任何 Custom Script，請檢查 API Key 或權限")
 
-        return result.get("items", [])
+        return scripts
 
     def update_script(self, file_path, file_name, file_type, description):
         """
@@ -46,6 +57,9 @@ class CustomScriptManager:
             print(f"❌ 錯誤: 無法讀取檔案 '{file_path}'，請檢查權限")
             return None
 
+        # Script 清單已變更，清除快取讓下一次查詢取得最新資料
+        self.api_client.invalidate_cache(endpoint)
+
         if result is None:
             print("✅ 更新 Custom Script 成功！(204 No Content)")
             return True  # 返回 True 表示成功
@@ -54,6 +68,7 @@ class CustomScriptManager:
         return result
 
 if __name__ == "__main__":
+    setup_logging()
     manager = CustomScriptManager()
 
     # 讓使用者輸入參數
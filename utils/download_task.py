@@ -7,12 +7,20 @@ import datetime
 import zipfile  # 用於 zip 解壓縮
 import platform
 import shutil
-from utils.api_client import APIClient
+import asyncio
+from utils.api_client import get_api_client
+from utils.async_api_client import AsyncAPIClient, DEFAULT_CONCURRENCY
+from utils.job_journal import JobJournal
+from utils.target_ingest import normalize_task_id, read_targets
+from utils.log import setup_logging
 
 
 class TaskDownloader:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
         self.url_template = "/v3.0/response/tasks/{task_id}"
 
         # 檔案儲存路徑
@@ -64,7 +72,7 @@ class TaskDownloader:
         下載檔案並確保完整性
         """
         try:
-            response = requests.get(url, stream=True, timeout=60)
+            response = self.api_client.session.get(url, stream=True, timeout=60)
             if response.status_code != 200:
                 print(f"❌ 無法下載 (狀態碼: {response.status_code})")
                 return False
@@ -146,73 +154,144 @@ class TaskDownloader:
 
         return extracted_folders
 
-    def process_task(self, task_id):
+    @staticmethod
+    def make_result(task_id, status, password="無密碼", extracted_files="無"):
+        """建立單一 Task 的結果 dict（與 CSV 匯出欄位相同）"""
+        return {
+            "task_id": task_id,
+            "status": status,
+            "password": password,
+            "extracted_files": extracted_files
+        }
+
+    def fetch_archive(self, task_id):
         """
-        執行下載與解壓縮流程
+        查詢下載連結並下載壓縮檔（流程的第一段）
+        :return: (task_info, 壓縮檔路徑, None)；失敗時為 (None, None, 失敗結果)
         """
         task_info = self.get_task_info(task_id)
         if not task_info:
-            return {
-                "task_id": task_id,
-                "status": "Failed",
-                "password": "無密碼",
-                "extracted_files": "無"
-            }
+            return None, None, self.make_result(task_id, "Failed")
 
         # 下載檔案
         filename = f"{task_info['task_id']}.7z"
         zip_path = os.path.join(self.download_dir, filename)
 
         if not self.download_file(task_info["download_url"], zip_path):
-            return {
-                "task_id": task_id,
-                "status": "Download Failed",
-                "password": task_info["password"],
-                "extracted_files": "無"
-            }
+            return None, None, self.make_result(task_id, "Download Failed", task_info["password"])
+        return task_info, zip_path, None
 
+    def extract_archive(self, task_info, zip_path):
+        """
+        解壓縮已下載的 7z 檔案與其中的 assessment.zip（流程的第二段）
+        :return: 結果 dict
+        """
         # 解壓縮 7z 檔案
         extracted_files = self.extract_7z(zip_path, task_info["task_id"], task_info["password"])
         if not extracted_files:
-            return {
-                "task_id": task_id,
-                "status": "Extract Failed",
-                "password": task_info["password"],
-                "extracted_files": "無"
-            }
+            return self.make_result(task_info["task_id"], "Extract Failed", task_info["password"])
 
         # 解壓縮 assessment.zip
         final_extracted_folders = self.extract_assessment_zip(task_info["task_id"])
 
-        return {
-            "task_id": task_id,
-            "status": "Success",
-            "password": task_info["password"],
-            "extracted_files": ", ".join(final_extracted_folders) if final_extracted_folders else "無"
-        }
+        return self.make_result(task_info["task_id"], "Success", task_info["password"],
+                            ", ".join(final_extracted_folders) if final_extracted_folders else "無")
 
-    def process_from_file(self, task_file):
+    def process_task(self, task_id):
+        """
+        執行下載與解壓縮流程
+        """
+        task_info, zip_path, failure = self.fetch_archive(task_id)
+        if failure:
+            return failure
+        return self.extract_archive(task_info, zip_path)
+
+    def start_job(self, task_ids):
+        """
+        開始或接續下載工作紀錄（只有成功的 Task 會被記錄，失敗的 Task 續傳時會重新處理）
+        :return: JobRun，使用完畢後需呼叫 `close()`
+        """
+        job = JobJournal().start("download", self.api_client.tenant_name, {}, task_ids)
+        if job.resumed:
+            print(job.summary())
+        return job
+
+    def _process_journaled(self, job, task_id):
+        """處理 Task 並在成功後立即寫入工作紀錄"""
+        result = self.process_task(task_id)
+        if result["status"] == "Success":
+            job.record([(task_id, result)])
+        return result
+
+    def finish_job(self, job, results):
+        """
+        合併上次與本次的結果（依原始順序）；全部 Task 都有結果時標記工作完成
+        沒有結果的 Task（例如執行中斷）標記為 Not Processed，工作維持未完成，續傳時會重新處理
+        :return: 結果列表
+        """
+        by_id = job.done()
+        by_id.update((r["task_id"], r) for r in results)
+        missing = [task_id for task_id in job.keys if task_id not in by_id]
+        if missing:
+            print(f"⚠️ {len(missing)} 個 Task 沒有結果，以相同清單重新執行時會再處理")
+        else:
+            job.finish()
+        return [by_id.get(task_id) or self.make_result(task_id, "Not Processed") for task_id in job.keys]
+
+    def process_from_file(self, task_file, resume=True):
         """
         讀取 Task ID 清單，批次執行下載與解壓縮
+        :param resume: 是否使用工作紀錄（中斷後以相同輸入重新執行時跳過已下載完成的 Task）
         """
-        if not os.path.isfile(task_file):
-            print(f"❌ 錯誤: 檔案 '{task_file}' 不存在，請確認路徑")
+        task_ids = self._read_task_ids(task_file)
+        if not task_ids:
             return
 
-        with open(task_file, "r", encoding="utf-8") as f:
-            task_ids = [line.strip() for line in f if line.strip()]
+        if not resume:
+            results = [self.process_task(task_id) for task_id in task_ids]
+        else:
+            job = self.start_job(task_ids)
+            try:
+                results = self.finish_job(job, [self._process_journaled(job, task_id) for task_id in job.pending()])
+            finally:
+                job.close()
 
+        # 匯出結果到 CSV
+        self.export_results(results)
+        return results
+
+    async def process_from_file_async(self, task_file, concurrency=DEFAULT_CONCURRENCY, resume=True):
+        """
+        `process_from_file` 的非同步版本，同時最多處理 `concurrency` 個 Task（查詢、下載與解壓縮）
+        :param task_file: 包含 Task ID 的 txt 檔案路徑
+        :param concurrency: 同時處理的 Task 數上限
+        :param resume: 是否使用工作紀錄（中斷後以相同輸入重新執行時跳過已下載完成的 Task）
+        """
+        task_ids = self._read_task_ids(task_file)
         if not task_ids:
-            print("❌ 檔案內沒有有效的 Task ID")
             return
 
-        results = []
-        for task_id in task_ids:
-            result = self.process_task(task_id)
-            results.append(result)
+        async with AsyncAPIClient(self.api_client.tenant_name, concurrency) as async_client:
+            if not resume:
+                results = list(await asyncio.gather(*[
+                    async_client.run(self.process_task, task_id) for task_id in task_ids
+                ]))
+            else:
+                job = self.start_job(task_ids)
+                try:
+                    results = self.finish_job(job, await asyncio.gather(*[
+                        async_client.run(self._process_journaled, job, task_id) for task_id in job.pending()
+                    ]))
+                finally:
+                    job.close()
 
-        # 匯出結果到 CSV
         self.export_results(results)
+        return results
+
+    def _read_task_ids(self, task_file):
+        """讀取 Task ID 清單（檢查格式並去除重複），檔案不存在或沒有有效 Task ID 時回傳 None"""
+        task_ids, _ = read_targets(task_file, normalize_task_id, "Task ID")
+        return task_ids or None
 
     def export_results(self, results):
         """
@@ -242,6 +321,7 @@ class TaskDownloader:
 
 
 if __name__ == "__main__":
+    setup_logging()
     manager = TaskDownloader()
     task_file = input("請輸入 Task ID 清單的 txt 檔案: ").strip()
     manager.process_from_file(task_file)
@@ -0,0 +1,364 @@
+import datetime
+import ipaddress
+import logging
+import sqlite3
+import threading
+import time
+from utils.agentlist import ENDPOINT_LIST_PARAMS, ENDPOINTS_PATH
+from utils.api_client import PaginationError, get_api_client
+from utils.records import EndpointRecord
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INVENTORY_PATH = "endpoint_inventory.db"
+DEFAULT_MAX_AGE = 300  # 超過此秒數未同步時，讀取前會先做增量同步
+FULL_SYNC_INTERVAL = 24 * 3600  # 增量同步無法得知已移除的 Endpoint，定期做完整同步
+SYNC_SKEW = 300  # 增量同步的時間游標往前多取的秒數，避免時鐘誤差漏掉資料
+# 增量同步使用的 TMV1-Filter；API 不接受時會自動改用完整同步
+# 只會取得游標之後有連線的 Endpoint：離線的 Endpoint 不會再出現在增量結果中，其連線狀態要等到下次完整同步
+# （或下發前的 `refresh`）才會更新
+INCREMENTAL_FILTER = "lastConnectedDateTime ge '{since}'"
+REFRESH_BATCH_SIZE = 50  # 以 TMV1-Filter 重新查詢指定 Agent 時，每個請求包含的 GUID 數
+LOOKUP_BATCH_SIZE = 500  # 單一 SQL `IN (...)` 的參數數上限
+BUSY_TIMEOUT = 30  # 其他行程正在寫入時，等待資料庫鎖定釋放的秒數
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS endpoints (
+    tenant TEXT NOT NULL,
+    agent_guid TEXT NOT NULL,
+    endpoint_name TEXT COLLATE NOCASE,
+    last_used_ip TEXT,
+    os_name TEXT COLLATE NOCASE,
+    connectivity TEXT,
+    sync_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (tenant, agent_guid)
+);
+CREATE INDEX IF NOT EXISTS idx_endpoints_name ON endpoints (tenant, endpoint_name);
+CREATE INDEX IF NOT EXISTS idx_endpoints_ip ON endpoints (tenant, last_used_ip);
+CREATE INDEX IF NOT EXISTS idx_endpoints_os ON endpoints (tenant, os_name);
+CREATE TABLE IF NOT EXISTS sync_state (
+    tenant TEXT PRIMARY KEY,
+    sync_id INTEGER NOT NULL,
+    last_full_sync REAL,
+    last_sync REAL,
+    cursor TEXT
+);
+"""
+
+COLUMNS = "agent_guid, endpoint_name, last_used_ip, os_name, connectivity"
+LOOKUP_FIELDS = {"name": "endpoint_name", "ip": "last_used_ip"}
+
+
+def ip_in_network(ip, network):
+    """SQLite 自訂函式：IP 是否在網段（CIDR）內，IP 格式錯誤時回傳 0"""
+    try:
+        return int(ipaddress.ip_address(ip) in ipaddress.ip_network(network, strict=False))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _to_row(tenant_name, sync_id, now, item):
+    return (
+        tenant_name,
+        item.get("agentGuid", "").lower(),
+        item.get("endpointName"),
+        item.get("lastUsedIp"),
+        item.get("osName"),
+        (item.get("edrSensor") or {}).get("connectivity", "Disconnected"),
+        sync_id,
+        now
+    )
+
+
+class EndpointInventory:
+    """
+    本機 Endpoint 清單（SQLite WAL），每個 Tenant 各自同步
+
+    第一次使用時完整同步；之後以時間游標做增量同步，並每 FULL_SYNC_INTERVAL 做一次完整同步以移除已刪除的 Endpoint。
+    增量同步以 lastConnectedDateTime 為游標，無法得知 Endpoint 轉為離線；需要最新連線狀態時請使用 `refresh`。
+    讀取皆在本機完成，GUID、名稱、IP 與 OS 均有索引；查詢結果為 EndpointRecord（`list_endpoints` 除外）。
+    """
+
+    def __init__(self, tenant_name=None, path=DEFAULT_INVENTORY_PATH):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        :param path: SQLite 檔案路徑
+        """
+        self.api_client = get_api_client(tenant_name)
+        self.tenant_name = self.api_client.tenant_name
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.create_function("ip_in_network", 2, ip_in_network, deterministic=True)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 同步 ----------
+
+    def sync_state(self):
+        """取得同步狀態 {"sync_id", "last_full_sync", "last_sync", "cursor"}，尚未同步時回傳 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sync_id, last_full_sync, last_sync, cursor FROM sync_state WHERE tenant = ?",
+                (self.tenant_name,)
+            ).fetchone()
+        return dict(zip(["sync_id", "last_full_sync", "last_sync", "cursor"], row)) if row else None
+
+    def _fetch_all(self, extra_headers=None):
+        """
+        取得 Endpoint 清單（自動跟隨 nextLink 分頁）
+        :return: 有 agentGuid 的項目列表，任一頁失敗時回傳 None
+        """
+        try:
+            return [item for item in self.api_client.paginate(ENDPOINTS_PATH, params=ENDPOINT_LIST_PARAMS,
+                                                               extra_headers=extra_headers)
+                    if item.get("agentGuid")]
+        except PaginationError as e:
+            logger.warning("%s", e)
+            return None
+
+    def sync(self, full=False):
+        """
+        同步 Endpoint 清單
+        :param full: 強制完整同步（否則在可行時做增量同步）
+        :return: {"mode", "fetched", "removed", "seconds"}，失敗時回傳 None（本機資料維持不變）
+        """
+        state = self.sync_state()
+        if state is None or not state["cursor"] or not state["last_full_sync"] \
+                or time.time() - state["last_full_sync"] > FULL_SYNC_INTERVAL:
+            full = True
+
+        if not full:
+            result = self._sync(state, full=False)
+            if result is not None:
+                return result
+            logger.warning("增量同步失敗，改用完整同步（Tenant: %s）", self.tenant_name)
+        return self._sync(state, full=True)
+
+    def _sync(self, state, full):
+        started = time.time()
+        cursor = datetime.datetime.fromtimestamp(started - SYNC_SKEW, datetime.timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%SZ")
+        extra_headers = None if full else {"TMV1-Filter": INCREMENTAL_FILTER.format(since=state["cursor"])}
+
+        # 先取得所有分頁再寫入，呼叫 API 期間不持有資料庫鎖定
+        items = self._fetch_all(extra_headers)
+        if items is None:
+            print(f"❌ Endpoint 清單{'完整' if full else '增量'}同步失敗，保留既有資料")
+            return None
+        fetched = len(items)
+
+        removed = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 在寫入交易內重新讀取 sync_id，避免與同時進行的同步使用相同的編號
+                row = self._conn.execute("SELECT sync_id FROM sync_state WHERE tenant = ?",
+                                         (self.tenant_name,)).fetchone()
+                sync_id = (row[0] if row else 0) + 1
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO endpoints (tenant, agent_guid, endpoint_name, last_used_ip, os_name, "
+                    "connectivity, sync_id, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [_to_row(self.tenant_name, sync_id, started, item) for item in items]
+                )
+                if full:
+                    # 完整同步時未出現的 Endpoint 視為已移除
+                    removed = self._conn.execute(
+                        "DELETE FROM endpoints WHERE tenant = ? AND sync_id != ?", (self.tenant_name, sync_id)
+                    ).rowcount
+                self._conn.execute(
+                    "INSERT INTO sync_state (tenant, sync_id, last_full_sync, last_sync, cursor) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(tenant) DO UPDATE SET sync_id = excluded.sync_id, "
+                    "last_full_sync = COALESCE(excluded.last_full_sync, sync_state.last_full_sync), "
+                    "last_sync = excluded.last_sync, cursor = excluded.cursor",
+                    (self.tenant_name, sync_id, started if full else None, started, cursor)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        result = {"mode": "full" if full else "incremental", "fetched": fetched, "removed": removed,
+                  "seconds": round(time.time() - started, 2)}
+        print(f"✅ Endpoint 清單{'完整' if full else '增量'}同步完成：取得 {fetched} 筆，移除 {removed} 筆"
+              f"（{result['seconds']} 秒）")
+        return result
+
+    def refresh(self, agent_guids, batch_size=REFRESH_BATCH_SIZE):
+        """
+        只重新取得指定 Agent 的資料（以 TMV1-Filter 分批查詢），用於下發前確認最新的連線狀態
+        :return: 成功更新的筆數，任一批次失敗時回傳 None（已成功的批次仍會保留）
+        """
+        state = self.sync_state()
+        if state is None:
+            return None if self.sync(full=True) is None else len(agent_guids)
+
+        updated = 0
+        guids = list(dict.fromkeys(guid.lower() for guid in agent_guids))
+        for start in range(0, len(guids), batch_size):
+            batch = guids[start:start + batch_size]
+            endpoints = self.fetch_filtered(" or ".join(f"agentGuid eq '{guid}'" for guid in batch), state)
+            if endpoints is None:
+                print("❌ 無法更新 Endpoint 連線狀態，將使用本機既有資料")
+                return None
+            updated += len(endpoints)
+        return updated
+
+    def fetch_filtered(self, tmv1_filter, state=None):
+        """
+        以 TMV1-Filter 直接向 API 查詢，並將結果寫回本機清單（已完整同步過時）
+        :param tmv1_filter: TMV1-Filter 條件，例如 "osName eq 'Windows'"
+        :param state: `sync_state()` 的結果，未指定時重新讀取
+        :return: 符合條件的 EndpointRecord 列表，API 失敗或不接受條件時回傳 None
+        """
+        now = time.time()
+        items = self._fetch_all({"TMV1-Filter": tmv1_filter})
+        if items is None:
+            return None
+
+        rows = [_to_row(self.tenant_name, 0, now, item) for item in items]
+        state = state or self.sync_state()
+        if state is not None:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO endpoints (tenant, agent_guid, endpoint_name, last_used_ip, os_name, "
+                        "connectivity, sync_id, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [row[:6] + (state["sync_id"], now) for row in rows]
+                    )
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        return [EndpointRecord.from_row(row[1:6]) for row in rows]
+
+    def ensure_fresh(self, max_age=DEFAULT_MAX_AGE):
+        """
+        本機資料超過 `max_age` 秒未同步時先同步（從未同步時做完整同步）
+        :return: 有同步時回傳 `sync` 的結果，否則回傳 None
+        """
+        state = self.sync_state()
+        if state is not None and state["last_sync"] and time.time() - state["last_sync"] <= max_age:
+            return None
+        return self.sync()
+
+    # ---------- 查詢 ----------
+
+    def _select(self, where="", params=(), limit=None):
+        sql = f"SELECT {COLUMNS} FROM endpoints WHERE tenant = ?"
+        if where:
+            sql += f" AND ({where})"
+        sql += " ORDER BY agent_guid"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [EndpointRecord.from_row(row) for row in self._conn.execute(sql, (self.tenant_name, *params))]
+
+    def query(self, where="", params=(), limit=None):
+        """
+        以 SQL 條件查詢（欄位：agent_guid、endpoint_name、last_used_ip、os_name、connectivity）
+        可使用自訂函式 `ip_in_network(last_used_ip, '10.0.0.0/16')`
+        :return: EndpointRecord 列表
+        """
+        return self._select(where, params, limit)
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM endpoints WHERE tenant = ?",
+                                      (self.tenant_name,)).fetchone()[0]
+
+    def list_records(self):
+        """列出全部 Endpoint（EndpointRecord）"""
+        return self._select()
+
+    def list_endpoints(self):
+        """列出全部 Endpoint（與 `ClientManager.list_all_clients` 相同格式的 dict，用於匯出與相容既有程式）"""
+        return [record.to_endpoint() for record in self._select()]
+
+    def get_many(self, agent_guids):
+        """
+        依 Agent GUID 批次查詢
+        :return: {agent_guid: EndpointRecord}，找不到的 GUID 不會出現在結果中
+        """
+        found = {}
+        guids = [guid.lower() for guid in agent_guids]
+        for start in range(0, len(guids), LOOKUP_BATCH_SIZE):
+            batch = guids[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for endpoint in self._select(f"agent_guid IN ({placeholders})", batch):
+                found[endpoint.agent_guid] = endpoint
+        return found
+
+    def lookup(self, field, values):
+        """
+        以名稱或 IP 批次精確比對（名稱不分大小寫）
+        :param field: "name" 或 "ip"
+        :param values: 名稱或 IP 列表
+        :return: {小寫的名稱或 IP: [EndpointRecord, ...]}，找不到的值不會出現在結果中
+        """
+        column = LOOKUP_FIELDS[field]
+        found = {}
+        values = list(values)
+        for start in range(0, len(values), LOOKUP_BATCH_SIZE):
+            batch = values[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for endpoint in self._select(f"{column} IN ({placeholders})", batch):
+                found.setdefault((getattr(endpoint, column) or "").lower(), []).append(endpoint)
+        return found
+
+    def find(self, name=None, ip=None, os_name=None, connectivity=None, limit=None):
+        """
+        依條件查詢（皆為選填，多個條件為 AND）
+        :param name: Endpoint 名稱（不分大小寫），可使用萬用字元 `*`、`?`
+        :param ip: IP，可使用萬用字元 `*`、`?`
+        :param os_name: 作業系統名稱（不分大小寫），可使用萬用字元 `*`、`?`
+        :param connectivity: EDR Sensor 連線狀態（例如 "Connected"）
+        """
+        clauses, params = [], []
+        for column, value in (("endpoint_name", name), ("last_used_ip", ip), ("os_name", os_name)):
+            if value:
+                clause, clause_params = match_clause(column, value)
+                clauses.append(clause)
+                params.extend(clause_params)
+        if connectivity:
+            clauses.append("connectivity = ? COLLATE NOCASE")
+            params.append(connectivity)
+        return self._select(" AND ".join(clauses), params, limit)
+
+
+def match_clause(column, value):
+    """
+    產生單一欄位的比對條件，可使用萬用字元 `*`、`?`
+    :return: (SQL 條件, 參數列表)
+    """
+    prefix = value[:-1]
+    if value.endswith("*") and not any(c in prefix for c in "*?"):
+        # 以範圍條件做前綴比對，可直接使用索引
+        return f"{column} >= ? AND {column} < ?", [prefix, prefix + "\U0010ffff"]
+    if "*" in value or "?" in value:
+        return f"{column} LIKE ? ESCAPE '\\'", [_to_like(value)]
+    return f"{column} = ?", [value]
+
+
+def _to_like(pattern):
+    """將萬用字元（`*`、`?`）轉為 SQL LIKE 樣式"""
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    inventory = EndpointInventory()
+    try:
+        inventory.sync(full=input("是否完整同步？(Y/N): ").strip().lower() == "y")
+        print(f"📋 本機共有 {inventory.count()} 筆 Endpoint")
+    finally:
+        inventory.close()
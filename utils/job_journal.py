@@ -0,0 +1,210 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+
+DEFAULT_JOURNAL_PATH = "job_journal.db"
+
+STATE_SENT = "sent"  # 請求已送出但尚未取得結果（中斷時無法確認是否已執行）
+STATE_DONE = "done"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    tenant TEXT,
+    params TEXT,
+    total INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (job_id, item_key)
+);
+"""
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def make_job_id(kind, tenant_name, params, keys):
+    """
+    以工作類型、Tenant、參數與項目清單產生固定的 Job ID
+    相同輸入重新執行時會得到相同的 Job ID，因此可以接續未完成的工作
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([kind, tenant_name, params], sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for key in keys:
+        digest.update(b"\0" + key.encode("utf-8"))
+    return f"{kind}-{digest.hexdigest()[:16]}"
+
+
+class JobJournal:
+    """
+    批次工作的磁碟紀錄（SQLite WAL 模式，執行緒安全）
+
+    每個批次完成後立即寫入結果；程式中斷後以相同輸入重新執行時，
+    已完成的項目直接沿用紀錄，不會重複下發。
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        """
+        :param path: SQLite 檔案路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL 模式下 commit 後即使 process 中斷也不會遺失
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def start(self, kind, tenant_name, params, keys):
+        """
+        開始或接續工作
+        :param kind: 工作類型（例如 "runScript"）
+        :param tenant_name: Tenant 名稱
+        :param params: 會影響執行內容的參數（dict）
+        :param keys: 所有項目的識別字串列表
+        :return: JobRun
+        """
+        keys = list(keys)
+        job_id = make_job_id(kind, tenant_name, params, keys)
+        with self._lock:
+            row = self._conn.execute("SELECT finished_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row and row[0]:
+                # 上次已完整執行完畢：視為新的工作重新開始
+                self._conn.execute("BEGIN")
+                self._conn.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+                self._conn.execute("COMMIT")
+                row = None
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO jobs (job_id, kind, tenant, params, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, tenant_name, json.dumps(params, ensure_ascii=False), len(keys), _now())
+                )
+            states = {
+                key: (state, json.loads(result) if result else None)
+                for key, state, result in self._conn.execute(
+                    "SELECT item_key, state, result FROM items WHERE job_id = ?", (job_id,)
+                )
+            }
+        return JobRun(self, job_id, keys, states)
+
+    def mark_sent(self, job_id, keys):
+        """在送出請求前記錄項目，之後中斷時可得知哪些項目狀態不明"""
+        now = _now()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO items (job_id, item_key, state, updated_at) VALUES (?, ?, ?, ?)",
+                [(job_id, key, STATE_SENT, now) for key in keys]
+            )
+            self._conn.execute("COMMIT")
+
+    def record(self, job_id, key_results):
+        """
+        寫入項目結果（單一交易）
+        :param key_results: [(項目識別, 結果 dict 或 DispatchResult), ...]
+        """
+        now = _now()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO items (job_id, item_key, state, result, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, key, STATE_DONE, json.dumps(dict(result), ensure_ascii=False), now)
+                 for key, result in key_results]
+            )
+            self._conn.execute("COMMIT")
+
+    def release(self, job_id, keys):
+        """
+        移除項目的送出紀錄（整個請求失敗、伺服器沒有逐項回應時），續傳時這些項目會重新處理
+        只移除尚未取得結果的項目
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "DELETE FROM items WHERE job_id = ? AND item_key = ? AND state = ?",
+                [(job_id, key, STATE_SENT) for key in keys]
+            )
+            self._conn.execute("COMMIT")
+
+    def finish(self, job_id):
+        """標記工作完成"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET finished_at = ? WHERE job_id = ?", (_now(), job_id))
+
+    def list_jobs(self, unfinished_only=False):
+        """
+        列出工作與進度
+        :return: [{"job_id", "kind", "tenant", "total", "done", "created_at", "finished_at"}, ...]
+        """
+        sql = (
+            "SELECT j.job_id, j.kind, j.tenant, j.total, "
+            "(SELECT COUNT(*) FROM items i WHERE i.job_id = j.job_id AND i.state = ?), j.created_at, j.finished_at "
+            "FROM jobs j"
+        )
+        if unfinished_only:
+            sql += " WHERE j.finished_at IS NULL"
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY j.created_at DESC", (STATE_DONE,)).fetchall()
+        fields = ["job_id", "kind", "tenant", "total", "done", "created_at", "finished_at"]
+        return [dict(zip(fields, row)) for row in rows]
+
+
+class JobRun:
+    """單一工作的執行狀態，由 `JobJournal.start` 建立"""
+
+    def __init__(self, journal, job_id, keys, states):
+        self.journal = journal
+        self.job_id = job_id
+        self.keys = keys
+        self._states = states
+
+    @property
+    def resumed(self):
+        return bool(self._states)
+
+    def done(self):
+        """上次已完成的 {項目識別: 結果}"""
+        return {key: result for key, (state, result) in self._states.items() if state == STATE_DONE}
+
+    def unconfirmed(self):
+        """上次已送出但未取得結果的項目（可能已在端點上執行）"""
+        return [key for key, (state, _) in self._states.items() if state == STATE_SENT]
+
+    def pending(self):
+        """尚未處理的項目（保留原始順序）"""
+        return [key for key in self.keys if key not in self._states]
+
+    def mark_sent(self, keys):
+        self.journal.mark_sent(self.job_id, keys)
+
+    def record(self, key_results):
+        self.journal.record(self.job_id, key_results)
+
+    def release(self, keys):
+        self.journal.release(self.job_id, keys)
+
+    def close(self):
+        self.journal.close()
+
+    def finish(self):
+        self.journal.finish(self.job_id)
+
+    def summary(self):
+        """續傳時印出的說明文字"""
+        return (f"♻️ 接續未完成的工作 {self.job_id}：已完成 {len(self.done())} 筆，"
+                f"狀態不明 {len(self.unconfirmed())} 筆（不重送），剩餘 {len(self.pending())} 筆")
@@ -0,0 +1,13 @@
+import logging
+import os
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+
+def setup_logging(level=None):
+    """
+    設定 Log 輸出（Streamlit 每次 rerun 重複呼叫也只會設定一次）
+    :param level: Log 等級，未指定時讀取環境變數 V1_LOG_LEVEL（預設 INFO）；DEBUG 才會輸出完整 Payload
+    """
+    level = (level or os.environ.get("V1_LOG_LEVEL") or "INFO").upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
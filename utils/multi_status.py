@@ -0,0 +1,55 @@
+import logging
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50  # 每個 207 Multi-Status 請求包含的項目數
+
+
+def chunked(iterable, size):
+    """將 iterable 依 `size` 切成多個 list（最後一組可能較少）"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_operation_location(item):
+    """取得 207 項目中 Operation-Location 標頭的值（Task URL），沒有時回傳 None"""
+    for header in (item or {}).get("headers", []) or []:
+        if header.get("name", "").lower() == "operation-location":
+            return header.get("value")
+    return None
+
+
+def get_error_message(item):
+    """取得 207 項目中的錯誤訊息"""
+    body = (item or {}).get("body") or {}
+    error = body.get("error") if isinstance(body, dict) else None
+    if isinstance(error, dict):
+        return error.get("message") or error.get("code") or ""
+    return ""
+
+
+def map_multi_status(keys, result):
+    """
+    將 207 Multi-Status 回應依請求順序對應回各項目
+    :param keys: 與 Request Body 同順序的識別列表（例如 Agent GUID）
+    :param result: `send_request` 的回傳值
+    :return: [(key, 回應項目或 None), ...]，整個請求失敗時每個項目皆為 None
+    """
+    items = result if isinstance(result, list) else []
+    if items and len(items) != len(keys):
+        logger.warning("207 回應筆數 (%d) 與請求筆數 (%d) 不符，無法對應的項目視為失敗", len(items), len(keys))
+    return [(key, items[i] if i < len(items) else None) for i, key in enumerate(keys)]
+
+
+def answered_keys(keys, result):
+    """
+    伺服器有逐項回應的項目（成功或失敗皆算）；整個請求失敗時回傳空集合
+    工作紀錄只記錄這些項目，其餘項目續傳時會重新下發
+    """
+    items = result if isinstance(result, list) else []
+    return {key for key, item in zip(keys, items) if isinstance(item, dict)}
@@ -0,0 +1,176 @@
+import asyncio
+import csv
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils.endpoint_inventory import EndpointInventory
+from utils.all_tasks_status import fetch_all_tasks
+from utils.async_api_client import DEFAULT_CONCURRENCY
+from utils.config_manager import ConfigManager
+from utils.custom_script import CustomScriptManager
+from utils.run_custom_script import RunCustomScriptManager
+from utils.target_ingest import IngestReport, normalize_agent_guid
+from utils.yara_rule_list import YaraRuleManager
+
+DEFAULT_MAX_TENANTS = 8  # 同時處理的 Tenant 數；每個 Tenant 仍各自受連線池與限流設定約束
+TENANT_FIELD = "tenant"
+
+
+def _tag(rows, tenant_name):
+    """在每筆資料加上 Tenant 名稱"""
+    return [dict(row, **{TENANT_FIELD: tenant_name}) for row in rows or []]
+
+
+def _check_tenants(tenant_names):
+    """過濾掉不存在或未設定 API Key / Base URL 的 Tenant，回傳 (可用的 Tenant 列表, 錯誤字典)"""
+    tenants = ConfigManager().get_all_tenants()
+    valid, errors = [], {}
+    for name in dict.fromkeys(tenant_names):  # 去除重複並保留順序
+        tenant = tenants.get(name)
+        if not tenant:
+            errors[name] = "Tenant 不存在"
+        elif not tenant.get("api_key") or not tenant.get("base_url"):
+            errors[name] = "未設定 API Key 或 Base URL"
+        else:
+            valid.append(name)
+    return valid, errors
+
+
+def fan_out(tenant_names, func, max_workers=DEFAULT_MAX_TENANTS):
+    """
+    對多個 Tenant 同時執行 `func(tenant_name)`，並將結果合併為同一張表
+    :param tenant_names: Tenant 名稱列表
+    :param func: 接收 Tenant 名稱、回傳 dict 列表的函式（失敗時回傳 None 或拋出例外）
+    :param max_workers: 同時處理的 Tenant 數上限
+    :return: (合併後的資料列表（每筆含 "tenant" 欄位）, {Tenant 名稱: 錯誤訊息})
+    """
+    tenant_names, errors = _check_tenants(tenant_names)
+    if not tenant_names:
+        return [], errors
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tenant_names))),
+                            thread_name_prefix="v1-tenant") as executor:
+        futures = {name: executor.submit(func, name) for name in tenant_names}
+        for name, future in futures.items():
+            try:
+                result = future.result()
+                if result is None:
+                    errors[name] = "讀取失敗，請查看 Log"
+                    continue
+                rows.extend(_tag(result, name))
+            except Exception as e:
+                print(f"❌ Tenant {name} 執行失敗: {e}")
+                errors[name] = str(e)
+    return rows, errors
+
+
+def _list_inventory(tenant_name):
+    """從本機 Endpoint 清單讀取（超過時效時先同步）"""
+    inventory = EndpointInventory(tenant_name)
+    try:
+        inventory.ensure_fresh()
+        return inventory.list_endpoints()
+    finally:
+        inventory.close()
+
+
+def list_clients_for_tenants(tenant_names, max_workers=DEFAULT_MAX_TENANTS):
+    """列出多個 Tenant 的全部 Client（讀取本機 Endpoint 清單）"""
+    return fan_out(tenant_names, _list_inventory, max_workers)
+
+
+def fetch_tasks_for_tenants(tenant_names, max_workers=DEFAULT_MAX_TENANTS):
+    """取得多個 Tenant 的全部 Task"""
+    return fan_out(tenant_names, lambda name: fetch_all_tasks(tenant_name=name), max_workers)
+
+
+def list_custom_scripts_for_tenants(tenant_names, max_workers=DEFAULT_MAX_TENANTS):
+    """列出多個 Tenant 的 Custom Scripts"""
+    return fan_out(tenant_names, lambda name: CustomScriptManager(name).list_custom_scripts(), max_workers)
+
+
+def list_yara_rules_for_tenants(tenant_names, max_workers=DEFAULT_MAX_TENANTS):
+    """列出多個 Tenant 的 YARA 規則"""
+    return fan_out(tenant_names, lambda name: YaraRuleManager(name).list_yara_rules(), max_workers)
+
+
+def read_tenant_targets(file_path):
+    """
+    讀取多 Tenant 的目標清單，每行格式為 `Tenant 名稱,Agent GUID`（可含標題列）
+    格式錯誤的 GUID 與同一 Tenant 內重複的 GUID 會被略過並列在報告中
+    :return: {Tenant 名稱: [Agent GUID, ...]}
+    """
+    targets, seen = {}, set()
+    report = IngestReport("Tenant,Agent GUID")
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+        for line_no, row in enumerate(csv.reader(f), start=1):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                continue
+            tenant_name = row[0].strip()
+            if tenant_name.lower() == TENANT_FIELD:  # 標題列
+                continue
+            agent_guid = normalize_agent_guid(row[1].strip())
+            if agent_guid is None:
+                report.reject(line_no, ",".join(row)[:80], "Agent GUID 格式錯誤")
+                continue
+            if (tenant_name, agent_guid) in seen:
+                report.duplicates += 1
+                continue
+            seen.add((tenant_name, agent_guid))
+            report.accepted += 1
+            targets.setdefault(tenant_name, []).append(agent_guid)
+    report.print_report()
+    return targets
+
+
+async def run_script_for_tenants_async(targets, file_name, parameters=None, concurrency=DEFAULT_CONCURRENCY):
+    """
+    同時對多個 Tenant 下發 Custom Script，每個 Tenant 使用各自的連線池與限流
+    :param targets: {Tenant 名稱: [Agent GUID, ...]}
+    :param file_name: 要執行的 Custom Script 檔案名稱
+    :param parameters: 腳本執行時的參數（可選）
+    :param concurrency: 每個 Tenant 同時進行的請求數上限
+    :return: (合併後的執行結果列表（每筆含 "tenant" 欄位）, {Tenant 名稱: 錯誤訊息})
+    """
+    names, errors = _check_tenants([name for name, guids in targets.items() if guids])
+
+    async def run_one(name):
+        manager = RunCustomScriptManager(name)
+        return await manager.run_for_agents_async(targets[name], file_name, parameters, concurrency)
+
+    outcomes = await asyncio.gather(*[run_one(name) for name in names], return_exceptions=True)
+
+    rows = []
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"❌ Tenant {name} 執行失敗: {outcome}")
+            errors[name] = str(outcome)
+        else:
+            rows.extend(_tag(outcome, name))
+    return rows, errors
+
+
+def export_tenant_results(rows, prefix, output_dir="multi_tenant_results"):
+    """
+    將合併後的多 Tenant 結果匯出至 CSV（Tenant 欄位放在第一欄）
+    :return: CSV 路徑，沒有資料時回傳 None
+    """
+    if not rows:
+        print("❌ 沒有可匯出的結果")
+        return None
+
+    fields = [TENANT_FIELD]
+    for row in rows:
+        fields.extend(k for k in row if k not in fields)
+
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    file_path = os.path.join(output_dir, f"{prefix}_{timestamp}.csv")
+    with open(file_path, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"✅ 多 Tenant 結果已成功匯出至 {file_path}")
+    return file_path
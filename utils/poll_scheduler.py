@@ -0,0 +1,224 @@
+import calendar
+import logging
+import math
+import sqlite3
+import threading
+import time
+from utils.endpoint_inventory import EndpointInventory
+from utils.records import is_terminal
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_PATH = "task_latency.db"
+MIN_POLL_INTERVAL = 10  # 秒
+MAX_POLL_INTERVAL = 3600
+BACKOFF_BASE = 30  # 超過 p90 仍未完成的 Task：30、60、120 … 秒後再查
+MIN_SAMPLES = 5  # (動作, OS) 的樣本數不足時改用同動作全部 OS 的統計
+SAMPLE_LIMIT = 200  # 每個分組只使用最近的樣本
+# 沒有任何樣本時的預估完成時間（秒）：(中位數, p90)
+DEFAULT_EXPECTED = {
+    "collectFile": (60, 300),
+    "runScript": (120, 600),
+    "runYaraRules": (300, 1800),
+}
+FALLBACK_EXPECTED = (120, 900)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS latency (
+    task_id TEXT PRIMARY KEY,
+    action TEXT,
+    os_name TEXT,
+    seconds REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_latency_group ON latency (action, os_name, finished_at);
+"""
+
+
+def parse_time(timestamp):
+    """將 API 的 UTC 時間字串（例如 2024-01-01T00:00:00Z）轉為 epoch 秒數，無法解析時回傳 None"""
+    try:
+        return calendar.timegm(time.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(sorted_values, ratio):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+class LatencyStats:
+    """
+    Task 從下發到完成的時間統計（SQLite），依動作（runScript、collectFile、runYaraRules …）與 OS 分組
+    時間取自 API 的 createdDateTime 與 lastActionDateTime，不受輪詢間隔影響；同一個 Task 只記錄一次
+    """
+
+    def __init__(self, path=DEFAULT_LATENCY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._cache = {}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def observe(self, records, os_names=None):
+        """
+        記錄已完成 Task 的完成時間（未完成或時間不完整的 Task 會略過）
+        :param records: TaskRecord 列表
+        :param os_names: {agent_guid: OS 名稱}
+        :return: 新增的樣本數
+        """
+        os_names = os_names or {}
+        rows = []
+        for record in records:
+            if not is_terminal(record.status):
+                continue
+            created, finished = parse_time(record.created), parse_time(record.updated)
+            if created is None or finished is None or finished < created:
+                continue
+            rows.append((record.task_id, record.action, os_names.get(record.agent_guid), finished - created,
+                         finished))
+        if not rows:
+            return 0
+
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO latency (task_id, action, os_name, seconds, finished_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.execute("COMMIT")
+            added = self._conn.total_changes - before
+            if added:
+                self._cache.clear()
+        return added
+
+    def _samples(self, action, os_name):
+        where, params = "action IS ?", [action]
+        if os_name is not None:
+            where += " AND os_name = ?"
+            params.append(os_name)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT seconds FROM latency WHERE {where} ORDER BY finished_at DESC LIMIT {SAMPLE_LIMIT}", params
+            ).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def expected(self, action, os_name=None):
+        """
+        預估完成時間
+        :return: (中位數秒數, p90 秒數, 樣本數)；樣本不足時依序改用同動作全部 OS、DEFAULT_EXPECTED
+        """
+        key = (action, os_name)
+        if key not in self._cache:
+            result = None
+            for group_os in ([os_name] if os_name else []) + [None]:
+                samples = self._samples(action, group_os)
+                if len(samples) >= MIN_SAMPLES:
+                    result = (_percentile(samples, 0.5), _percentile(samples, 0.9), len(samples))
+                    break
+            if result is None:
+                median, p90 = DEFAULT_EXPECTED.get(action, FALLBACK_EXPECTED)
+                result = (median, p90, 0)
+            self._cache[key] = result
+        return self._cache[key]
+
+    def summary(self):
+        """各分組的統計：[{"action", "os_name", "samples", "median", "p90"}]"""
+        groups = {}
+        with self._lock:
+            for action, os_name, seconds in self._conn.execute(
+                    "SELECT action, os_name, seconds FROM latency ORDER BY finished_at DESC"):
+                samples = groups.setdefault((action or "", os_name or ""), [])
+                if len(samples) < SAMPLE_LIMIT:
+                    samples.append(seconds)
+        rows = []
+        for (action, os_name), samples in sorted(groups.items()):
+            samples.sort()
+            rows.append({"action": action, "os_name": os_name, "samples": len(samples),
+                         "median": round(_percentile(samples, 0.5), 1), "p90": round(_percentile(samples, 0.9), 1)})
+        return rows
+
+
+class PollScheduler:
+    """
+    依完成時間統計決定每個 Task 的下次查詢時間
+
+    - 下發後約在中位數時間第一次查詢（快速的 collectFile 不必等滿 90 秒）
+    - 超過中位數則在 p90 時再查
+    - 超過 p90 仍未完成時指數退避：p90 之後 BACKOFF_BASE、2 倍、4 倍 … 秒（依 Task 年齡計算，重新啟動也不會重置）
+    - 間隔限制在 MIN_POLL_INTERVAL ~ MAX_POLL_INTERVAL 之間
+    """
+
+    def __init__(self, stats=None):
+        """
+        :param stats: LatencyStats，未指定時使用預設檔案
+        """
+        self.stats = stats or LatencyStats()
+
+    def delay(self, record, os_name=None, now=None):
+        """
+        距離下次查詢的秒數
+        :param record: 尚未完成的 TaskRecord
+        :param os_name: Task 所在 Endpoint 的 OS
+        """
+        now = time.time() if now is None else now
+        created = parse_time(record.created)
+        age = max(0.0, now - created) if created is not None else 0.0
+        median, p90, _ = self.stats.expected(record.action, os_name)
+
+        if age < median:
+            wait = median - age
+        elif age < p90:
+            wait = p90 - age
+        else:
+            step = math.floor(math.log2((age - p90) / BACKOFF_BASE + 1))
+            wait = p90 + BACKOFF_BASE * (2 ** (step + 1) - 1) - age
+        return min(MAX_POLL_INTERVAL, max(MIN_POLL_INTERVAL, wait))
+
+    def next_poll(self, record, os_name=None, now=None):
+        """下次查詢的 epoch 秒數"""
+        now = time.time() if now is None else now
+        return now + self.delay(record, os_name, now)
+
+    def refresh_interval(self, records, os_names=None, now=None, max_interval=MAX_POLL_INTERVAL):
+        """
+        多個 Task 中最早需要查詢的秒數（例如畫面的自動更新間隔）；沒有未完成的 Task 時回傳 `max_interval`
+        :param records: TaskRecord 列表（已完成的 Task 會略過）
+        """
+        os_names = os_names or {}
+        delays = [self.delay(r, os_names.get(r.agent_guid), now) for r in records if not is_terminal(r.status)]
+        return min(delays + [max_interval])
+
+
+def lookup_os_names(agent_guids, tenant_name=None):
+    """
+    從本機 Endpoint 清單取得 Agent 的 OS（不會呼叫 API），失敗時回傳空字典
+    :return: {agent_guid: OS 名稱}
+    """
+    guids = [guid for guid in dict.fromkeys(agent_guids) if guid]
+    if not guids:
+        return {}
+    try:
+        inventory = EndpointInventory(tenant_name)
+        try:
+            found = inventory.get_many(guids)
+            return {guid: found[guid.lower()].os_name for guid in guids if guid.lower() in found}
+        finally:
+            inventory.close()
+    except Exception as e:
+        logger.warning("無法從本機 Endpoint 清單取得 OS: %s", e)
+        return {}
+
+
+if __name__ == "__main__":
+    setup_logging()
+    for row in LatencyStats().summary():
+        print(f"{row['action']:<16}{row['os_name'] or '(全部)':<24}樣本 {row['samples']:>5}  "
+              f"中位數 {row['median']:>8} 秒  p90 {row['p90']:>8} 秒")
@@ -0,0 +1,82 @@
+import datetime
+import os
+from utils.endpoint_inventory import EndpointInventory
+from utils.target_resolver import read_agent_targets
+from utils.log import setup_logging
+
+CONNECTED = "connected"
+DEFERRED_DIR = "preflight_deferred"
+FULL_SYNC_THRESHOLD = 2000  # 目標超過此數量時改用完整同步（每頁 1000 筆）而非逐批查詢
+DEFERRED_STATUS = "Deferred"
+
+
+def check_connectivity(agent_guids, tenant_name=None, refresh=True):
+    """
+    依本機 Endpoint 清單判斷 Agent 的 EDR Sensor 連線狀態
+    :param agent_guids: Agent GUID 列表
+    :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+    :param refresh: 先向 API 重新取得目標的最新狀態（失敗時使用本機既有資料）
+    :return: (在線的 GUID 列表, {離線或找不到的 GUID: 原因})，皆保留輸入順序
+    """
+    inventory = EndpointInventory(tenant_name)
+    try:
+        if refresh:
+            if len(agent_guids) > FULL_SYNC_THRESHOLD:
+                inventory.sync(full=True)
+            else:
+                inventory.refresh(agent_guids)
+        endpoints = inventory.get_many(agent_guids)
+    finally:
+        inventory.close()
+
+    online, offline = [], {}
+    for guid in agent_guids:
+        endpoint = endpoints.get(guid.lower())
+        if endpoint is None:
+            offline[guid] = "不在 Endpoint 清單中"
+            continue
+        connectivity = endpoint.connectivity or "Unknown"
+        if connectivity.lower() == CONNECTED:
+            online.append(guid)
+        else:
+            offline[guid] = f"EDR Sensor {connectivity}"
+    return online, offline
+
+
+def export_deferred(offline, label):
+    """
+    將離線的 Agent GUID 寫入延後清單（每行一個 GUID，可直接作為下次執行的目標檔案）
+    :return: 檔案路徑，沒有離線 Agent 時回傳 None
+    """
+    if not offline:
+        return None
+
+    os.makedirs(DEFERRED_DIR, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    file_path = os.path.join(DEFERRED_DIR, f"{label}_deferred_{timestamp}.txt")
+    with open(file_path, "w", encoding="utf-8") as file:
+        for guid in offline:
+            file.write(f"{guid}\n")
+    return file_path
+
+
+def split_online(agent_guids, tenant_name=None, label="targets", refresh=True):
+    """
+    下發前的連線檢查：只保留在線的 Agent，離線的 Agent 寫入延後清單
+    :param label: 延後清單檔名的前綴（例如 "runScript"）
+    :return: (在線的 GUID 列表, {離線的 GUID: 原因}, 延後清單路徑或 None)
+    """
+    online, offline = check_connectivity(agent_guids, tenant_name, refresh)
+    deferred_path = export_deferred(offline, label)
+    print(f"🛫 連線檢查：{len(online)} 台在線，{len(offline)} 台離線或找不到（延後執行）")
+    if deferred_path:
+        print(f"📝 延後清單已匯出至 {deferred_path}，Agent 上線後可直接用此檔案重新執行")
+    return online, offline, deferred_path
+
+
+if __name__ == "__main__":
+    setup_logging()
+    agent_file = input("請輸入包含 Agent GUIDs 的 txt 檔案路徑: ").strip()
+    agent_guids = read_agent_targets(agent_file)
+    if agent_guids:
+        split_online(agent_guids)
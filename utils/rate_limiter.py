@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+import datetime
+from email.utils import parsedate_to_datetime
+
+# tenants.json 中 "rate_limit" 未設定的欄位使用以下預設值
+DEFAULT_RATE_LIMIT = {
+    "requests_per_second": 10,  # Token 補充速率
+    "burst": 20,                # Token Bucket 容量（瞬間可連續送出的請求數）
+    "max_retries": 5,           # 429 / 5xx / 連線中斷時的重試次數
+    "backoff_base": 1.0,        # 指數退避的基準秒數
+    "backoff_max": 60.0,        # 單次等待的上限秒數
+}
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 標頭
+    :param value: 秒數（"120"）或 HTTP 日期（"Wed, 21 Oct 2015 07:28:00 GMT"）
+    :return: 需要等待的秒數，無法解析時回傳 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """
+    單一 Tenant 的 Token Bucket 限流器與重試策略（執行緒安全）
+
+    同一個 Tenant 的所有請求共用同一個 Bucket；收到 429 時整個 Tenant 暫停到 Retry-After 指定的時間。
+    """
+
+    def __init__(self, settings=None):
+        """
+        :param settings: tenants.json 中的 "rate_limit" 設定字典
+        """
+        config = dict(DEFAULT_RATE_LIMIT)
+        config.update(settings or {})
+
+        self.rate = float(config["requests_per_second"])
+        self.capacity = max(1.0, float(config["burst"]))
+        self.max_retries = int(config["max_retries"])
+        self.backoff_base = float(config["backoff_base"])
+        self.backoff_max = float(config["backoff_max"])
+
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個 Token，必要時等待（速率 <= 0 表示不限流）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """暫停整個 Tenant 的請求（收到 429 時呼叫）"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def backoff(self, attempt):
+        """第 `attempt` 次重試前的等待秒數（指數退避 + Full Jitter）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
@@ -0,0 +1,197 @@
+import datetime
+import sys
+from collections.abc import Mapping
+from operator import attrgetter
+
+
+def _intern(value):
+    """重複率高的短字串（OS、狀態、動作）共用同一個物件"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+    """
+    固定欄位的資料列（`__slots__`，不建立 `__dict__`）
+    子類別以 `__slots__` 定義欄位與順序，可用位置或名稱參數建立，未指定的欄位為 None
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+        for name in self.__slots__[len(args):]:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError(f"{type(self).__name__} 沒有欄位：{', '.join(kwargs)}")
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class EndpointRecord(Record):
+    """Endpoint 清單的一列"""
+
+    __slots__ = ("agent_guid", "endpoint_name", "last_used_ip", "os_name", "connectivity")
+
+    COLUMNS = {
+        "agent_guid": "Agent GUID",
+        "endpoint_name": "Endpoint Name",
+        "last_used_ip": "IP",
+        "os_name": "OS",
+        "connectivity": "EDR Sensor"
+    }
+
+    @classmethod
+    def from_row(cls, row):
+        """由 SQLite 資料列（欄位順序同 `__slots__`）建立"""
+        agent_guid, endpoint_name, last_used_ip, os_name, connectivity = row
+        return cls(agent_guid, endpoint_name, last_used_ip, _intern(os_name), _intern(connectivity))
+
+    def to_endpoint(self):
+        """轉為與 API 相同格式的 Endpoint dict"""
+        return {
+            "agentGuid": self.agent_guid,
+            "endpointName": self.endpoint_name,
+            "lastUsedIp": self.last_used_ip,
+            "osName": self.os_name,
+            "edrSensor": {"connectivity": self.connectivity}
+        }
+
+
+API_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"  # API 的 UTC 時間字串格式（createdDateTime、lastActionDateTime 等）
+
+
+def format_api_time(epoch):
+    """將 epoch 秒數轉為 API 的 UTC 時間字串"""
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime(API_TIME_FORMAT)
+
+
+def shift_api_time(timestamp, seconds):
+    """將 API 的 UTC 時間字串平移 `seconds` 秒，格式無法解析時回傳 None"""
+    try:
+        moment = datetime.datetime.strptime(timestamp[:19] + "Z", API_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return (moment + datetime.timedelta(seconds=seconds)).strftime(API_TIME_FORMAT)
+
+
+NOT_FOUND_STATUS = "notfound"  # 多次查詢都找不到的 Task（由 TaskPoller 標記，不是 API 的狀態）
+TERMINAL_STATUSES = frozenset({"succeeded", "failed", "completed", "rejected", NOT_FOUND_STATUS})
+
+
+def is_terminal(status):
+    """Task 是否已進入完成狀態（不會再變化）"""
+    return (status or "").lower() in TERMINAL_STATUSES
+
+
+class TaskRecord(Record):
+    """/v3.0/response/tasks 的一筆 Task，只保留畫面與追蹤用到的欄位"""
+
+    __slots__ = ("task_id", "status", "action", "agent_guid", "endpoint_name", "file", "error", "description",
+                 "created", "updated")
+
+    COLUMNS = {
+        "task_id": "Task ID",
+        "status": "狀態",
+        "action": "動作",
+        "endpoint_name": "端點",
+        "file": "檔案路徑/名稱",
+        "error": "錯誤訊息",
+        "description": "描述",
+        "created": "建立時間",
+        "updated": "更新時間"
+    }
+
+    @classmethod
+    def from_api(cls, task):
+        """由 API 回傳的 Task dict 建立，原始 dict 之後即可釋放"""
+        return cls(
+            task.get("id", "N/A"),
+            _intern((task.get("status") or "Unknown").lower()),
+            _intern(task.get("action")),
+            task.get("agentGuid"),
+            task.get("endpointName", "N/A"),
+            task.get("filePath") or task.get("fileName") or "N/A",
+            (task.get("error") or {}).get("message", ""),
+            task.get("description", "N/A"),
+            task.get("createdDateTime"),
+            task.get("lastActionDateTime")
+        )
+
+
+class DispatchResult(Record, Mapping):
+    """
+    批次下發的單一結果（Custom Script、Collect File、YARA 共用）
+    同時提供唯讀 Mapping 介面：`result["status"]`、`result.get(...)`、`dict(result)` 與原本的 dict 結果相同，
+    值為 None 的欄位視為不存在，因此可直接寫入工作紀錄與 CSV
+    """
+
+    __slots__ = ("agent_guid", "file_path", "yara_rule", "target_file_location", "task_id", "task_url", "status",
+                 "error")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.status = _intern(self.status)
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (name for name in self.__slots__ if getattr(self, name) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return dict(self)
+
+    def replace(self, **changes):
+        """回傳修改部分欄位後的新結果"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return type(self)(**values)
+
+    __eq__ = Mapping.__eq__
+    __hash__ = None
+
+
+def records_to_frame(records, record_type, columns=None):
+    """
+    以欄位為單位將資料列轉為 DataFrame：每個欄位只建立一次，不經過每列一個 dict 的中間格式
+    :param records: 同一類型的 Record 列表
+    :param record_type: Record 子類別（決定欄位）
+    :param columns: {欄位: 顯示名稱}，未指定時使用 `record_type.COLUMNS`（沒有時為全部欄位）
+    :return: pandas DataFrame
+    """
+    import pandas as pd
+
+    columns = columns or getattr(record_type, "COLUMNS", None) or {name: name for name in record_type.__slots__}
+    fields = list(columns)
+    if not records:
+        return pd.DataFrame(columns=list(columns.values()))
+
+    getter = attrgetter(*fields)
+    rows = map(getter, records) if len(fields) > 1 else ((getter(r),) for r in records)
+    return pd.DataFrame(dict(zip(columns.values(), zip(*rows))))
+
+
+def results_to_frame(results):
+    """
+    批次下發結果轉為 DataFrame，省略整欄皆為空的欄位
+    :param results: DispatchResult 列表（工作紀錄續傳時讀回的 dict 也可混用）
+    """
+    results = [r if isinstance(r, DispatchResult) else DispatchResult(**r) for r in results]
+    return records_to_frame(results, DispatchResult).dropna(axis=1, how="all")
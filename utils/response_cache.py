@@ -0,0 +1,104 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# 各端點的快取秒數（讀多寫少的清單），未列出的端點使用 DEFAULT_CACHE_TTL
+CACHE_TTLS = {
+    "/v3.0/response/customScripts": 300,
+    "/v3.0/response/yaraRuleFiles": 300,
+}
+DEFAULT_CACHE_TTL = 60
+DEFAULT_MAX_ENTRIES = 256
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "last_modified", "expires_at")
+
+    def __init__(self, body, etag, last_modified, expires_at):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires_at
+
+    @property
+    def revalidatable(self):
+        return bool(self.etag or self.last_modified)
+
+    def conditional_headers(self):
+        """過期後重新驗證用的條件式請求標頭"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    GET 回應的 LRU 快取（執行緒安全），以 (Tenant, 端點, 查詢參數) 為 key
+
+    過期的項目會保留到被 LRU 淘汰為止，若 API 有提供 ETag / Last-Modified，可用條件式請求重新驗證。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(tenant_name, url, params=None):
+        """產生快取 key，查詢參數順序不影響結果"""
+        return tenant_name, url, tuple(sorted((str(k), str(v)) for k, v in (params or {}).items()))
+
+    @staticmethod
+    def ttl_for(url):
+        """取得端點的快取秒數"""
+        return CACHE_TTLS.get(urlparse(url).path, DEFAULT_CACHE_TTL)
+
+    def get(self, key):
+        """取得快取項目（可能已過期），不存在時回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, etag=None, last_modified=None):
+        """寫入快取，超過上限時淘汰最久未使用的項目"""
+        entry = CacheEntry(copy.deepcopy(body), etag, last_modified, time.monotonic() + self.ttl_for(key[1]))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, key):
+        """重新驗證成功（304）後延長快取期限"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expires_at = time.monotonic() + self.ttl_for(key[1])
+
+    def invalidate(self, tenant_name, endpoint=None):
+        """
+        清除快取
+        :param tenant_name: Tenant 名稱
+        :param endpoint: 只清除此端點（含分頁）的快取，未指定時清除該 Tenant 全部快取
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != tenant_name:
+                    continue
+                if endpoint is None or urlparse(key[1]).path == endpoint:
+                    del self._entries[key]
+
+
+# Process 內所有 Tenant 共用的快取
+response_cache = ResponseCache()
@@ -1,12 +1,76 @@
 import csv
 import os
 import datetime
-from utils.api_client import APIClient
+import asyncio
+import logging
+from utils.api_client import get_api_client
+from utils.async_api_client import AsyncAPIClient, DEFAULT_CONCURRENCY
+from utils.job_journal import JobJournal
+from utils.multi_status import (DEFAULT_CHUNK_SIZE, answered_keys, chunked, get_error_message, get_operation_location,
+                                map_multi_status)
+from utils.preflight import DEFERRED_STATUS, split_online
+from utils.records import DispatchResult
+from utils.target_resolver import read_agent_targets
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
 
 class RunCustomScriptManager:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
+        self.url_path = "/v3.0/response/endpoints/runScript"
         self.task_id_output_file = "run_script_result/task_ids.txt"  # ✅ Task ID 輸出 TXT
+        self.chunk_size = DEFAULT_CHUNK_SIZE  # 每個 runScript 請求包含的 Agent 數
+
+    def _build_item(self, agent_guid, file_name, parameters=None, description="Run custom script task"):
+        """產生 runScript Request Body 中單一 Agent 的項目"""
+        return {
+            "agentGuid": agent_guid,
+            "fileName": file_name,
+            "parameter": parameters if parameters else "",
+            "description": description
+        }
+
+    def _build_payload(self, agent_guid, file_name, parameters=None, description="Run custom script task"):
+        """產生 runScript 的 Request Body"""
+        return [self._build_item(agent_guid, file_name, parameters, description)]
+
+    def _parse_item(self, agent_guid, item):
+        """將 207 回應中的單一項目轉換為 Agent 的執行結果"""
+        if isinstance(item, dict) and item.get("status") == 202:
+            task_url = get_operation_location(item)
+            if task_url:
+                return DispatchResult(agent_guid, task_id=task_url.split("/")[-1], task_url=task_url,
+                                      status="Success")
+            return DispatchResult(agent_guid, task_id="N/A", task_url="N/A", status="Accepted")
+        return DispatchResult(agent_guid, task_id="N/A", task_url="N/A", status="Failed",
+                              error=get_error_message(item))
+
+    def _parse_result(self, agent_guid, result):
+        """解析 runScript 的回應，轉換為單一 Agent 的執行結果"""
+        if result is None:
+            print(f"❌ 無法執行 Custom Script（Agent: {agent_guid}），請檢查 API 權限")
+            return None
+
+        response = self._parse_item(agent_guid, result[0] if isinstance(result, list) and result else None)
+        if response["status"] == "Success":
+            print(f"✅ Custom Script 執行成功（Agent: {agent_guid}）")
+            print(f"🔍 任務查詢 URL: {response['task_url']}")
+        elif response["status"] == "Accepted":
+            print(f"⚠️ 任務已接受（Agent: {agent_guid}），但未提供 Task URL，請手動檢查 API")
+        else:
+            print(f"❌ API 回應格式異常（Agent: {agent_guid}），請檢查 API 設定")
+        return response
+
+    def _parse_batch_result(self, agent_guids, result):
+        """將 207 回應逐一對應回 Agent GUID，並印出該批次的摘要"""
+        responses = [self._parse_item(agent_guid, item) for agent_guid, item in map_multi_status(agent_guids, result)]
+        succeeded = sum(1 for r in responses if r["status"] == "Success")
+        print(f"📦 runScript 批次完成：{succeeded}/{len(responses)} 台 Agent 成功下發")
+        return responses
 
     def run_custom_script(self, agent_guid, file_name, parameters=None, description="Run custom script task"):
         """
@@ -16,77 +80,205 @@ class RunCustomScriptManager:
         :param parameters: 腳本執行時的參數（可選）
         :param description: 任務描述（預設為 "Run custom script task"）
         """
-        endpoint = "/v3.0/response/endpoints/runScript"
-        payload = [{
-            "agentGuid": agent_guid,
-            "fileName": file_name,
-            "parameter": parameters if parameters else "",
-            "description": description
-        }]
+        payload = self._build_payload(agent_guid, file_name, parameters, description)
+        result = self.api_client.send_request("POST", self.url_path, data=payload)
+        logger.debug("runScript 回傳: %s", result)
+        return self._parse_result(agent_guid, result)
 
-        result = self.api_client.send_request("POST", endpoint, data=payload)
-        print("🔥 result 回傳:", result)
+    async def run_custom_script_async(self, async_client, agent_guid, file_name, parameters=None,
+                                      description="Run custom script task"):
+        """
+        `run_custom_script` 的非同步版本
+        :param async_client: AsyncAPIClient
+        """
+        payload = self._build_payload(agent_guid, file_name, parameters, description)
+        result = await async_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_result(agent_guid, result)
 
-        if result is None:
-            print(f"❌ 無法執行 Custom Script（Agent: {agent_guid}），請檢查 API 權限")
-            return None
+    def dispatch_batch(self, agent_guids, file_name, parameters=None, description="Run custom script task"):
+        """
+        以單一請求對多台 Agent 執行自訂腳本（207 Multi-Status）
+        :param agent_guids: Agent GUID 列表（建議不超過 `chunk_size`）
+        :param file_name: 要執行的腳本檔案名稱
+        :param parameters: 腳本執行時的參數（可選）
+        :param description: 任務描述
+        :return: 與 `agent_guids` 同順序的執行結果列表
+        """
+        return self._parse_batch_result(agent_guids, self._send_batch(agent_guids, file_name, parameters, description))
 
-        # ✅ 處理 207 Multi-Status 回應
-        if isinstance(result, list) and len(result) > 0 and "status" in result[0]:
-            status_code = result[0]["status"]
-            task_id = None  # 預設 Task ID
-
-            # 如果是 202 Accepted，取得 Task URL
-            if status_code == 202:
-                task_url = None
-                for header in result[0].get("headers", []):
-                    if header["name"] == "Operation-Location":
-                        task_url = header["value"]
-                        task_id = task_url.split("/")[-1]  # ✅ 提取 Task ID
-                        break
-
-                if task_url:
-                    print(f"✅ Custom Script 執行成功（Agent: {agent_guid}）")
-                    print(f"🔍 任務查詢 URL: {task_url}")
-                    return {"agent_guid": agent_guid, "task_id": task_id, "task_url": task_url, "status": "Success"}
-                else:
-                    print(f"⚠️ 任務已接受（Agent: {agent_guid}），但未提供 Task URL，請手動檢查 API")
-                    return {"agent_guid": agent_guid, "task_id": "N/A", "task_url": "N/A", "status": "Accepted"}
+    def _send_batch(self, agent_guids, file_name, parameters=None, description="Run custom script task"):
+        """送出 runScript 批次請求，回傳未解析的回應"""
+        payload = [self._build_item(guid, file_name, parameters, description) for guid in agent_guids]
+        return self.api_client.send_request("POST", self.url_path, data=payload)
 
-        print(f"❌ API 回應格式異常（Agent: {agent_guid}），請檢查 API 設定")
-        return {"agent_guid": agent_guid, "task_id": "N/A", "task_url": "N/A", "status": "Failed"}
+    async def dispatch_batch_async(self, async_client, agent_guids, file_name, parameters=None,
+                                   description="Run custom script task"):
+        """
+        `dispatch_batch` 的非同步版本
+        :param async_client: AsyncAPIClient
+        """
+        payload = [self._build_item(guid, file_name, parameters, description) for guid in agent_guids]
+        result = await async_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_batch_result(agent_guids, result)
+
+    def _read_agent_guids(self, file_path):
+        """
+        讀取目標清單（Agent GUID、Endpoint 名稱、IP 或萬用字元），轉換為不重複的 Agent GUID
+        :return: Agent GUID 列表，檔案不存在或沒有有效目標時回傳 None
+        """
+        return read_agent_targets(file_path, self.api_client.tenant_name) or None
+
+    def _export(self, results):
+        """匯出結果到 CSV & Task ID 到 TXT，回傳 (results, csv_path, taskid_path)"""
+        task_ids = [r["task_id"] for r in results if r["task_id"] != "N/A"]  # 只記錄有效 Task ID
+        csv_path = self.export_results(results)
+        taskid_path = self.export_task_ids(task_ids)
+        return results, csv_path, taskid_path
 
-    def run_from_file(self, file_path, file_name, parameters=None):
+    def _start_job(self, agent_guids, file_name, parameters):
+        """開始或接續 runScript 工作紀錄"""
+        job = JobJournal().start("runScript", self.api_client.tenant_name,
+                                 {"file_name": file_name, "parameters": parameters or ""}, agent_guids)
+        if job.resumed:
+            print(job.summary())
+        return job
+
+    def _dispatch_journaled(self, job, agent_guids, file_name, parameters=None):
+        """
+        送出前先記錄項目，取得結果後立即寫入工作紀錄
+        只記錄伺服器有逐項回應的 Agent；整個請求失敗時移除送出紀錄，續傳時會重新下發
+        """
+        job.mark_sent(agent_guids)
+        result = self._send_batch(agent_guids, file_name, parameters)
+        responses = self._parse_batch_result(agent_guids, result)
+        answered = answered_keys(agent_guids, result)
+        job.record([(r["agent_guid"], r) for r in responses if r["agent_guid"] in answered])
+        job.release([guid for guid in agent_guids if guid not in answered])
+        return responses
+
+    def _finish_job(self, job, results):
+        """合併上次與本次的結果（依原始順序），並標記工作完成"""
+        by_guid = job.done()
+        by_guid.update(
+            (guid, DispatchResult(guid, task_id="N/A", task_url="N/A", status="Unknown",
+                                  error="上次執行中斷，無法確認是否已下發"))
+            for guid in job.unconfirmed()
+        )
+        by_guid.update((r["agent_guid"], r) for r in results)
+        job.finish()
+        return [by_guid[guid] for guid in job.keys]
+
+    def _preflight(self, agent_guids):
+        """
+        下發前的連線檢查，離線的 Agent 寫入延後清單
+        :return: (在線的 GUID 列表, 離線 Agent 的結果列表)
+        """
+        online, offline, _ = split_online(agent_guids, self.api_client.tenant_name, "runScript")
+        deferred = [DispatchResult(guid, task_id="N/A", task_url="N/A", status=DEFERRED_STATUS, error=reason)
+                    for guid, reason in offline.items()]
+        return online, deferred
+
+    def run_from_file(self, file_path, file_name, parameters=None, resume=True, preflight=False):
         """
         從 txt 檔案批次執行 Custom Script，並將結果匯出到 CSV
         :param file_path: 包含 Agent GUIDs 的 txt 檔案路徑
         :param file_name: 要執行的 Custom Script 檔案名稱
         :param parameters: 腳本執行時的參數（可選）
+        :param resume: 是否使用工作紀錄（中斷後以相同輸入重新執行時跳過已下發的 Agent）
+        :param preflight: 只下發給 EDR Sensor 在線的 Agent，離線的 Agent 寫入延後清單
+        :return: (執行結果列表, CSV 路徑, Task ID 檔案路徑)
         """
-        if not os.path.isfile(file_path):
-            print(f"❌ 錯誤: 檔案 '{file_path}' 不存在，請確認路徑")
-            return
+        agent_guids = self._read_agent_guids(file_path)
+        if not agent_guids:
+            return [], None, None
+        return self.run_targets(agent_guids, file_name, parameters, resume, preflight)
+
+    def run_targets(self, agent_guids, file_name, parameters=None, resume=True, preflight=False):
+        """
+        對 Agent GUID 列表批次執行 Custom Script（含工作紀錄、連線檢查與匯出），參數同 `run_from_file`
+        :return: (執行結果列表, CSV 路徑, Task ID 檔案路徑)
+        """
+        job = self._start_job(agent_guids, file_name, parameters) if resume else None
+        try:
+            targets = job.pending() if job else agent_guids
+            targets, results = self._preflight(targets) if preflight else (targets, [])
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            agent_guids = [line.strip() for line in f if line.strip()]
+            for chunk in chunked(targets, self.chunk_size):
+                if job:
+                    results.extend(self._dispatch_journaled(job, chunk, file_name, parameters))
+                else:
+                    results.extend(self.dispatch_batch(chunk, file_name, parameters))
+            results = self._finish_job(job, results) if job else self._in_order(agent_guids, results)
+        finally:
+            if job:
+                job.close()
+        return self._export(results)
 
+    async def run_from_file_async(self, file_path, file_name, parameters=None, concurrency=DEFAULT_CONCURRENCY,
+                                  chunk_size=None, resume=True, preflight=False):
+        """
+        `run_from_file` 的非同步版本，同時最多送出 `concurrency` 個批次請求
+        :param chunk_size: 每個請求包含的 Agent 數，未指定時使用 `self.chunk_size`
+        :return: (執行結果列表, CSV 路徑, Task ID 檔案路徑)
+        """
+        agent_guids = self._read_agent_guids(file_path)
         if not agent_guids:
-            print("❌ 檔案內沒有有效的 Agent GUID")
-            return
+            return [], None, None
+        return await self.run_targets_async(agent_guids, file_name, parameters, concurrency, chunk_size, resume,
+                                            preflight)
 
-        results = []
-        task_ids = []  # ✅ Task ID 收集
+    async def run_targets_async(self, agent_guids, file_name, parameters=None, concurrency=DEFAULT_CONCURRENCY,
+                                chunk_size=None, resume=True, preflight=False):
+        """
+        `run_targets` 的非同步版本，同時最多送出 `concurrency` 個批次請求
+        :return: (執行結果列表, CSV 路徑, Task ID 檔案路徑)
+        """
+        job = self._start_job(agent_guids, file_name, parameters) if resume else None
+        try:
+            targets = job.pending() if job else agent_guids
+            targets, results = self._preflight(targets) if preflight else (targets, [])
 
-        for agent_guid in agent_guids:
-            response = self.run_custom_script(agent_guid, file_name, parameters)
-            if response:
-                results.append(response)
-                if response["task_id"] != "N/A":  # 只記錄有效 Task ID
-                    task_ids.append(response["task_id"])
+            results += await self.run_for_agents_async(targets, file_name, parameters, concurrency, chunk_size,
+                                                       job=job)
+            results = self._finish_job(job, results) if job else self._in_order(agent_guids, results)
+        finally:
+            if job:
+                job.close()
+        return self._export(results)
 
-        # 匯出結果到 CSV & Task ID 到 TXT
-        self.export_results(results)
-        self.export_task_ids(task_ids)
+    @staticmethod
+    def _in_order(agent_guids, results):
+        """將結果依 Agent GUID 的原始順序排列"""
+        by_guid = {r["agent_guid"]: r for r in results}
+        return [by_guid[guid] for guid in agent_guids if guid in by_guid]
+
+    async def run_for_agents_async(self, agent_guids, file_name, parameters=None, concurrency=DEFAULT_CONCURRENCY,
+                                   chunk_size=None, job=None):
+        """
+        對 Agent GUID 列表執行 Custom Script（不匯出檔案）
+        Agent 依 `chunk_size` 打包成 207 批次請求，各批次同時送出
+        :param agent_guids: Agent GUID 列表
+        :param file_name: 要執行的 Custom Script 檔案名稱
+        :param parameters: 腳本執行時的參數（可選）
+        :param concurrency: 同時進行的批次請求數上限
+        :param chunk_size: 每個請求包含的 Agent 數，未指定時使用 `self.chunk_size`
+        :param job: JobRun，指定時每個批次的結果會立即寫入工作紀錄
+        :return: 與 `agent_guids` 同順序的執行結果列表
+        """
+        chunk_size = chunk_size or self.chunk_size
+        async with AsyncAPIClient(self.api_client.tenant_name, concurrency) as async_client:
+            if job is None:
+                batches = await asyncio.gather(*[
+                    self.dispatch_batch_async(async_client, chunk, file_name, parameters)
+                    for chunk in chunked(agent_guids, chunk_size)
+                ])
+            else:
+                # 在執行緒池中實際送出前才記錄，排隊中的批次不會被誤判為已送出
+                batches = await asyncio.gather(*[
+                    async_client.run(self._dispatch_journaled, job, chunk, file_name, parameters)
+                    for chunk in chunked(agent_guids, chunk_size)
+                ])
+        return [response for batch in batches for response in batch]
 
     def export_results(self, results):
         """將執行結果匯出至 CSV"""
@@ -110,6 +302,7 @@ class RunCustomScriptManager:
                 writer.writerow([result["agent_guid"], result["task_id"], result["task_url"], result["status"]])
 
         print(f"✅ 執行結果已成功匯出至 {filename}")
+        return filename
 
     def export_task_ids(self, task_ids):
         """✅ 將 Task ID 存入 `task_ids.txt`"""
@@ -124,8 +317,10 @@ class RunCustomScriptManager:
                 file.write(f"{task_id}\n")
 
         print(f"✅ Task IDs 已成功匯出至 {self.task_id_output_file}")
+        return self.task_id_output_file
 
 if __name__ == "__main__":
+    setup_logging()
     manager = RunCustomScriptManager()
 
     # 讀取 Agent GUIDs 的 txt 檔案
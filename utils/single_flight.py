@@ -0,0 +1,65 @@
+import copy
+import threading
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合併相同 key 的同時請求（執行緒安全）
+
+    第一個呼叫者實際執行，其餘同時呼叫相同 key 的執行緒等待並共用結果；
+    結果有多人共用時，每個呼叫者都會拿到各自的複本，避免互相修改。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        執行 `func()`，若相同 key 的呼叫正在進行中則等待並共用其結果
+        :param key: 可 hash 的請求識別
+        :param func: 不需參數的函式
+        :return: `func()` 的結果
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        # 移除 key 之後 waiters 不會再增加
+        return copy.deepcopy(call.result) if call.waiters else call.result
+
+
+# Process 內所有 Tenant 共用（key 已包含 Tenant 名稱）
+single_flight = SingleFlight()
@@ -0,0 +1,135 @@
+import os
+import re
+import uuid
+
+DEFAULT_MAX_TARGETS = 1_000_000  # 單一清單的不重複項目數上限（去除重複時保留於記憶體中），超過時拋出 TargetLimitError
+MAX_REJECTED_SAMPLES = 20  # 報告中保留的無效行範例數（計數不受影響）
+
+_GUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_TASK_ID_PATTERN = re.compile(r"^[0-9A-Za-z][0-9A-Za-z_-]{0,63}$")
+_STRIP_CHARS = " \t\r\n\ufeff\"'{}"
+
+
+class TargetLimitError(ValueError):
+    """目標清單的不重複項目超過上限；不會略過任何項目，整份清單都不處理"""
+
+
+def normalize_agent_guid(value):
+    """
+    將 Agent GUID 正規化為小寫、含連字號的格式
+    :return: 正規化後的 GUID，格式錯誤時回傳 None
+    """
+    value = value.lower()
+    if _GUID_PATTERN.match(value):  # 常見的標準格式不需要經過 uuid 解析
+        return value
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        return None
+
+
+def normalize_task_id(value):
+    """檢查 Task ID 格式（英數字、`-`、`_`，最長 64 字元），格式錯誤時回傳 None"""
+    return value if _TASK_ID_PATTERN.match(value) else None
+
+
+class IngestReport:
+    """讀取目標清單的統計：有效、重複與無效的行數，以及無效行的範例"""
+
+    __slots__ = ("label", "accepted", "duplicates", "rejected", "rejected_samples")
+
+    def __init__(self, label="Agent GUID"):
+        self.label = label
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.rejected_samples = []  # [(行號, 內容, 原因), ...]
+
+    def reject(self, line_no, line, reason):
+        self.rejected += 1
+        if len(self.rejected_samples) < MAX_REJECTED_SAMPLES:
+            self.rejected_samples.append((line_no, line, reason))
+
+    def summary(self):
+        """一行文字摘要"""
+        return f"📋 {self.label}：有效 {self.accepted} 筆，重複 {self.duplicates} 筆，格式錯誤 {self.rejected} 筆"
+
+    def print_report(self):
+        """印出摘要與無效行範例"""
+        print(self.summary())
+        for line_no, line, reason in self.rejected_samples:
+            print(f"⚠️ 第 {line_no} 行（{reason}）: {line}")
+        if self.rejected > len(self.rejected_samples):
+            print(f"⚠️ ……另有 {self.rejected - len(self.rejected_samples)} 行格式錯誤未列出")
+
+
+def iter_targets(lines, normalize=normalize_agent_guid, report=None, max_targets=DEFAULT_MAX_TARGETS,
+                 with_line_no=False):
+    """
+    逐行讀取目標清單：去除空白與引號、略過空行與 `#` 註解、檢查格式並去除重複
+    :param lines: 任意可逐行迭代的來源（檔案物件、`str.splitlines()` 等），不會一次讀入全部內容
+    :param normalize: 正規化函式，格式錯誤時回傳 None
+    :param report: IngestReport，用於統計結果
+    :param max_targets: 不重複項目數上限
+    :param with_line_no: 為 True 時產生 (行號, 項目)
+    :return: 正規化後且不重複的項目（generator）
+    :raises TargetLimitError: 不重複項目超過 `max_targets`（不會略過任何項目，呼叫端應停止處理）
+    """
+    report = report if report is not None else IngestReport()
+    seen = set()
+    for line_no, raw in enumerate(lines, start=1):
+        line = raw.strip(_STRIP_CHARS)
+        if not line or line.startswith("#"):
+            continue
+
+        value = normalize(line)
+        if value is None:
+            report.reject(line_no, line[:80], "格式錯誤")
+            continue
+
+        if value in seen:
+            report.duplicates += 1
+            continue
+        if len(seen) >= max_targets:
+            raise TargetLimitError(f"{report.label} 超過上限 {max_targets:,} 筆（第 {line_no} 行），請分批處理")
+
+        seen.add(value)
+        report.accepted += 1
+        yield (line_no, value) if with_line_no else value
+
+
+def read_targets(file_path, normalize=normalize_agent_guid, label="Agent GUID", max_targets=DEFAULT_MAX_TARGETS):
+    """
+    讀取目標清單檔案並印出統計報告
+    :param file_path: txt 檔案路徑（每行一個項目）
+    :param normalize: 正規化函式（`normalize_agent_guid` 或 `normalize_task_id`）
+    :param label: 報告中顯示的項目名稱
+    :return: (不重複的有效項目列表, IngestReport)，檔案不存在或超過上限時列表為 None
+    """
+    report = IngestReport(label)
+    if not os.path.isfile(file_path):
+        print(f"❌ 錯誤: 檔案 '{file_path}' 不存在，請確認路徑")
+        return None, report
+
+    try:
+        with open(file_path, "r", encoding="utf-8-sig", errors="replace") as f:
+            targets = list(iter_targets(f, normalize, report, max_targets))
+    except TargetLimitError as e:
+        print(f"❌ {e}")
+        return None, report
+
+    report.print_report()
+    if not targets:
+        print(f"❌ 檔案內沒有有效的 {label}")
+    return targets, report
+
+
+def parse_targets(text, normalize=normalize_agent_guid, label="Agent GUID", max_targets=DEFAULT_MAX_TARGETS):
+    """
+    解析多行文字（例如 Streamlit text_area）中的目標清單
+    :return: (不重複的有效項目列表, IngestReport)
+    :raises TargetLimitError: 不重複項目超過 `max_targets`
+    """
+    report = IngestReport(label)
+    targets = list(iter_targets((text or "").splitlines(), normalize, report, max_targets))
+    return targets, report
@@ -0,0 +1,273 @@
+import ipaddress
+import re
+from utils.endpoint_inventory import EndpointInventory, match_clause
+from utils.log import setup_logging
+
+# 欄位別名 → (本機 SQL 欄位, TMV1-Filter 欄位)
+QUERY_FIELDS = {
+    "os": ("os_name", "osName"),
+    "osname": ("os_name", "osName"),
+    "name": ("endpoint_name", "endpointName"),
+    "endpointname": ("endpoint_name", "endpointName"),
+    "ip": ("last_used_ip", "lastUsedIp"),
+    "lastusedip": ("last_used_ip", "lastUsedIp"),
+    "connectivity": ("connectivity", "edrSensorConnectivity"),
+    "guid": ("agent_guid", "agentGuid"),
+    "agentguid": ("agent_guid", "agentGuid"),
+}
+QUERY_EXAMPLE = "os = Windows* and connectivity = Connected and (name = WEB-* or ip in 10.0.1.0/24)"
+
+_TOKEN_PATTERN = re.compile(r"""\s*(?:(?P<string>"[^"]*"|'[^']*')|(?P<op>!=|==|=|\(|\)|,)|(?P<word>[^\s=!(),"']+))""")
+_KEYWORDS = {"and", "or", "not", "in"}
+
+
+class QueryError(ValueError):
+    """查詢條件語法錯誤"""
+
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKEN_PATTERN.match(text, pos)
+        if not match or match.end() == pos:
+            raise QueryError(f"無法解析的字元：{text[pos:pos + 20]}")
+        pos = match.end()
+        if match.group("string") is not None:
+            tokens.append(("value", match.group("string")[1:-1]))
+        elif match.group("op") is not None:
+            tokens.append(("op", match.group("op")))
+        else:
+            word = match.group("word")
+            tokens.append(("keyword", word.lower()) if word.lower() in _KEYWORDS else ("value", word))
+    return tokens
+
+
+class _Parser:
+    """
+    遞迴下降解析：
+        expr       := term ("or" term)*
+        term       := factor ("and" factor)*
+        factor     := "not" factor | "(" expr ")" | comparison
+        comparison := 欄位 ("=" | "!=") 值 | 欄位 ["not"] "in" 值 ("," 值)*
+    """
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            expected = value or {"value": "值", "op": "運算子", "keyword": "關鍵字"}.get(kind, "條件")
+            found = token[1] if token[0] else "結尾"
+            raise QueryError(f"預期 {expected}，但遇到 {found}")
+        self.pos += 1
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("查詢條件不可為空白")
+        node = self.expr()
+        if self.pos < len(self.tokens):
+            raise QueryError(f"多餘的內容：{self.peek()[1]}")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() == ("keyword", "or"):
+            self.pos += 1
+            node = ("or", node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() == ("keyword", "and"):
+            self.pos += 1
+            node = ("and", node, self.factor())
+        return node
+
+    def factor(self):
+        if self.peek() == ("keyword", "not"):
+            self.pos += 1
+            return ("not", self.factor())
+        if self.peek() == ("op", "("):
+            self.pos += 1
+            node = self.expr()
+            self.take("op", ")")
+            return node
+        return self.comparison()
+
+    def comparison(self):
+        field = self.take("value")
+        if field.lower() not in QUERY_FIELDS:
+            raise QueryError(f"不支援的欄位：{field}（可用：{', '.join(sorted(QUERY_FIELDS))}）")
+        field = field.lower()
+
+        negate = self.peek() == ("keyword", "not")
+        if negate:
+            self.pos += 1
+        if self.peek() == ("keyword", "in"):
+            self.pos += 1
+            values = [self.take("value")]
+            while self.peek() == ("op", ","):
+                self.pos += 1
+                values.append(self.take("value"))
+            node = self._in_node(field, values)
+            return ("not", node) if negate else node
+        if negate:
+            raise QueryError(f"預期 in，但遇到 {self.peek()[1] or '結尾'}")
+
+        op = self.take("op")
+        if op not in ("=", "==", "!="):
+            raise QueryError(f"不支援的運算子：{op}")
+        node = ("eq", field, self.take("value"))
+        return ("not", node) if op == "!=" else node
+
+    @staticmethod
+    def _in_node(field, values):
+        """`in` 的值為列表；ip 欄位的值可以是網段（CIDR）"""
+        nodes = []
+        for value in values:
+            if QUERY_FIELDS[field][0] == "last_used_ip" and "/" in value:
+                try:
+                    value = str(ipaddress.ip_network(value, strict=False))
+                except ValueError:
+                    raise QueryError(f"網段格式錯誤：{value}") from None
+                nodes.append(("cidr", field, value))
+            else:
+                nodes.append(("eq", field, value))
+        node = nodes[0]
+        for other in nodes[1:]:
+            node = ("or", node, other)
+        return node
+
+
+def parse_query(text):
+    """
+    解析查詢條件，例如 `os = Windows* and connectivity = Connected and ip in 10.0.1.0/24`
+    - 欄位：os、name、ip、connectivity、guid（不分大小寫）
+    - 運算子：`=`、`!=`（值可使用萬用字元 `*`、`?`）、`in` / `not in`（以 `,` 分隔多個值，ip 可使用 CIDR）
+    - 以 `and`、`or`、`not` 與括號組合；含空白的值請加引號
+    :return: 語法樹（tuple）
+    :raises QueryError: 語法錯誤
+    """
+    return _Parser(text).parse()
+
+
+def to_sql(node):
+    """
+    將語法樹轉為本機 Endpoint 清單的 SQL 條件
+    :return: (SQL 條件, 參數列表)
+    """
+    kind = node[0]
+    if kind in ("and", "or"):
+        left, left_params = to_sql(node[1])
+        right, right_params = to_sql(node[2])
+        return f"({left}) {kind.upper()} ({right})", left_params + right_params
+    if kind == "not":
+        inner, params = to_sql(node[1])
+        # NULL 欄位視為不符合內層條件，因此 `name != x` 會包含沒有名稱的 Endpoint
+        return f"NOT COALESCE(({inner}), 0)", params
+
+    column = QUERY_FIELDS[node[1]][0]
+    value = node[2]
+    if kind == "cidr":
+        network = ipaddress.ip_network(value)
+        clause, params = "ip_in_network(last_used_ip, ?)", [value]
+        prefix = _cidr_prefix(network)
+        if prefix:
+            # 以文字前綴縮小範圍，可使用 IP 索引
+            clause = f"last_used_ip >= ? AND last_used_ip < ? AND {clause}"
+            params = [prefix, prefix + "\U0010ffff"] + params
+        return clause, params
+    if column == "connectivity":
+        return "connectivity = ? COLLATE NOCASE", [value]
+    if column == "agent_guid":
+        value = value.lower()
+    return match_clause(column, value)
+
+
+def _cidr_prefix(network):
+    """IPv4 網段的前綴長度為 8 的倍數時，回傳可用於文字範圍比對的前綴（例如 10.0.1.0/24 → "10.0.1."）"""
+    if network.version != 4 or network.prefixlen == 0 or network.prefixlen % 8:
+        return None
+    octets = str(network.network_address).split(".")[:network.prefixlen // 8]
+    return ".".join(octets) + ("." if len(octets) < 4 else "")
+
+
+def to_tmv1_filter(node):
+    """
+    將語法樹轉為 API 的 TMV1-Filter（只支援 and / or 與不含萬用字元的 `=`）
+    :return: TMV1-Filter 字串，有無法轉換的條件時回傳 None
+    """
+    kind = node[0]
+    if kind in ("and", "or"):
+        left, right = to_tmv1_filter(node[1]), to_tmv1_filter(node[2])
+        return f"({left} {kind} {right})" if left and right else None
+    if kind != "eq":
+        return None
+
+    value = node[2]
+    if any(c in value for c in "*?'"):
+        return None
+    if QUERY_FIELDS[node[1]][0] == "agent_guid":
+        value = value.lower()
+    return f"{QUERY_FIELDS[node[1]][1]} eq '{value}'"
+
+
+def select_endpoints(query, tenant_name=None, server_side=True, inventory=None):
+    """
+    依查詢條件選取 Endpoint
+    條件可完全轉為 TMV1-Filter 時直接向 API 查詢（結果會寫回本機清單）；
+    否則或 API 不接受時，在本機 Endpoint 清單上以 SQL 查詢（必要時先同步）
+    :param query: 查詢條件文字或 `parse_query` 的結果
+    :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+    :param server_side: 是否優先使用 API 的 TMV1-Filter
+    :param inventory: EndpointInventory（未指定時自行建立並關閉）
+    :return: (EndpointRecord 列表, "server" | "local")
+    :raises QueryError: 語法錯誤
+    """
+    node = parse_query(query) if isinstance(query, str) else query
+    own_inventory = inventory is None
+    inventory = inventory or EndpointInventory(tenant_name)
+    try:
+        tmv1_filter = to_tmv1_filter(node) if server_side else None
+        if tmv1_filter:
+            endpoints = inventory.fetch_filtered(tmv1_filter)
+            if endpoints is not None:
+                return endpoints, "server"
+            print("⚠️ API 不接受此查詢條件，改用本機 Endpoint 清單")
+
+        inventory.ensure_fresh()
+        where, params = to_sql(node)
+        return inventory.query(where, params), "local"
+    finally:
+        if own_inventory:
+            inventory.close()
+
+
+def select_targets(query, tenant_name=None, server_side=True):
+    """
+    依查詢條件選取 Agent GUID，可直接交給批次下發
+    :return: 依 GUID 排序且不重複的 Agent GUID 列表，語法錯誤時回傳 None
+    """
+    try:
+        endpoints, source = select_endpoints(query, tenant_name, server_side)
+    except QueryError as e:
+        print(f"❌ 查詢條件錯誤: {e}")
+        return None
+
+    agent_guids = sorted({endpoint.agent_guid for endpoint in endpoints})
+    print(f"🔎 查詢條件符合 {len(agent_guids)} 台 Agent（{'API' if source == 'server' else '本機 Endpoint 清單'}）")
+    return agent_guids
+
+
+if __name__ == "__main__":
+    setup_logging()
+    text = input(f"請輸入查詢條件（例如 {QUERY_EXAMPLE}）: ").strip()
+    for agent_guid in select_targets(text) or []:
+        print(agent_guid)
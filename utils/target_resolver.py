@@ -0,0 +1,163 @@
+import ipaddress
+import os
+import re
+from utils.endpoint_inventory import EndpointInventory
+from utils.target_ingest import (DEFAULT_MAX_TARGETS, MAX_REJECTED_SAMPLES, IngestReport, TargetLimitError, iter_targets,
+                                 normalize_agent_guid)
+from utils.log import setup_logging
+
+_HOSTNAME_PATTERN = re.compile(r"^[A-Za-z0-9*?][A-Za-z0-9._*?-]{0,254}$")
+_IP_PATTERN = re.compile(r"^(?:[0-9.*?]*\.[0-9.*?]*|[0-9A-Fa-f:*?]*:[0-9A-Fa-f:*?]*)$")
+
+
+def classify_target(value):
+    """
+    判斷目標的類型
+    :return: ("guid" | "ip" | "ip_pattern" | "name" | "name_pattern", 正規化後的值)，無法辨識時回傳 None
+    """
+    guid = normalize_agent_guid(value)
+    if guid:
+        return "guid", guid
+    wildcard = "*" in value or "?" in value
+    if wildcard and _IP_PATTERN.match(value):
+        return "ip_pattern", value
+    if not wildcard:
+        try:
+            return "ip", str(ipaddress.ip_address(value))
+        except ValueError:
+            pass
+    if _HOSTNAME_PATTERN.match(value):
+        return ("name_pattern" if wildcard else "name"), value.lower()
+    return None
+
+
+def _normalize_target(value):
+    kind = classify_target(value)
+    return f"{kind[0]}:{kind[1]}" if kind else None
+
+
+class ResolveReport(IngestReport):
+    """IngestReport 加上名稱 / IP 解析的統計"""
+
+    __slots__ = ("resolved_tokens", "unresolved", "unresolved_samples", "guids")
+
+    def __init__(self, label="目標"):
+        super().__init__(label)
+        self.resolved_tokens = 0  # 成功對應到 Agent 的名稱 / IP / 萬用字元項目數
+        self.unresolved = 0
+        self.unresolved_samples = []  # [(行號, 內容), ...]
+        self.guids = 0  # 最終（去除重複後）的 Agent GUID 數
+
+    def summary(self):
+        text = super().summary()
+        if self.resolved_tokens or self.unresolved:
+            text += f"；名稱 / IP 解析：{self.resolved_tokens} 個項目對應成功，{self.unresolved} 個找不到"
+        return f"{text}；共 {self.guids} 台 Agent"
+
+    def unresolve(self, line_no, value):
+        self.unresolved += 1
+        if len(self.unresolved_samples) < MAX_REJECTED_SAMPLES:
+            self.unresolved_samples.append((line_no, value))
+
+    def print_report(self):
+        super().print_report()
+        for line_no, value in self.unresolved_samples:
+            print(f"⚠️ 第 {line_no} 行（找不到對應的 Endpoint）: {value}")
+
+
+def resolve_targets(lines, tenant_name=None, report=None, max_targets=DEFAULT_MAX_TARGETS, inventory=None):
+    """
+    將 Agent GUID、Endpoint 名稱、IP 或萬用字元（例如 `WEB-*`、`10.0.1.*`）轉換為 Agent GUID
+    名稱與 IP 會分批以 SQL `IN (...)` 查詢本機 Endpoint 清單；只有 GUID 時不會讀取清單
+    :param lines: 可逐行迭代的來源（檔案物件、`str.splitlines()` 等）
+    :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+    :param report: ResolveReport
+    :param inventory: EndpointInventory（未指定時於需要時建立，並在必要時同步）
+    :return: 依輸入順序且不重複的 Agent GUID 列表
+    :raises TargetLimitError: 不重複項目超過 `max_targets`
+    """
+    report = report if report is not None else ResolveReport()
+    tokens = [
+        (line_no, *value.split(":", 1))
+        for line_no, value in iter_targets(lines, _normalize_target, report, max_targets, with_line_no=True)
+    ]
+
+    exact = {"name": [], "ip": []}
+    for _, kind, value in tokens:
+        if kind in exact:
+            exact[kind].append(value)
+
+    lookups = {}
+    needs_inventory = any(kind != "guid" for _, kind, _ in tokens)
+    own_inventory = needs_inventory and inventory is None
+    if own_inventory:
+        inventory = EndpointInventory(tenant_name)
+
+    guids = {}  # dict 保留順序並去除重複
+    try:
+        if needs_inventory:
+            inventory.ensure_fresh()
+            lookups = {kind: inventory.lookup(kind, values) for kind, values in exact.items() if values}
+
+        for line_no, kind, value in tokens:
+            if kind == "guid":
+                guids[value] = None
+                continue
+            if kind in exact:
+                endpoints = lookups.get(kind, {}).get(value, [])
+            elif kind == "name_pattern":
+                endpoints = inventory.find(name=value)
+            else:
+                endpoints = inventory.find(ip=value)
+
+            if endpoints:
+                report.resolved_tokens += 1
+                guids.update((endpoint.agent_guid, None) for endpoint in endpoints)
+            else:
+                report.unresolve(line_no, value)
+    finally:
+        if own_inventory:
+            inventory.close()
+
+    report.guids = len(guids)
+    return list(guids)
+
+
+def read_agent_targets(file_path, tenant_name=None):
+    """
+    讀取目標清單檔案（每行一個 Agent GUID、Endpoint 名稱、IP 或萬用字元）並印出統計報告
+    :return: 不重複的 Agent GUID 列表，檔案不存在或超過上限時回傳 None
+    """
+    if not os.path.isfile(file_path):
+        print(f"❌ 錯誤: 檔案 '{file_path}' 不存在，請確認路徑")
+        return None
+
+    report = ResolveReport()
+    try:
+        with open(file_path, "r", encoding="utf-8-sig", errors="replace") as f:
+            agent_guids = resolve_targets(f, tenant_name, report)
+    except TargetLimitError as e:
+        print(f"❌ {e}")
+        return None
+
+    report.print_report()
+    if not agent_guids:
+        print("❌ 檔案內沒有有效的 Agent GUID")
+    return agent_guids
+
+
+def parse_agent_targets(text, tenant_name=None):
+    """
+    解析多行文字（例如 Streamlit text_area）中的目標
+    :return: (不重複的 Agent GUID 列表, ResolveReport)
+    :raises TargetLimitError: 不重複項目超過上限
+    """
+    report = ResolveReport()
+    return resolve_targets((text or "").splitlines(), tenant_name, report), report
+
+
+if __name__ == "__main__":
+    setup_logging()
+    target_file = input("請輸入目標清單的 txt 檔案路徑（GUID、名稱、IP 或萬用字元）: ").strip()
+    for agent_guid in read_agent_targets(target_file) or []:
+        print(agent_guid)
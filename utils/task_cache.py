@@ -0,0 +1,297 @@
+import logging
+import sqlite3
+import threading
+import time
+from utils.api_client import PaginationError, get_api_client
+from utils.endpoint_inventory import match_clause
+from utils.records import TERMINAL_STATUSES, TaskRecord, format_api_time, shift_api_time
+from utils.task_poller import CHANGED_SKEW, TASK_PAGE_SIZE, TASKS_PATH
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "task_cache.db"
+DEFAULT_MAX_AGE = 60  # 超過此秒數未同步時，讀取前會先做增量同步
+FULL_SYNC_INTERVAL = 24 * 3600  # 增量同步無法得知已被 API 清除的 Task，定期做完整同步
+DEFAULT_PAGE_SIZE = 100
+BUSY_TIMEOUT = 30  # 其他行程正在寫入時，等待資料庫鎖定釋放的秒數
+# 可排序的欄位 → SQL 欄位
+SORT_COLUMNS = {
+    "updated": "updated",
+    "created": "created",
+    "status": "status",
+    "action": "action",
+    "endpoint_name": "endpoint_name",
+    "task_id": "task_id",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    tenant TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    status TEXT,
+    action TEXT,
+    agent_guid TEXT,
+    endpoint_name TEXT COLLATE NOCASE,
+    file TEXT,
+    error TEXT,
+    description TEXT,
+    created TEXT,
+    updated TEXT,
+    sync_id INTEGER NOT NULL,
+    changed_sync_id INTEGER NOT NULL,
+    PRIMARY KEY (tenant, task_id)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (tenant, updated);
+CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (tenant, created);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (tenant, status);
+CREATE INDEX IF NOT EXISTS idx_tasks_changed ON tasks (tenant, changed_sync_id);
+CREATE TABLE IF NOT EXISTS sync_state (
+    tenant TEXT PRIMARY KEY,
+    sync_id INTEGER NOT NULL,
+    last_full_sync REAL,
+    last_sync REAL,
+    cursor TEXT
+);
+"""
+
+_FIELDS = TaskRecord.__slots__
+COLUMNS = ", ".join(_FIELDS)
+# 內容有變化時才更新，changed_sync_id 因此只標記本次真正變化的 Task
+_UPSERT = (
+    f"INSERT INTO tasks (tenant, {COLUMNS}, sync_id, changed_sync_id) "
+    f"VALUES (?, {', '.join('?' * len(_FIELDS))}, ?, ?) "
+    f"ON CONFLICT(tenant, task_id) DO UPDATE SET "
+    + ", ".join(f"{name} = excluded.{name}" for name in _FIELDS[1:])
+    + ", sync_id = excluded.sync_id, changed_sync_id = excluded.changed_sync_id WHERE "
+    + " OR ".join(f"{name} IS NOT excluded.{name}" for name in _FIELDS[1:])
+)
+
+
+class TaskCache:
+    """
+    本機 Task 清單（SQLite WAL），每個 Tenant 各自同步
+
+    第一次使用時完整同步；之後只取得游標之後建立或有動作的 Task（`dateTimeTarget=lastActionDateTime`），
+    並每 FULL_SYNC_INTERVAL 做一次完整同步。分頁、篩選與排序皆在本機以 SQL 完成，畫面只讀取目前頁面的資料。
+    """
+
+    def __init__(self, tenant_name=None, path=DEFAULT_CACHE_PATH):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        :param path: SQLite 檔案路徑
+        """
+        self.api_client = get_api_client(tenant_name)
+        self.tenant_name = self.api_client.tenant_name
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 同步 ----------
+
+    def sync_state(self):
+        """取得同步狀態 {"sync_id", "last_full_sync", "last_sync", "cursor"}，尚未同步時回傳 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sync_id, last_full_sync, last_sync, cursor FROM sync_state WHERE tenant = ?",
+                (self.tenant_name,)
+            ).fetchone()
+        return dict(zip(["sync_id", "last_full_sync", "last_sync", "cursor"], row)) if row else None
+
+    def _fetch_all(self, params=None):
+        """
+        取得 Task 清單（自動跟隨 nextLink 分頁）
+        :return: TaskRecord 列表，任一頁失敗時回傳 None
+        """
+        try:
+            return [TaskRecord.from_api(item)
+                    for item in self.api_client.paginate(TASKS_PATH, params=dict(params or {}, top=TASK_PAGE_SIZE))
+                    if item.get("id")]
+        except PaginationError as e:
+            logger.warning("%s", e)
+            return None
+
+    def sync(self, full=False):
+        """
+        同步 Task 清單
+        :param full: 強制完整同步（否則在可行時做增量同步）
+        :return: {"mode", "fetched", "changed", "removed", "seconds"}，失敗時回傳 None（本機資料維持不變）
+        """
+        state = self.sync_state()
+        if state is None or not state["cursor"] or not state["last_full_sync"] \
+                or time.time() - state["last_full_sync"] > FULL_SYNC_INTERVAL:
+            full = True
+
+        if not full:
+            result = self._sync(state, full=False)
+            if result is not None:
+                return result
+            logger.warning("Task 清單增量同步失敗，改用完整同步（Tenant: %s）", self.tenant_name)
+        return self._sync(state, full=True)
+
+    def _sync(self, state, full):
+        started = time.time()
+        params = None if full else {"startDateTime": state["cursor"], "dateTimeTarget": "lastActionDateTime"}
+
+        # 先取得所有分頁再寫入，呼叫 API 期間不持有資料庫鎖定
+        records = self._fetch_all(params)
+        if records is None:
+            print(f"❌ Task 清單{'完整' if full else '增量'}同步失敗，保留既有資料")
+            return None
+        fetched = len(records)
+        latest = max((r.updated for r in records if r.updated), default=None)
+
+        removed = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 在寫入交易內重新讀取同步狀態，避免與同時進行的同步使用相同的 sync_id 或讓游標倒退
+                row = self._conn.execute("SELECT sync_id, cursor FROM sync_state WHERE tenant = ?",
+                                         (self.tenant_name,)).fetchone()
+                current = dict(zip(("sync_id", "cursor"), row)) if row else None
+                sync_id = (current["sync_id"] if current else 0) + 1
+                before = self._conn.total_changes
+                self._conn.executemany(_UPSERT, [
+                    (self.tenant_name,) + tuple(getattr(r, name) for name in _FIELDS) + (sync_id, sync_id)
+                    for r in records
+                ])
+                changed = self._conn.total_changes - before
+                # 內容未變化的 Task 只更新 sync_id，供完整同步判斷是否已被清除
+                self._conn.executemany("UPDATE tasks SET sync_id = ? WHERE tenant = ? AND task_id = ?",
+                                       [(sync_id, self.tenant_name, r.task_id) for r in records])
+
+                if full:
+                    # 完整同步時未出現的 Task 視為已被 API 清除
+                    removed = self._conn.execute(
+                        "DELETE FROM tasks WHERE tenant = ? AND sync_id != ?", (self.tenant_name, sync_id)
+                    ).rowcount
+                cursor = self._next_cursor(current, latest, started)
+                self._conn.execute(
+                    "INSERT INTO sync_state (tenant, sync_id, last_full_sync, last_sync, cursor) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(tenant) DO UPDATE SET sync_id = excluded.sync_id, "
+                    "last_full_sync = COALESCE(excluded.last_full_sync, sync_state.last_full_sync), "
+                    "last_sync = excluded.last_sync, cursor = excluded.cursor",
+                    (self.tenant_name, sync_id, started if full else None, started, cursor)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        result = {"mode": "full" if full else "incremental", "fetched": fetched, "changed": changed,
+                  "removed": removed, "seconds": round(time.time() - started, 2)}
+        logger.info("Task 清單%s同步完成：取得 %d 筆，變更 %d 筆（%s 秒）", "完整" if full else "增量", fetched,
+                    changed, result["seconds"])
+        return result
+
+    @staticmethod
+    def _next_cursor(state, latest, started):
+        """以伺服器回傳的最新 lastActionDateTime 為游標；沒有新資料時沿用原游標"""
+        cursor = shift_api_time(latest, -CHANGED_SKEW) if latest else None
+        previous = state["cursor"] if state else None
+        if cursor is None:
+            return previous or format_api_time(started - CHANGED_SKEW)
+        return max(cursor, previous) if previous else cursor
+
+    def ensure_fresh(self, max_age=DEFAULT_MAX_AGE):
+        """
+        本機資料超過 `max_age` 秒未同步時先同步（從未同步時做完整同步）
+        :return: 有同步時回傳 `sync` 的結果，否則回傳 None
+        """
+        state = self.sync_state()
+        if state is not None and state["last_sync"] and time.time() - state["last_sync"] <= max_age:
+            return None
+        return self.sync()
+
+    # ---------- 查詢 ----------
+
+    def _where(self, statuses=None, action=None, search=None, active_only=False):
+        clauses, params = ["tenant = ?"], [self.tenant_name]
+        if statuses:
+            clauses.append(f"status IN ({','.join('?' * len(statuses))})")
+            params.extend(s.lower() for s in statuses)
+        if action:
+            clauses.append("action = ?")
+            params.append(action)
+        if search:
+            # Task ID 或端點名稱，可使用萬用字元 `*`、`?`
+            id_clause, id_params = match_clause("task_id", search)
+            name_clause, name_params = match_clause("endpoint_name", search)
+            clauses.append(f"(({id_clause}) OR ({name_clause}))")
+            params.extend(id_params + name_params)
+        if active_only:
+            clauses.append(f"status NOT IN ({','.join('?' * len(TERMINAL_STATUSES))})")
+            params.extend(sorted(TERMINAL_STATUSES))
+        return " AND ".join(clauses), params
+
+    def page(self, statuses=None, action=None, search=None, sort="updated", descending=True, offset=0,
+             limit=DEFAULT_PAGE_SIZE):
+        """
+        分頁查詢（篩選與排序皆在 SQLite 完成，只讀取目前頁面）
+        :param statuses: 狀態列表（例如 ["running", "failed"]）
+        :param action: 動作（例如 "collectFile"）
+        :param search: Task ID 或端點名稱，可使用萬用字元 `*`、`?`
+        :param sort: SORT_COLUMNS 的鍵
+        :return: TaskRecord 列表
+        """
+        where, params = self._where(statuses, action, search)
+        order = SORT_COLUMNS.get(sort, "updated")
+        direction = "DESC" if descending else "ASC"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {COLUMNS} FROM tasks WHERE {where} ORDER BY {order} {direction}, task_id {direction} "
+                f"LIMIT ? OFFSET ?", params + [int(limit), int(offset)]
+            ).fetchall()
+        return [TaskRecord(*row) for row in rows]
+
+    def active_records(self):
+        """尚未完成的 Task（用於決定自動更新間隔）"""
+        where, params = self._where(active_only=True)
+        with self._lock:
+            return [TaskRecord(*row) for row in self._conn.execute(f"SELECT {COLUMNS} FROM tasks WHERE {where}", params)]
+
+    def recent_changes(self, limit=None):
+        """最近一次同步中內容有變化的 Task"""
+        state = self.sync_state()
+        if state is None:
+            return []
+        sql = f"SELECT {COLUMNS} FROM tasks WHERE tenant = ? AND changed_sync_id = ? ORDER BY updated DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [TaskRecord(*row) for row in self._conn.execute(sql, (self.tenant_name, state["sync_id"]))]
+
+    def status_counts(self):
+        """:return: {狀態: 筆數}"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM tasks WHERE tenant = ? GROUP BY status ORDER BY COUNT(*) DESC",
+                (self.tenant_name,)
+            ).fetchall())
+
+    def actions(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT action FROM tasks WHERE tenant = ? AND action IS NOT NULL ORDER BY action",
+                (self.tenant_name,)
+            )]
+
+    def count(self, statuses=None, action=None, search=None):
+        """符合條件的筆數（條件同 `page`）"""
+        where, params = self._where(statuses, action, search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM tasks WHERE {where}", params).fetchone()[0]
+
+
+if __name__ == "__main__":
+    setup_logging()
+    cache = TaskCache()
+    print(cache.sync(full=input("是否完整同步？(Y/N): ").strip().lower() == "y"))
+    print(f"📋 本機共有 {cache.count()} 筆 Task：{cache.status_counts()}")
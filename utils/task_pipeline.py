@@ -0,0 +1,191 @@
+import logging
+import queue
+import threading
+import time
+from utils.download_task import TaskDownloader
+from utils.records import NOT_FOUND_STATUS, is_terminal
+from utils.target_ingest import normalize_task_id, read_targets
+from utils.task_poller import TaskPoller
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOWNLOAD_WORKERS = 8
+DEFAULT_EXTRACT_WORKERS = 2  # 7z 解壓縮主要受磁碟與 CPU 限制，不需要太多
+DEFAULT_MAX_WAIT = 3600  # 畫面上等待 Task 完成的預設上限（秒），超過時其餘 Task 標記為 Timeout
+QUEUE_SIZE_PER_WORKER = 2  # 每個 Worker 最多預先排隊的項目數，佇列滿時上游會暫停
+SUCCEEDED_STATUSES = ("succeeded", "completed")
+_STOP = None  # 通知 Worker 結束的佇列項目
+
+
+class TaskPipeline:
+    """
+    輪詢 → 下載 → 7z 解壓縮 的管線
+
+    - Task 一進入 succeeded 就交給下載 Worker，不必等全部 Task 完成後再執行一次下載
+    - 下載完成的壓縮檔交給解壓縮 Worker，查詢、下載與解壓縮同時進行
+    - 各段之間以有上限的佇列連接：下游忙碌時上游暫停，不會累積大量待處理的壓縮檔
+    - 使用與批次下載相同的工作紀錄，中斷後以相同清單重新執行會跳過已下載完成的 Task
+    """
+
+    def __init__(self, tenant_name=None, download_workers=DEFAULT_DOWNLOAD_WORKERS,
+                 extract_workers=DEFAULT_EXTRACT_WORKERS, check_interval=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        :param download_workers: 同時下載的 Task 數
+        :param extract_workers: 同時解壓縮的 Task 數
+        :param check_interval: 輪詢間隔秒數，未指定時依預估完成時間自動調整（見 TaskPoller）
+        """
+        self.downloader = TaskDownloader(tenant_name)
+        self.tenant_name = self.downloader.api_client.tenant_name
+        self.download_workers = max(1, download_workers)
+        self.downloader.api_client.ensure_pool_size(self.download_workers)  # 每個下載 Worker 都有可重複使用的連線
+        self.extract_workers = max(1, extract_workers)
+        self.check_interval = check_interval
+        self.download_queue = queue.Queue(maxsize=self.download_workers * QUEUE_SIZE_PER_WORKER)
+        self.extract_queue = queue.Queue(maxsize=self.extract_workers * QUEUE_SIZE_PER_WORKER)
+        self._results = {}
+        self._lock = threading.Lock()
+        self._job = None
+        self._on_result = None
+
+    def _finish(self, task_id, result):
+        """
+        記錄單一 Task 的最終結果（成功的 Task 立即寫入工作紀錄）
+        不會拋出例外：寫入工作紀錄失敗時改將 Task 標記為失敗，避免 Worker 執行緒中止後輪詢卡在已滿的佇列
+        """
+        if self._job is not None and result["status"] == "Success":
+            try:
+                self._job.record([(task_id, result)])
+            except Exception as e:
+                logger.exception("Task %s 寫入工作紀錄失敗", task_id)
+                result = self.downloader.make_result(task_id, f"Failed: {e}", result["password"])
+        with self._lock:
+            self._results[task_id] = result
+        print(f"{'✅' if result['status'] == 'Success' else '❌'} Task {task_id}: {result['status']}")
+        if self._on_result:
+            try:
+                self._on_result(result)
+            except Exception as e:
+                logger.warning("on_result 回呼失敗: %s", e)
+
+    # ---------- 各段 Worker ----------
+
+    def _download_worker(self):
+        while True:
+            task_id = self.download_queue.get()
+            if task_id is _STOP:
+                return
+            try:
+                task_info, zip_path, failure = self.downloader.fetch_archive(task_id)
+            except Exception as e:
+                logger.exception("下載 Task %s 失敗", task_id)
+                task_info, failure = None, self.downloader.make_result(task_id, f"Download Failed: {e}")
+            if failure:
+                self._finish(task_id, failure)
+            else:
+                self.extract_queue.put((task_info, zip_path))
+
+    def _extract_worker(self):
+        while True:
+            item = self.extract_queue.get()
+            if item is _STOP:
+                return
+            task_info, zip_path = item
+            try:
+                result = self.downloader.extract_archive(task_info, zip_path)
+            except Exception as e:
+                logger.exception("解壓縮 Task %s 失敗", task_info["task_id"])
+                result = self.downloader.make_result(task_info["task_id"], f"Extract Failed: {e}", task_info["password"])
+            self._finish(task_info["task_id"], result)
+
+    def _poll(self, task_ids, max_wait):
+        """輪詢直到全部 Task 完成（或超過 `max_wait` 秒），完成的 Task 立即送入下載佇列"""
+        poller = TaskPoller(self.tenant_name, adaptive=self.check_interval is None)
+        poller.add(task_ids)
+        started = time.time()
+        while not poller.done:
+            for record in poller.poll():
+                if not is_terminal(record.status):
+                    continue
+                if record.status in SUCCEEDED_STATUSES:
+                    self.download_queue.put(record.task_id)  # 佇列滿時在此等待下載 Worker
+                elif record.status == NOT_FOUND_STATUS:
+                    self._finish(record.task_id, self.downloader.make_result(record.task_id, "Failed: Task not found"))
+                else:
+                    self._finish(record.task_id, self.downloader.make_result(record.task_id, f"Task {record.status}"))
+            if poller.done:
+                break
+            if max_wait is not None and time.time() - started > max_wait:
+                for task_id in list(poller.active):
+                    self._finish(task_id, self.downloader.make_result(task_id, "Timeout"))
+                break
+            wait = self.check_interval if self.check_interval is not None else poller.seconds_until_next()
+            if max_wait is not None:
+                wait = min(wait, max(0.0, started + max_wait - time.time()))
+            time.sleep(wait)
+        print(poller.summary())
+
+    # ---------- 執行 ----------
+
+    def run(self, task_ids, resume=True, max_wait=None, on_result=None):
+        """
+        等待 Task 完成並自動下載、解壓縮
+        :param task_ids: Task ID 列表
+        :param resume: 是否使用工作紀錄（跳過上次已下載完成的 Task）
+        :param max_wait: 最多等待 Task 完成的秒數，超過時其餘 Task 標記為 Timeout；未指定時等到全部完成
+        :param on_result: 每個 Task 有最終結果時呼叫 `on_result(result)`（於 Worker 執行緒中呼叫）
+        :return: 結果列表（依 `task_ids` 順序），已匯出至 CSV
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        if not task_ids:
+            return []
+        self._results, self._on_result = {}, on_result
+        self._job = self.downloader.start_job(task_ids) if resume else None
+        pending = self._job.pending() if self._job else task_ids
+        print(f"🚚 管線模式：{len(pending)} 個 Task 完成後自動下載（下載 {self.download_workers} / "
+              f"解壓縮 {self.extract_workers} 個 Worker）")
+
+        downloaders = [threading.Thread(target=self._download_worker, name=f"v1-pipeline-download-{i}", daemon=True)
+                       for i in range(self.download_workers)]
+        extractors = [threading.Thread(target=self._extract_worker, name=f"v1-pipeline-extract-{i}", daemon=True)
+                      for i in range(self.extract_workers)]
+        for worker in downloaders + extractors:
+            worker.start()
+        try:
+            try:
+                self._poll(pending, max_wait)
+            finally:
+                # 依序關閉：輪詢結束 → 下載 Worker 全部結束 → 解壓縮 Worker 結束
+                for _ in downloaders:
+                    self.download_queue.put(_STOP)
+                for worker in downloaders:
+                    worker.join()
+                for _ in extractors:
+                    self.extract_queue.put(_STOP)
+                for worker in extractors:
+                    worker.join()
+
+            if self._job:
+                results = self.downloader.finish_job(self._job, list(self._results.values()))
+            else:
+                results = [self._results.get(task_id) or self.downloader.make_result(task_id, "Not Processed")
+                           for task_id in task_ids]
+        finally:
+            if self._job:
+                self._job.close()
+        self.downloader.export_results(results)
+        return results
+
+    def run_from_file(self, task_file, **kwargs):
+        """讀取 Task ID 清單後執行 `run`（參數同 `run`）"""
+        task_ids, _ = read_targets(task_file, normalize_task_id, "Task ID")
+        if not task_ids:
+            return
+        return self.run(task_ids, **kwargs)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    task_file = input("請輸入包含 Task ID 的 txt 檔案路徑: ").strip()
+    TaskPipeline().run_from_file(task_file)
@@ -0,0 +1,302 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.api_client import PaginationError, get_api_client
+from utils.async_api_client import DEFAULT_CONCURRENCY
+from utils.poll_scheduler import MIN_POLL_INTERVAL, PollScheduler, lookup_os_names
+from utils.records import NOT_FOUND_STATUS, TERMINAL_STATUSES, TaskRecord, format_api_time, is_terminal, shift_api_time
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+TASKS_PATH = "/v3.0/response/tasks"
+DEFAULT_POLL_INTERVAL = 90  # 未使用自動調整（adaptive=False）時的每輪間隔
+TASK_FILTER_BATCH_SIZE = 50  # 以 TMV1-Filter 批次查詢時，每個請求包含的 Task ID 數
+TASK_PAGE_SIZE = 200
+CHANGED_SKEW = 60  # 增量查詢的時間游標往前多取的秒數，避免時鐘誤差漏掉狀態變化
+# 增量 / 批次查詢失敗後改用較慢查詢方式的秒數；失敗也可能只是暫時的網路或伺服器錯誤，之後會再嘗試
+CAPABILITY_RETRY = 600
+# 確定查無資料（批次查詢成功但結果不含該 ID，或單筆查詢回應 404）幾輪的 Task 標記為 notfound 並移出工作集；
+# 網路或伺服器錯誤不計入
+NOT_FOUND_ATTEMPTS = 3
+_NOT_FOUND = object()  # 單筆查詢回應 404 時 `send_request` 的回傳值
+
+
+class TaskPoller:
+    """
+    增量 Task 狀態輪詢
+
+    - 已完成（succeeded / failed …）的 Task 立即移出工作集，不再查詢
+    - 第一次（或新加入的 Task）以 TMV1-Filter `id eq ...` 批次查詢 Task 清單，每個請求 TASK_FILTER_BATCH_SIZE 個 ID
+    - 之後每一輪只查詢「上次之後有動作」的 Task（`dateTimeTarget=lastActionDateTime`），數千個 Task 也只需數頁
+    - API 不接受篩選條件時自動退回逐一 `GET /tasks/{id}`，CAPABILITY_RETRY 秒後再嘗試批次 / 增量查詢
+    - 有 NOT_FOUND_ATTEMPTS 輪確定查無資料的 Task 視為已完成（狀態 notfound）；查詢失敗的輪次不計入
+    - 每個 Task 依動作與 OS 的完成時間統計排定下次查詢時間（見 PollScheduler），只查詢已到期的 Task；
+      完成的 Task 會記錄下發到完成的時間，讓之後的排程更準確
+    """
+
+    def __init__(self, tenant_name=None, concurrency=DEFAULT_CONCURRENCY, scheduler=None, adaptive=True):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        :param concurrency: 退回逐一查詢時同時進行的請求數上限
+        :param scheduler: PollScheduler，未指定時使用預設的完成時間統計
+        :param adaptive: 為 False 時每一輪查詢全部未完成的 Task（固定間隔）
+        """
+        self.api_client = get_api_client(tenant_name)
+        self.concurrency = concurrency
+        self.records = {}  # {task_id: TaskRecord}，包含已完成的 Task
+        self.active = {}  # 尚未完成的 Task ID（dict 保留加入順序）
+        self.unseen = {}  # 尚未取得過狀態的 Task ID
+        self.misses = {}  # {task_id: 確定查無資料的輪數}
+        self.cursor = None  # 增量查詢的時間游標（API 的 lastActionDateTime）
+        self.fallback_until = {"changed": 0.0, "filter": 0.0}  # 暫停使用增量 / 批次查詢直到此 epoch 秒數
+        self.calls = 0  # 累計 API 請求數
+        self.scheduler = (scheduler or PollScheduler()) if adaptive else None
+        self.due = {}  # {task_id: 下次查詢的 epoch 秒數}
+        self.os_names = {}  # {agent_guid: OS 名稱}，取自本機 Endpoint 清單
+
+    def add(self, task_ids):
+        """加入要追蹤的 Task ID（已追蹤的會略過）"""
+        for task_id in task_ids:
+            if task_id not in self.records and task_id not in self.active:
+                self.active[task_id] = None
+                self.unseen[task_id] = None
+                self.due[task_id] = 0
+
+    @property
+    def done(self):
+        return not self.active
+
+    @property
+    def changed_supported(self):
+        return time.time() >= self.fallback_until["changed"]
+
+    @property
+    def filter_supported(self):
+        return time.time() >= self.fallback_until["filter"]
+
+    def _fall_back(self, capability, message):
+        """暫停使用增量（"changed"）或批次（"filter"）查詢 CAPABILITY_RETRY 秒"""
+        print(f"⚠️ {message}，{CAPABILITY_RETRY // 60} 分鐘後再嘗試")
+        self.fallback_until[capability] = time.time() + CAPABILITY_RETRY
+
+    # ---------- 查詢 ----------
+
+    def _fetch_list(self, params=None, extra_headers=None):
+        """
+        逐頁取得 Task 清單
+        :return: Task dict 列表，任一頁失敗時回傳 None
+        """
+        items = []
+        try:
+            for page in self.api_client.pages(TASKS_PATH, params=dict(params or {}, top=TASK_PAGE_SIZE),
+                                              extra_headers=extra_headers):
+                self.calls += 1
+                items.extend(page)
+        except PaginationError as e:
+            self.calls += 1
+            logger.warning("%s", e)
+            return None
+        return items
+
+    def _fetch_by_ids(self, task_ids):
+        """
+        以 TMV1-Filter 批次查詢指定的 Task
+        :return: (Task dict 列表, 查詢成功的 Task ID 列表)；第一批就失敗（API 不接受篩選條件或暫時錯誤）時回傳 None
+        """
+        items, queried = [], []
+        for start in range(0, len(task_ids), TASK_FILTER_BATCH_SIZE):
+            batch = task_ids[start:start + TASK_FILTER_BATCH_SIZE]
+            page = self._fetch_list(extra_headers={"TMV1-Filter": " or ".join(f"id eq '{i}'" for i in batch)})
+            if page is None:
+                if start == 0:
+                    return None
+                logger.warning("批次查詢 Task 中斷，其餘 Task 改為逐一查詢")
+                break
+            items.extend(page)
+            queried.extend(batch)
+        return items, queried
+
+    def _fetch_changed(self):
+        """
+        查詢游標之後有動作的 Task（整個 Tenant）
+        :return: Task dict 列表；API 不支援時回傳 None
+        """
+        return self._fetch_list(params={"startDateTime": self.cursor, "dateTimeTarget": "lastActionDateTime"})
+
+    def _get_one(self, task_id):
+        result = self.api_client.send_request("GET", f"{TASKS_PATH}/{task_id}", not_found=_NOT_FOUND)
+        return result if isinstance(result, dict) or result is _NOT_FOUND else None
+
+    def _fetch_each(self, task_ids):
+        """
+        逐一查詢（同時最多 `concurrency` 個請求）
+        :return: (Task dict 列表, 回應 404 的 Task ID 列表)；查詢失敗的 Task 兩者皆不包含
+        """
+        if not task_ids:
+            return [], []
+        self.calls += len(task_ids)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(task_ids))),
+                                thread_name_prefix="v1-task-poll") as executor:
+            results = list(executor.map(self._get_one, task_ids))
+        return ([result for result in results if isinstance(result, dict)],
+                [task_id for task_id, result in zip(task_ids, results) if result is _NOT_FOUND])
+
+    # ---------- 輪詢 ----------
+
+    def due_tasks(self, now=None):
+        """已到期需要查詢的 Task ID"""
+        if self.scheduler is None:
+            return list(self.active)
+        now = time.time() if now is None else now
+        return [task_id for task_id in self.active if self.due.get(task_id, 0) <= now]
+
+    def seconds_until_next(self, now=None):
+        """距離下一個 Task 到期的秒數，沒有未完成的 Task 時回傳 None"""
+        if not self.active:
+            return None
+        if self.scheduler is None:
+            return DEFAULT_POLL_INTERVAL
+        now = time.time() if now is None else now
+        return max(0.0, min(self.due.get(task_id, 0) for task_id in self.active) - now)
+
+    def _query_round(self, due):
+        """
+        本輪需要的查詢：尚未取得過狀態的 Task 以 ID 查詢，其餘以增量清單查詢
+        :return: (Task dict 列表, 本輪確定查無資料的 Task ID 集合)
+        """
+        items, missing = [], set()
+        by_id = list(self.unseen)
+        if self.cursor and self.changed_supported:
+            changed = self._fetch_changed()
+            if changed is None:
+                self._fall_back("changed", "Task 清單增量查詢失敗，改為依 Task ID 批次查詢")
+            else:
+                items.extend(changed)
+        if not self.cursor or not self.changed_supported:
+            by_id = due
+
+        if by_id and self.filter_supported:
+            fetched = self._fetch_by_ids(by_id)
+            if fetched is None:
+                self._fall_back("filter", "Task 清單批次查詢（TMV1-Filter）失敗，改為逐一查詢 Task")
+            else:
+                fetched, queried = fetched
+                items.extend(fetched)
+                found = {item.get("id") for item in fetched}
+                absent = [task_id for task_id in queried if task_id not in found]
+                missing.update(absent)
+                # 批次查詢找不到且尚未取得過狀態的 Task 以單筆查詢確認一次，其餘交給增量查詢
+                items.extend(self._fetch_each([task_id for task_id in absent if task_id in self.unseen])[0])
+                queried = set(queried)
+                by_id = [task_id for task_id in by_id if task_id not in queried]  # 批次查詢中斷時未查詢到的 Task
+        fetched, not_found = self._fetch_each(by_id)
+        items.extend(fetched)
+        missing.update(not_found)
+        return items, missing
+
+    def poll(self):
+        """
+        進行一輪查詢，並將已完成的 Task 移出工作集
+        :return: 本輪狀態有變化的 TaskRecord 列表
+        """
+        started = time.time()
+        due = self.due_tasks(started)
+        if not due:
+            return []
+        items, missing = self._query_round(due)
+
+        changed, seen, finished = [], [], []
+        latest = None
+        for item in items:
+            updated = item.get("lastActionDateTime")
+            if updated and (latest is None or updated > latest):
+                latest = updated
+            task_id = item.get("id")
+            if task_id not in self.active:
+                continue  # 其他工作的 Task 或已完成的 Task
+            record = TaskRecord.from_api(item)
+            previous = self.records.get(task_id)
+            self.records[task_id] = record
+            self.unseen.pop(task_id, None)
+            self.misses.pop(task_id, None)
+            seen.append(task_id)
+            if previous is None or previous.status != record.status:
+                changed.append(record)
+            if is_terminal(record.status):
+                del self.active[task_id]
+                self.due.pop(task_id, None)
+                finished.append(record)
+
+        for task_id in missing:
+            if task_id not in self.unseen:
+                continue  # 單筆確認時找到，或之前已取得過狀態
+            self.misses[task_id] = self.misses.get(task_id, 0) + 1
+            if self.misses[task_id] >= NOT_FOUND_ATTEMPTS:
+                logger.warning("Task %s 有 %d 輪確定查無資料，不再追蹤", task_id, NOT_FOUND_ATTEMPTS)
+                record = self.records[task_id] = TaskRecord(task_id, NOT_FOUND_STATUS,
+                                                            error=f"{NOT_FOUND_ATTEMPTS} 輪查詢都確定查無此 Task")
+                del self.unseen[task_id], self.active[task_id], self.misses[task_id]
+                self.due.pop(task_id, None)
+                changed.append(record)
+
+        if self.scheduler is not None:
+            self._reschedule(set(due).union(seen), finished, started)
+
+        # 以伺服器回傳的時間為游標；第一輪沒有任何資料時才使用本機時間
+        if latest is None and self.cursor is None:
+            latest = format_api_time(started)
+        cursor = shift_api_time(latest, -CHANGED_SKEW) if latest else None
+        if cursor and (self.cursor is None or cursor > self.cursor):
+            self.cursor = cursor
+        return changed
+
+    def _reschedule(self, task_ids, finished, now):
+        """記錄完成時間，並排定本輪查詢過或有更新的 Task 的下次查詢時間"""
+        records = [self.records[task_id] for task_id in task_ids if task_id in self.records] + finished
+        new_guids = {r.agent_guid for r in records if r.agent_guid and r.agent_guid not in self.os_names}
+        if new_guids:
+            os_names = lookup_os_names(new_guids, self.api_client.tenant_name)
+            self.os_names.update((guid, os_names.get(guid)) for guid in new_guids)
+        if finished:
+            self.scheduler.stats.observe(finished, self.os_names)
+
+        for task_id in task_ids:
+            if task_id not in self.active:
+                continue
+            record = self.records.get(task_id)
+            if record is None:  # 查不到的 Task 稍後再試
+                self.due[task_id] = now + MIN_POLL_INTERVAL
+            else:
+                self.due[task_id] = self.scheduler.next_poll(record, self.os_names.get(record.agent_guid), now)
+
+    def run(self, interval=None, on_update=None):
+        """
+        持續輪詢直到所有 Task 完成
+        :param interval: 每輪間隔秒數，未指定時等到下一個 Task 到期（adaptive=False 時為 DEFAULT_POLL_INTERVAL）
+        :param on_update: 每輪結束後呼叫 `on_update(poller, changed)`
+        :return: {task_id: TaskRecord}
+        """
+        while self.active:
+            changed = self.poll()
+            if on_update:
+                on_update(self, changed)
+            if self.active:
+                time.sleep(interval if interval is not None else self.seconds_until_next())
+        return self.records
+
+    def summary(self):
+        """一行文字摘要"""
+        finished = len(self.records) - sum(1 for task_id in self.active if task_id in self.records)
+        return (f"📊 Task：已完成 {finished} 個，進行中 {len(self.active)} 個"
+                f"（尚未取得狀態 {len(self.unseen)} 個），累計 API 請求 {self.calls} 次")
+
+
+if __name__ == "__main__":
+    from utils.target_ingest import normalize_task_id, read_targets
+
+    setup_logging()
+    task_ids, _ = read_targets(input("請輸入包含 Task ID 的 txt 檔案路徑: ").strip(), normalize_task_id, "Task ID")
+    poller = TaskPoller()
+    poller.add(task_ids or [])
+    poller.run(on_update=lambda p, changed: print(p.summary()))
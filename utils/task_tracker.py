@@ -0,0 +1,393 @@
+import datetime
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from utils.config_manager import ConfigManager
+from utils.records import TaskRecord, is_terminal
+from utils.task_poller import TaskPoller
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACKER_PATH = "task_tracker.db"
+DEFAULT_TRACKER_LOG = "task_tracker.log"
+LEASE_NAME = "tracker"
+LEASE_TTL = 30  # 秒；背景程序停止更新超過此時間即視為已結束，可由新的程序接手
+LEASE_RENEW_INTERVAL = LEASE_TTL / 3  # 租約由獨立的執行緒定期延長，與單輪查詢花費的時間無關
+REGISTER_CHECK_INTERVAL = 5  # 背景程序檢查新登記 Task 的間隔
+IDLE_EXIT = 600  # 沒有未完成的 Task 超過此秒數後背景程序自動結束
+UNAVAILABLE_RETRY = 300  # 無法建立 API 連線的 Tenant 暫停此秒數後再嘗試（期間不計入未完成的 Task）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    tenant TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    status TEXT,
+    action TEXT,
+    agent_guid TEXT,
+    endpoint_name TEXT,
+    file TEXT,
+    error TEXT,
+    description TEXT,
+    created TEXT,
+    updated TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    registered_at TEXT NOT NULL,
+    checked_at TEXT,
+    PRIMARY KEY (tenant, task_id)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_pending ON tasks (done, tenant);
+CREATE TABLE IF NOT EXISTS lease (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    pid INTEGER,
+    expires REAL NOT NULL,
+    heartbeat TEXT
+);
+"""
+
+_RECORD_FIELDS = TaskRecord.__slots__[1:]  # task_id 之外的欄位
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class TaskStore:
+    """
+    Task 追蹤的共用狀態（SQLite WAL，可同時由多個 Streamlit Session 與背景程序開啟）
+
+    - 各 Session 以 `register` 登記要追蹤的 Task ID，同一個 Task 只會登記一次
+    - 背景程序（TaskTracker）查詢後寫回狀態，畫面直接讀取，不需要呼叫 API
+    - `lease` 資料表確保同一時間只有一個背景程序在查詢
+    """
+
+    def __init__(self, path=DEFAULT_TRACKER_PATH):
+        """
+        :param path: SQLite 檔案路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- Task ----------
+
+    def register(self, task_ids, tenant_name):
+        """
+        登記要追蹤的 Task ID（已登記的會略過）
+        :param tenant_name: Tenant 名稱
+        :return: 新登記的數量
+        """
+        now = _now()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tasks (tenant, task_id, registered_at) VALUES (?, ?, ?)",
+                [(tenant_name, task_id, now) for task_id in task_ids]
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def pending(self):
+        """
+        尚未完成的 Task
+        :return: {tenant: [task_id, ...]}
+        """
+        pending = {}
+        with self._lock:
+            for tenant, task_id in self._conn.execute("SELECT tenant, task_id FROM tasks WHERE done = 0"):
+                pending.setdefault(tenant, []).append(task_id)
+        return pending
+
+    def save(self, tenant_name, records):
+        """
+        寫回查詢到的 Task 狀態（單一交易，失敗時整批復原）
+        :raises sqlite3.Error: 寫入失敗
+        """
+        now = _now()
+        assignments = ", ".join(f"{name} = ?" for name in _RECORD_FIELDS)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"UPDATE tasks SET {assignments}, done = ?, checked_at = ? WHERE tenant = ? AND task_id = ?",
+                    [tuple(getattr(record, name) for name in _RECORD_FIELDS)
+                     + (int(is_terminal(record.status)), now, tenant_name, record.task_id) for record in records]
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+
+    def task_records(self, tenant_name, task_ids=None):
+        """
+        讀取已登記 Task 的最新狀態（不呼叫 API），尚未查詢過的 Task 狀態為 None
+        :param task_ids: 只讀取指定的 Task，未指定時為該 Tenant 全部
+        :return: TaskRecord 列表（依登記時間排序）
+        """
+        columns = ", ".join(("task_id",) + _RECORD_FIELDS)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {columns} FROM tasks WHERE tenant = ? ORDER BY registered_at, task_id", (tenant_name,)
+            ).fetchall()
+        if task_ids is not None:
+            wanted = set(task_ids)
+            rows = [row for row in rows if row[0] in wanted]
+        return [TaskRecord(*row) for row in rows]
+
+    def counts(self, tenant_name):
+        """:return: (已完成數, 未完成數)"""
+        with self._lock:
+            rows = dict(self._conn.execute(
+                "SELECT done, COUNT(*) FROM tasks WHERE tenant = ? GROUP BY done", (tenant_name,)
+            ).fetchall())
+        return rows.get(1, 0), rows.get(0, 0)
+
+    def forget_finished(self, tenant_name):
+        """清除該 Tenant 已完成的 Task 紀錄，回傳刪除數量"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM tasks WHERE tenant = ? AND done = 1", (tenant_name,)).rowcount
+
+    # ---------- Lease ----------
+
+    def acquire_lease(self, owner, ttl=LEASE_TTL):
+        """
+        取得或延長背景程序的租約；其他程序的租約尚未過期時回傳 False
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT owner, expires FROM lease WHERE name = ?", (LEASE_NAME,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                self._conn.execute("ROLLBACK")
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lease (name, owner, pid, expires, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                (LEASE_NAME, owner, os.getpid(), now + ttl, _now())
+            )
+            self._conn.execute("COMMIT")
+        return True
+
+    def release_lease(self, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM lease WHERE name = ? AND owner = ?", (LEASE_NAME, owner))
+
+    def lease_info(self):
+        """
+        目前背景程序的資訊
+        :return: {"owner", "pid", "heartbeat"}，沒有執行中的背景程序時回傳 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner, pid, heartbeat FROM lease WHERE name = ? AND expires > ?", (LEASE_NAME, time.time())
+            ).fetchone()
+        return dict(zip(("owner", "pid", "heartbeat"), row)) if row else None
+
+
+class TaskTracker:
+    """
+    共用的背景 Task 追蹤程序
+
+    - 同一時間只有一個程序持有租約；其他 Session 只登記 Task ID，不會各自輪詢
+    - 每個 Tenant 使用一個 TaskPoller（批次 / 增量查詢，依完成時間排定查詢），同一個 Task 只查詢一次
+    - 租約由獨立的執行緒每 LEASE_RENEW_INTERVAL 秒延長，單輪查詢再久也不會讓第二個程序接手
+    - 沒有未完成的 Task 超過 IDLE_EXIT 秒後自動結束，下次登記時再啟動（一直查不到的 Task 由 TaskPoller 標記為 notfound）
+    - 無法建立 API 連線的 Tenant 暫停 UNAVAILABLE_RETRY 秒且不計入未完成的 Task，不會讓背景程序永遠無法結束
+    - 寫回狀態失敗時保留結果，下一輪再寫入，不會讓背景程序中止
+    """
+
+    def __init__(self, store=None):
+        """
+        :param store: TaskStore，未指定時使用預設檔案
+        """
+        self.store = store or TaskStore()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.pollers = {}  # {tenant: TaskPoller}
+        self.unavailable = {}  # {tenant: 下次嘗試建立 TaskPoller 的時間}
+        self.unsaved = {}  # {tenant: {task_id: TaskRecord}}，寫回失敗、等待下一輪重試的狀態
+        self.lease_lost = threading.Event()
+
+    def _renew_lease(self, stop):
+        """定期延長租約，直到 `stop` 被設定或租約被其他程序取得"""
+        while not stop.wait(LEASE_RENEW_INTERVAL):
+            try:
+                renewed = self.store.acquire_lease(self.owner)
+            except sqlite3.Error as e:
+                logger.warning("延長租約失敗，稍後重試: %s", e)
+                continue
+            if not renewed:
+                self.lease_lost.set()
+                return
+
+    def _sync(self):
+        """
+        將新登記的 Task 加入對應 Tenant 的 TaskPoller
+        :return: 可查詢的未完成 Task 數（無法建立 API 連線的 Tenant 不計入）
+        """
+        try:
+            pending = self.store.pending()
+        except sqlite3.Error as e:
+            logger.warning("讀取登記的 Task 失敗，稍後重試: %s", e)
+            return sum(len(poller.active) for poller in self.pollers.values())
+
+        total = 0
+        for tenant, task_ids in pending.items():
+            poller = self.pollers.get(tenant)
+            if poller is None:
+                if self.unavailable.get(tenant, 0) > time.time():
+                    continue
+                try:
+                    poller = self.pollers[tenant] = TaskPoller(tenant)
+                except Exception as e:
+                    logger.warning("無法建立 Tenant %s 的 API 連線，%d 秒後再嘗試: %s", tenant, UNAVAILABLE_RETRY, e)
+                    self.unavailable[tenant] = time.time() + UNAVAILABLE_RETRY
+                    continue
+                self.unavailable.pop(tenant, None)
+            poller.add(task_ids)
+            total += len(task_ids)
+        return total
+
+    def _save(self, tenant, records):
+        """
+        寫回 Task 狀態；失敗時保留在 `unsaved`，下一輪與新的結果一起重試
+        :return: 是否寫入成功
+        """
+        unsaved = self.unsaved.setdefault(tenant, {})
+        unsaved.update((record.task_id, record) for record in records)
+        try:
+            self.store.save(tenant, list(unsaved.values()))
+        except sqlite3.Error as e:
+            logger.warning("寫回 Tenant %s 的 %d 個 Task 狀態失敗，下一輪重試: %s", tenant, len(unsaved), e)
+            return False
+        del self.unsaved[tenant]
+        return True
+
+    def poll_once(self):
+        """
+        查詢一輪到期的 Task 並寫回狀態
+        :return: 下一個 Task 到期前的秒數（沒有未完成的 Task 時為 None）
+        """
+        waits = []
+        for tenant, poller in list(self.pollers.items()):
+            if self.lease_lost.is_set():
+                break
+            try:
+                changed = poller.poll()
+            except Exception as e:
+                logger.warning("查詢 Tenant %s 的 Task 狀態失敗: %s", tenant, e)
+                continue
+            if (changed or tenant in self.unsaved) and self._save(tenant, changed):
+                logger.info("Tenant %s：%d 個 Task 狀態更新，%d 個未完成", tenant, len(changed), len(poller.active))
+            if tenant in self.unsaved:
+                waits.append(REGISTER_CHECK_INTERVAL)  # 等下一輪重試寫回
+            elif poller.done:
+                del self.pollers[tenant]  # 釋放已完成 Task 的紀錄，有新登記時再建立
+            else:
+                waits.append(poller.seconds_until_next())
+        return min(waits) if waits else None
+
+    def run(self, idle_exit=IDLE_EXIT):
+        """
+        持續追蹤直到閒置超過 `idle_exit` 秒
+        :return: 是否取得租約（已有其他背景程序時回傳 False）
+        """
+        if not self.store.acquire_lease(self.owner):
+            print(f"ℹ️ 已有背景追蹤程序執行中: {self.store.lease_info()}")
+            return False
+
+        print(f"🛰️ Task 背景追蹤程序啟動（{self.owner}）")
+        idle_since = None
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew_lease, args=(stop,), name="task-tracker-lease", daemon=True)
+        renewer.start()
+        try:
+            while True:
+                if self.lease_lost.is_set():
+                    print("⚠️ 租約已被其他程序取得，結束追蹤")
+                    return True
+                if self._sync():
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.time()
+                elif time.time() - idle_since > idle_exit:
+                    if self.unavailable:
+                        print(f"⚠️ Tenant {', '.join(self.unavailable)} 無法建立 API 連線，其 Task 待下次登記時再追蹤")
+                    print("✅ 沒有可查詢的未完成 Task，背景追蹤程序結束")
+                    return True
+
+                wait = self.poll_once()
+                time.sleep(REGISTER_CHECK_INTERVAL if wait is None else min(wait, REGISTER_CHECK_INTERVAL))
+        finally:
+            stop.set()
+            renewer.join()
+            self.store.release_lease(self.owner)
+
+
+def ensure_tracker(store=None, log_path=DEFAULT_TRACKER_LOG):
+    """
+    確認背景追蹤程序正在執行，沒有時以不開啟視窗的方式啟動（輸出寫入 `log_path`）
+    多個 Session 同時啟動時只有取得租約的程序會繼續執行
+    :return: True 表示已有執行中的程序，False 表示剛啟動新的程序
+    """
+    own_store = store is None
+    store = store or TaskStore()
+    try:
+        if store.lease_info():
+            return True
+    finally:
+        if own_store:
+            store.close()
+
+    options = {}
+    if os.name == "nt":
+        options["creationflags"] = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options["start_new_session"] = True  # 不隨 Streamlit 結束
+    with open(log_path, "ab") as log:
+        subprocess.Popen([sys.executable, "-m", "utils.task_tracker", "--daemon"], cwd=os.getcwd(),
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, **options)
+    return False
+
+
+def track_tasks(task_ids, tenant_name=None):
+    """
+    登記要追蹤的 Task ID 並確認背景追蹤程序正在執行
+    :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+    :return: (Tenant 名稱, 新登記的數量)
+    """
+    tenant_name = tenant_name or ConfigManager().get_active_tenant_name()
+    store = TaskStore()
+    try:
+        added = store.register(task_ids, tenant_name)
+    finally:
+        store.close()
+    ensure_tracker()
+    return tenant_name, added
+
+
+if __name__ == "__main__":
+    setup_logging()
+    if "--daemon" in sys.argv[1:]:
+        TaskTracker().run()
+    else:
+        from utils.target_ingest import normalize_task_id, read_targets
+
+        task_ids, _ = read_targets(input("請輸入包含 Task ID 的 txt 檔案路徑: ").strip(), normalize_task_id, "Task ID")
+        if task_ids:
+            tenant, added = track_tasks(task_ids)
+            print(f"✅ 已登記 {added} 個 Task（Tenant: {tenant}），由背景程序追蹤，狀態寫入 {DEFAULT_TRACKER_PATH}")
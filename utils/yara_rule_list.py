@@ -1,11 +1,21 @@
 import os
-from utils.api_client import APIClient
+from utils.api_client import PaginationError, get_api_client
 
 class YaraRuleManager:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
 
-    def list_yara_rules(self, filter_str=None, top=100):
+    def list_yara_rules(self, filter_str=None, top=100, use_cache=True):
+        """
+        列出所有 YARA 規則（自動跟隨 nextLink 分頁）
+        :param filter_str: 篩選條件（可選）
+        :param top: 每頁筆數
+        :param use_cache: 使用快取（預設開啟）
+        :return: YARA 規則列表，分頁讀取失敗時回傳 None（不回傳不完整的清單）
+        """
         endpoint = "/v3.0/response/yaraRuleFiles"
         params = {
             "top": top
@@ -13,14 +23,16 @@ class YaraRuleManager:
         if filter_str:
             params["filter"] = filter_str
 
-        response = self.api_client.send_request("GET", endpoint, params=params)
-        print("📦 API 回應:", response)
+        try:
+            rules = list(self.api_client.paginate(endpoint, params=params, use_cache=use_cache))
+        except PaginationError as e:
+            print(f"❌ YARA 規則清單讀取失敗：{e}")
+            return None
 
-        if not response:
+        if not rules:
             print("❌ 無法取得 YARA 規則清單，請檢查 API 權限或網路連線")
             return []
 
-        rules = response.get("items", [])
         return [
             {
                 "ID": rule.get("id", "N/A"),
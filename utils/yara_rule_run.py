@@ -1,18 +1,108 @@
+import csv
 import os
-from utils.api_client import APIClient
+import datetime
+import asyncio
+import logging
+from utils.api_client import get_api_client
+from utils.async_api_client import AsyncAPIClient, DEFAULT_CONCURRENCY, run_async
+from utils.multi_status import DEFAULT_CHUNK_SIZE, chunked, get_error_message, get_operation_location, map_multi_status
+from utils.preflight import DEFERRED_STATUS, split_online
+from utils.records import DispatchResult
+from utils.target_ingest import IngestReport, iter_targets
+from utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
 
 class YaraScanManager:
-    def __init__(self):
-        self.api_client = APIClient()
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.api_client = get_api_client(tenant_name)
         self.url_path = "/v3.0/response/endpoints/runYaraRules"
+        self.output_dir = "yara_scan_result"
+        self.task_id_output_file = "yara_scan_result/task_ids.txt"  # ✅ Task ID 輸出 TXT
+        self.chunk_size = DEFAULT_CHUNK_SIZE  # 每個 runYaraRules 請求包含的 Agent 數
+
+    def _build_item(self, agent_guid, options):
+        """產生 runYaraRules Request Body 中單一 Agent 的項目"""
+        item = dict(options)
+        item["agentGuid"] = agent_guid
+        return item
+
+    def _parse_item(self, agent_guid, options, item):
+        """將 207 回應中的單一項目轉換為 Agent 的掃描結果"""
+        response = DispatchResult(
+            agent_guid,
+            yara_rule=options.get("yaraRuleFileName", ""),
+            target_file_location=options.get("targetFileLocation", ""),
+            task_id="N/A",
+            task_url="N/A",
+        )
+        if isinstance(item, dict) and item.get("status") == 202:
+            task_url = get_operation_location(item)
+            if task_url:
+                return response.replace(task_id=task_url.split("/")[-1], task_url=task_url, status="Success")
+            return response.replace(status="Accepted")
+        return response.replace(status="Failed", error=get_error_message(item))
+
+    def _parse_batch_result(self, agent_guids, options, result):
+        """將 207 回應逐一對應回 Agent GUID，並印出該批次的摘要"""
+        responses = [self._parse_item(agent_guid, options, item)
+                     for agent_guid, item in map_multi_status(agent_guids, result)]
+        succeeded = sum(1 for r in responses if r["status"] == "Success")
+        print(f"📦 runYaraRules 批次完成：{succeeded}/{len(responses)} 台 Agent 成功下發")
+        return responses
+
+    def dispatch_batch(self, agent_guids, options):
+        """
+        以單一請求對多台 Agent 執行 YARA 掃描（207 Multi-Status）
+        :param agent_guids: Agent GUID 列表（建議不超過 `chunk_size`）
+        :param options: 掃描參數（yaraRuleFileName、targetFileLocation 等，不含 agentGuid）
+        :return: 與 `agent_guids` 同順序的掃描結果列表
+        """
+        payload = [self._build_item(guid, options) for guid in agent_guids]
+        result = self.api_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_batch_result(agent_guids, options, result)
+
+    async def dispatch_batch_async(self, async_client, agent_guids, options):
+        """
+        `dispatch_batch` 的非同步版本
+        :param async_client: AsyncAPIClient
+        """
+        payload = [self._build_item(guid, options) for guid in agent_guids]
+        result = await async_client.send_request("POST", self.url_path, data=payload)
+        return self._parse_batch_result(agent_guids, options, result)
 
-    def run_yara_scan(self, payload: dict):
+    async def scan_agents_async(self, agent_guids, options, concurrency=DEFAULT_CONCURRENCY, chunk_size=None):
+        """
+        對 Agent GUID 列表執行 YARA 掃描（不匯出檔案）
+        Agent 依 `chunk_size` 打包成 207 批次請求，各批次同時送出
+        :param agent_guids: Agent GUID 列表
+        :param options: 掃描參數（不含 agentGuid）
+        :param concurrency: 同時進行的批次請求數上限
+        :param chunk_size: 每個請求包含的 Agent 數，未指定時使用 `self.chunk_size`
+        :return: 與 `agent_guids` 同順序的掃描結果列表
+        """
+        chunk_size = chunk_size or self.chunk_size
+        async with AsyncAPIClient(self.api_client.tenant_name, concurrency) as async_client:
+            batches = await asyncio.gather(*[
+                self.dispatch_batch_async(async_client, chunk, options)
+                for chunk in chunked(agent_guids, chunk_size)
+            ])
+        return [response for batch in batches for response in batch]
+
+    def run_yara_scan(self, payload: dict, concurrency=DEFAULT_CONCURRENCY, chunk_size=None, preflight=False):
         """
         執行 YARA 掃描任務（支援多個 endpoint）
+        Agent 依 `chunk_size` 分批送出，各批次同時進行，並匯出每台 Agent 的 Task ID
         :param payload: dict，包含 agentGuids list 及其他掃描參數
+        :param concurrency: 同時進行的批次請求數上限
+        :param chunk_size: 每個請求包含的 Agent 數，未指定時使用 `self.chunk_size`
+        :param preflight: 只下發給 EDR Sensor 在線的 Agent，離線的 Agent 寫入延後清單
+        :return: {"data": 掃描結果列表, "csv_path": CSV 路徑, "task_id_path": Task ID 檔案路徑,
+                  "deferred_path": 延後清單路徑}，失敗時回傳 None
         """
-        import json
-
         if not payload or not isinstance(payload, dict):
             print("❌ 傳入的 payload 不是有效的字典格式。")
             return None
@@ -22,93 +112,87 @@ class YaraScanManager:
             print("❌ payload 中缺少有效的 'agentGuids' 列表。")
             return None
 
-        print("🚀 即將送出 YARA Scan Request：")
-        print(payload)
-
-        # 拆解成符合 API 要求的 list 格式，每個 agentGuid 對應一份 payload
-        payload_copy = payload.copy()
-        payload_copy.pop("agentGuids", None)
-        request_body = []
-        for guid in agent_guids:
-            item = payload_copy.copy()
-            item["agentGuid"] = guid
-            request_body.append(item)
-
-        print("🚀 即將送出的 Request Payload:")
-        print(json.dumps(request_body, indent=2, ensure_ascii=False))
-
-        headers = self.api_client.headers
-
-        import pprint
-        print("📤 Headers to send:")
-        pprint.pprint(headers)
-
-        print("📤 Payload to send (JSON body):")
-        pprint.pprint(request_body)
-
-        try:
-            response = self.api_client.send_request(
-                "POST",
-                self.url_path,
-                data=request_body
-            )
-
-            import pprint
-
-            # 列印回應 Headers（標準化）
-            response_headers = {}
-            if hasattr(response, 'headers'):
-                response_headers = dict(response.headers)
-            elif isinstance(response, dict) and 'headers' in response:
-                response_headers = response['headers']
-            print("📥 回應 Headers:")
-            if isinstance(response_headers, dict):
-                for k, v in response_headers.items():
-                    print(f"🔸 {k}: {v}")
-            else:
-                print("⚠️ 無法讀取 Headers")
-
-            # 處理回傳結果內容
-            if hasattr(response, 'json'):
-                try:
-                    result = response.json()
-                except Exception:
-                    result = response.text
-            else:
-                result = response if isinstance(response, (dict, list)) else None
-
-            # response_headers 已於上方取得
-
-            # 印出回傳的資料內容
-            print("📦 API 回傳結果:", result)
-
-        except Exception as e:
-            print(f"❌ 發送 YARA API 時發生錯誤: {e}")
+        # 檢查格式並去除重複的 GUID，每個 agentGuid 對應一個項目
+        report = IngestReport()
+        agent_guids = list(iter_targets(agent_guids, report=report))
+        report.print_report()
+        if not agent_guids:
+            print("❌ 沒有有效的 Agent GUID")
             return None
+        options = {k: v for k, v in payload.items() if k != "agentGuids"}
 
-        if result is None:
-            print("❌ 無法執行 YARA 掃描，請檢查 API 權限或參數設定")
-            return None
+        deferred, deferred_path = [], None
+        if preflight:
+            agent_guids, offline, deferred_path = split_online(agent_guids, self.api_client.tenant_name, "yaraScan")
+            deferred = [self._parse_item(guid, options, None).replace(status=DEFERRED_STATUS, error=reason)
+                        for guid, reason in offline.items()]
 
-        if isinstance(result, dict) and "error" in result:
-            print(f"❌ API 回傳錯誤: {result['error']}")
-            return None
+        logger.info("送出 YARA 掃描：%s @ %s，共 %d 台 Agent", payload.get("yaraRuleFileName"),
+                    payload.get("targetFileLocation"), len(agent_guids))
+
+        results = run_async(self.scan_agents_async(agent_guids, options, concurrency, chunk_size)) + deferred
+        logger.debug("YARA 掃描結果: %s", results)
+
+        succeeded = sum(1 for r in results if r["status"] == "Success")
+        if not succeeded:
+            print("❌ 無法執行 YARA 掃描，請檢查 API 權限或參數設定")
+        else:
+            print(f"✅ YARA 任務發出成功：{succeeded}/{len(results)} 台 Agent")
 
-        print("✅ YARA 任務發出成功")
+        task_ids = [r["task_id"] for r in results if r["task_id"] != "N/A"]
         return {
-            "data": result,
-            "headers": response_headers
+            "data": results,
+            "csv_path": self.export_results(results),
+            "task_id_path": self.export_task_ids(task_ids),
+            "deferred_path": deferred_path
         }
 
+    def export_results(self, results):
+        """將掃描結果匯出至 CSV"""
+        if not results:
+            print("❌ 沒有可匯出的結果")
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = os.path.join(self.output_dir, f"result_{timestamp}.csv")
+
+        with open(filename, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Agent GUID", "YARA Rule", "Target File Location", "Task ID", "Task URL", "Status",
+                             "Error"])
+            for result in results:
+                writer.writerow([result["agent_guid"], result["yara_rule"], result["target_file_location"],
+                                 result["task_id"], result["task_url"], result["status"], result.get("error", "")])
+
+        print(f"✅ 掃描結果已成功匯出至 {filename}")
+        return filename
+
+    def export_task_ids(self, task_ids):
+        """✅ 將 Task ID 存入 `task_ids.txt`"""
+        if not task_ids:
+            print("❌ 沒有可匯出的 Task ID")
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        with open(self.task_id_output_file, "w", encoding="utf-8") as file:
+            for task_id in task_ids:
+                file.write(f"{task_id}\n")
+
+        print(f"✅ Task IDs 已成功匯出至 {self.task_id_output_file}")
+        return self.task_id_output_file
+
 if __name__ == "__main__":
+    setup_logging()
     runner = YaraScanManager()
     print("請依序輸入以下資訊：")
-    agent_guid = input("Agent GUID: ").strip()
+    agent_guids = input("Agent GUID（多個以 , 分隔）: ").split(",")
     target_file_location = input("掃描檔案路徑（例如：C:\\Users\\test\\Downloads）: ").strip()
     yara_rule_filename = input("請輸入 YARA rule 檔案名稱（例如：xxx.yara）: ").strip()
 
     payload = {
-        "agentGuids": [agent_guid],
+        "agentGuids": agent_guids,
         "target": "File",
         "targetFileLocation": target_file_location,
         "targetFileSize": "1M",
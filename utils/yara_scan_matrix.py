@@ -0,0 +1,163 @@
+import asyncio
+import csv
+import datetime
+import os
+from utils.async_api_client import AsyncAPIClient, DEFAULT_CONCURRENCY, run_async
+from utils.multi_status import chunked
+from utils.target_ingest import iter_targets, read_targets
+from utils.yara_rule_run import YaraScanManager
+from utils.log import setup_logging
+
+DEFAULT_SCAN_OPTIONS = {
+    "target": "File",
+    "targetFileSize": "1M",
+    "targetFileOption": "SCAN_ALL",
+    "description": "Run YARA rule task"
+}
+
+
+def _unique(values):
+    """去除空白與重複值並保留順序"""
+    return [v for v in dict.fromkeys((v or "").strip() for v in values) if v]
+
+
+class YaraScanMatrixManager:
+    """
+    YARA 規則 × 掃描路徑 × Agent 的掃描矩陣
+
+    規則、路徑與 Agent 會先去除重複，再展開成 (規則, 路徑) 的格子；
+    每個格子的 Agent 依 `chunk_size` 打包成 207 批次請求，所有格子的批次共用同一個並行上限同時送出。
+    """
+
+    def __init__(self, tenant_name=None):
+        """
+        :param tenant_name: Tenant 名稱，未指定時使用 Active Tenant
+        """
+        self.scan_manager = YaraScanManager(tenant_name)
+        self.output_dir = self.scan_manager.output_dir
+
+    @staticmethod
+    def expand(rules, paths, agent_guids):
+        """
+        去除重複並展開掃描矩陣（格式錯誤的 Agent GUID 會被略過）
+        :return: ((規則, 路徑) 格子列表, 去除重複後的 Agent GUID 列表)
+        """
+        cells = [(rule, path) for rule in _unique(rules) for path in _unique(paths)]
+        return cells, list(iter_targets(agent_guids))
+
+    @staticmethod
+    def new_progress(cells, agent_count):
+        """建立進度矩陣：{(規則, 路徑): {"total", "done", "success", "failed"}}"""
+        return {cell: {"total": agent_count, "done": 0, "success": 0, "failed": 0} for cell in cells}
+
+    async def run_matrix_async(self, rules, paths, agent_guids, options=None, concurrency=DEFAULT_CONCURRENCY,
+                               chunk_size=None, on_progress=None):
+        """
+        執行掃描矩陣（不匯出檔案）
+        :param rules: YARA 規則檔案名稱列表
+        :param paths: 掃描路徑（targetFileLocation）列表
+        :param agent_guids: Agent GUID 列表
+        :param options: 其他掃描參數，未指定的欄位使用 DEFAULT_SCAN_OPTIONS
+        :param concurrency: 同時進行的批次請求數上限
+        :param chunk_size: 每個請求包含的 Agent 數，未指定時使用 `YaraScanManager.chunk_size`
+        :param on_progress: 每個批次完成時呼叫 `on_progress(progress)`，progress 為進度矩陣
+        :return: (每個 規則 × 路徑 × Agent 一筆的掃描結果列表, 進度矩陣)
+        """
+        cells, agent_guids = self.expand(rules, paths, agent_guids)
+        progress = self.new_progress(cells, len(agent_guids))
+        if not cells or not agent_guids:
+            print("❌ 規則、路徑與 Agent 皆至少需要一個")
+            return [], progress
+
+        base_options = dict(DEFAULT_SCAN_OPTIONS, **(options or {}))
+        chunk_size = chunk_size or self.scan_manager.chunk_size
+        print(f"🚀 YARA 掃描矩陣：{len(cells)} 個 (規則, 路徑) × {len(agent_guids)} 台 Agent")
+
+        async def run_chunk(async_client, cell, chunk):
+            rule, path = cell
+            cell_options = dict(base_options, yaraRuleFileName=rule, targetFileLocation=path)
+            responses = await self.scan_manager.dispatch_batch_async(async_client, chunk, cell_options)
+            # 在 event loop 執行緒中更新，不需加鎖
+            counts = progress[cell]
+            counts["done"] += len(responses)
+            counts["success"] += sum(1 for r in responses if r["status"] == "Success")
+            counts["failed"] += sum(1 for r in responses if r["status"] == "Failed")
+            if on_progress:
+                on_progress(progress)
+            return responses
+
+        async with AsyncAPIClient(self.scan_manager.api_client.tenant_name, concurrency) as async_client:
+            batches = await asyncio.gather(*[
+                run_chunk(async_client, cell, chunk)
+                for cell in cells
+                for chunk in chunked(agent_guids, chunk_size)
+            ])
+        return [response for batch in batches for response in batch], progress
+
+    def run_matrix(self, rules, paths, agent_guids, options=None, concurrency=DEFAULT_CONCURRENCY, chunk_size=None,
+                   on_progress=None):
+        """
+        執行掃描矩陣，並匯出結果 CSV、進度矩陣 CSV 與 Task ID
+        :return: {"data": 掃描結果列表, "progress": 進度矩陣, "csv_path", "matrix_path", "task_id_path"}
+        """
+        results, progress = run_async(self.run_matrix_async(rules, paths, agent_guids, options, concurrency,
+                                                            chunk_size, on_progress))
+        task_ids = [r["task_id"] for r in results if r["task_id"] != "N/A"]
+        return {
+            "data": results,
+            "progress": progress,
+            "csv_path": self.scan_manager.export_results(results),
+            "matrix_path": self.export_matrix(progress),
+            "task_id_path": self.scan_manager.export_task_ids(task_ids)
+        }
+
+    @staticmethod
+    def matrix_rows(progress):
+        """將進度矩陣轉為表格列（每個 規則 × 路徑 一列）"""
+        return [
+            {"yara_rule": rule, "target_file_location": path, **counts}
+            for (rule, path), counts in progress.items()
+        ]
+
+    @staticmethod
+    def format_progress(progress):
+        """將進度矩陣轉為文字（規則為列、路徑為欄，格子內容為 成功/總數）"""
+        rules = list(dict.fromkeys(rule for rule, _ in progress))
+        paths = list(dict.fromkeys(path for _, path in progress))
+        lines = ["\t".join(["YARA Rule"] + paths)]
+        for rule in rules:
+            cells = [f"{progress[(rule, path)]['success']}/{progress[(rule, path)]['total']}" for path in paths]
+            lines.append("\t".join([rule] + cells))
+        return "\n".join(lines)
+
+    def export_matrix(self, progress):
+        """將進度矩陣匯出至 CSV"""
+        if not progress:
+            print("❌ 沒有可匯出的掃描矩陣")
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = os.path.join(self.output_dir, f"matrix_{timestamp}.csv")
+
+        with open(filename, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["YARA Rule", "Target File Location", "Agents", "Done", "Success", "Failed"])
+            for (rule, path), counts in progress.items():
+                writer.writerow([rule, path, counts["total"], counts["done"], counts["success"], counts["failed"]])
+
+        print(f"✅ 掃描矩陣已成功匯出至 {filename}")
+        return filename
+
+
+if __name__ == "__main__":
+    setup_logging()
+    manager = YaraScanMatrixManager()
+
+    rules = input("YARA rule 檔案名稱（多個以 , 分隔）: ").split(",")
+    paths = input("掃描檔案路徑（多個以 ; 分隔）: ").split(";")
+    agent_file = input("請輸入包含 Agent GUIDs 的 txt 檔案路徑: ").strip()
+    agent_guids, _ = read_targets(agent_file)
+
+    result = manager.run_matrix(rules, paths, agent_guids or [])
+    print(manager.format_progress(result["progress"]))